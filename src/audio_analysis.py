@@ -0,0 +1,201 @@
+import time
+import logging
+import argparse
+import numpy as np
+
+import metrics
+from metrics import log
+
+# Level and spectrum of the app_sink samples of basic-tutorial-8.py, a cheap
+# replacement of the wavescope branch for headless deployments.
+#
+# The samples are collected per channel into a preallocated block of one
+# emit period, a whole number of hops. Once the block is full, everything is
+# computed for all the channels and frames of the block at once: RMS and
+# peak over the period, and the power spectrum of the Hann windowed frames,
+# every hop samples, averaged over the period and decimated into log-spaced
+# bands. The last window - hop samples stay in front of the next block, so the
+# frames overlap across periods too.
+#
+#     analyzer = AudioAnalyzer(window=2048, hop=1024, bands=32, emit_rate=10, callback=on_analysis)
+#     data = CustomData(sample_callback=analyzer.consume)
+#
+# on_analysis(result) then runs emit_rate times per second of media, with
+# result.rms and result.peak in dBFS per channel and result.spectrum in dB,
+# shaped (channels, bands), with the band edges in result.frequencies.
+#
+#     python3 audio_analysis.py --channels 1 8 32 --rate 48000
+
+# Nanoseconds per second, for the PTS of the results
+SECOND = 1000000000
+# Floor of the levels, in dB
+SILENCE = -120.0
+
+class AnalysisResult():
+
+    def __init__(self, pts, duration, rms, peak, spectrum, frequencies):
+        self.pts = pts
+        self.duration = duration
+        self.rms = rms
+        self.peak = peak
+        self.spectrum = spectrum
+        # bands + 1 edges in Hz
+        self.frequencies = frequencies
+
+def to_db(power):
+    return np.maximum(10.0 * np.log10(np.maximum(power, 1e-30)), SILENCE)
+
+def band_edges(window, rate, bands):
+    # Bin indices where log-spaced bands start, from the first bin above DC, merging bands narrower than a bin
+    bins = window // 2 + 1
+    edges = np.unique(np.geomspace(1, bins, bands + 1).astype(np.int64))
+    edges[-1] = bins
+    return edges[:-1], edges * rate / window
+
+class AudioAnalyzer():
+
+    def __init__(self, window=2048, hop=1024, bands=32, emit_rate=10.0, callback=None):
+        if hop > window:
+            raise ValueError('the hop ({}) can not be longer than the window ({})'.format(hop, window))
+        self.window = window
+        self.hop = hop
+        self.bands = bands
+        self.emit_rate = emit_rate
+        self.callback = callback or self.log_result
+
+        self.rate = None
+        self.channels = None
+        self.results = 0
+        self.cpu_time = 0.0
+        self._format = None
+
+    def configure(self, rate, channels):
+        self.rate = rate
+        self.channels = channels
+        # The period is a whole number of hops, so that it holds a whole number of frames
+        hops = max(1, int(round(rate / self.emit_rate / self.hop)))
+        self.period = hops * self.hop
+        self.overlap = self.window - self.hop
+        self._block = np.zeros((channels, self.overlap + self.period), dtype=np.float32)
+        self._filled = self.overlap
+        self._taper = np.hanning(self.window).astype(np.float32)
+        # Power of a full scale sine through the window, so that the band holding it reads 0dB
+        sine = np.fft.rfft(self._taper * np.sin(2 * np.pi * (self.window // 8) * np.arange(self.window) / self.window))
+        self._reference = float((np.abs(sine) ** 2).sum())
+        self._band_starts, self.frequencies = band_edges(self.window, rate, self.bands)
+        self._base_pts = None
+        self._analyzed = 0
+        log.info('analyzing {} channels at {}Hz: {} frames of {} samples per {:.1f}ms period, {} bands'.format(
+            channels, rate, hops, self.window, self.period * 1e3 / rate, len(self._band_starts)))
+
+    def consume(self, view):
+        # A sample_callback for basic-tutorial-8.py, taking the SampleView of app_sink
+        if view.format is not self._format:
+            self._format = view.format
+            if view.format.rate != self.rate or view.format.channels != self.channels:
+                self.configure(view.format.rate, view.format.channels)
+        self.feed(view.data, view.pts, view.format.interleaved)
+
+    def feed(self, data, pts=None, interleaved=True):
+        # data is (samples,), interleaved (samples, channels) or planar (channels, samples), integer samples are scaled to [-1, 1)
+        start = time.process_time()
+        if self._base_pts is None:
+            self._base_pts = pts if pts is not None and 0 <= pts < 2 ** 63 else 0
+        if data.dtype.kind in 'iu':
+            scale = np.float32(1.0 / 2 ** (8 * data.dtype.itemsize - 1))
+            offset = np.float32(1.0) if data.dtype.kind == 'u' else np.float32(0.0)
+        else:
+            scale, offset = np.float32(1.0), np.float32(0.0)
+        # (channels, samples) either way
+        samples = data.reshape(len(data), -1).T if interleaved else data.reshape(-1, data.shape[-1])
+
+        position = 0
+        total = samples.shape[1]
+        while position < total:
+            count = min(total - position, self._block.shape[1] - self._filled)
+            block = self._block[:, self._filled:self._filled + count]
+            np.multiply(samples[:, position:position + count], scale, out=block, casting='unsafe')
+            if offset:
+                block -= offset
+            self._filled += count
+            position += count
+            if self._filled == self._block.shape[1]:
+                self.analyze()
+        self.cpu_time += time.process_time() - start
+
+    def analyze(self):
+        block = self._block
+        period = block[:, self.overlap:]
+        mean_square = np.einsum('ij,ij->i', period, period) / self.period
+        peak = np.abs(period).max(axis=1)
+
+        # (channels, frames, window) views of the block, one frame every hop samples
+        frames = np.lib.stride_tricks.sliding_window_view(block, self.window, axis=1)[:, ::self.hop]
+        spectrum = np.fft.rfft(frames * self._taper, axis=-1)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2).mean(axis=1)
+        bands = np.add.reduceat(power, self._band_starts, axis=-1)
+
+        pts = self._base_pts + self._analyzed * SECOND // self.rate
+        self._analyzed += self.period
+        # Keep the end of the block for the frames overlapping the next period
+        if self.overlap:
+            block[:, :self.overlap] = block[:, -self.overlap:]
+        self._filled = self.overlap
+
+        self.results += 1
+        self.callback(AnalysisResult(pts, self.period * SECOND // self.rate, to_db(mean_square), to_db(peak * peak),
+                                     to_db(bands / self._reference), self.frequencies))
+
+    def log_result(self, result):
+        for channel in range(len(result.rms)):
+            metrics.REGISTRY.gauge('audio_rms_dbfs', 'RMS level of the last analysis period', channel=str(channel)).set(float(result.rms[channel]))
+            metrics.REGISTRY.gauge('audio_peak_dbfs', 'Peak level of the last analysis period', channel=str(channel)).set(float(result.peak[channel]))
+        # Logged about once per second of media, the gauges are updated every period
+        if self.results % max(1, int(round(self.rate / self.period))) and not log.isEnabledFor(logging.DEBUG):
+            return
+        loudest = int(result.spectrum[0].argmax())
+        log.info('{:.2f}s rms {:.1f}dBFS peak {:.1f}dBFS, loudest band {:.0f}-{:.0f}Hz'.format(
+            result.pts / SECOND, float(result.rms.max()), float(result.peak.max()),
+            result.frequencies[loudest], result.frequencies[loudest + 1]))
+
+    def report(self):
+        if self.rate is None or self._analyzed == 0:
+            return
+        media = self._analyzed / self.rate
+        print('analyzed {:.1f}s of {} channels in {} periods, {:.3f}s of CPU, {:.1f}x realtime'.format(
+            media, self.channels, self.results, self.cpu_time, media / self.cpu_time if self.cpu_time else float('inf')))
+
+def bench(channel_counts, rate, seconds, chunk, window, hop, bands, emit_rate):
+    print('{:>8} {:>10} {:>12} {:>10}'.format('channels', 'media s', 'CPU s', 'realtime'))
+    for channels in channel_counts:
+        # A tone per channel over noise, as interleaved S16LE like app_sink delivers
+        t = np.arange(chunk * 64) / rate
+        tones = 0.5 * np.sin(2 * np.pi * np.outer(t, 220.0 * (1 + np.arange(channels))))
+        noise = np.random.default_rng(0).normal(0, 0.05, tones.shape)
+        pattern = np.clip((tones + noise) * 32767, -32768, 32767).astype('<i2')
+        results = []
+        analyzer = AudioAnalyzer(window, hop, bands, emit_rate, results.append)
+        analyzer.configure(rate, channels)
+        total = int(seconds * rate)
+        fed = 0
+        while fed < total:
+            offset = fed % len(pattern)
+            data = pattern[offset:offset + chunk]
+            analyzer.feed(data, fed * SECOND // rate)
+            fed += len(data)
+        print('{:>8} {:>10.1f} {:>12.3f} {:>9.1f}x'.format(channels, fed / rate, analyzer.cpu_time, fed / rate / analyzer.cpu_time))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='how fast the analysis runs on one core, per channel count')
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2, 8, 32])
+    parser.add_argument('--rate', type=int, default=48000)
+    parser.add_argument('--seconds', type=float, default=30.0, help='seconds of audio to analyze')
+    parser.add_argument('--chunk', type=int, default=1024, help='samples per buffer')
+    parser.add_argument('--window', type=int, default=2048)
+    parser.add_argument('--hop', type=int, default=1024)
+    parser.add_argument('--bands', type=int, default=32)
+    parser.add_argument('--emit-rate', type=float, default=10.0, help='results per second of audio')
+    args = parser.parse_args()
+
+    metrics.configure_logging()
+    bench(args.channels, args.rate, args.seconds, args.chunk, args.window, args.hop, args.bands, args.emit_rate)
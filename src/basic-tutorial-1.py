@@ -1,8 +1,13 @@
 
 import sys
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+import logging
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+
+import metrics
+from metrics import log
+import media_cache
 
 def get_message_from_bus(gst_bus):
     return gst_bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.ANY)
@@ -13,11 +18,21 @@ if __name__ == '__main__':
 
     # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
     print('initializing Gst...')
-    Gst.init(None)
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics.serve_from_env()
+
+    # Play a local copy of the media, downloaded into the cache on the first run
+    print('resolving the media uri...')
+    try:
+        uri = media_cache.resolve_uri(media_cache.SINTEL_TRAILER_URI)
+    except media_cache.CacheError as error:
+        print(error)
+        sys.exit(1)
 
     # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.parse_launch
     print('building a pipeline...')
-    gst_element = Gst.parse_launch("playbin uri=https://www.freedesktop.org/software/gstreamer-sdk/data/media/sintel_trailer-480p.webm video-sink=glimagesink")
+    gst_element = Gst.parse_launch("playbin uri={} video-sink=glimagesink".format(uri))
     if gst_element == None:
         print('failed to build a pipeline')
         sys.exit(1)
@@ -41,7 +56,10 @@ if __name__ == '__main__':
                 print('failed to get a message')
                 break
             else:
-                print('a message {} was found'.format(gst_message.type))
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/flags.html#Gst.MessageType.get_name
+                metrics.count_bus_message(Gst.MessageType.get_name(gst_message.type))
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug('a message {} was found'.format(gst_message.type))
 
 
     # set state NULL
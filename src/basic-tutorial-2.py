@@ -1,7 +1,10 @@
 import sys
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+
+import metrics
+from metrics import log
 
 if __name__ == '__main__':
     pipeline = None
@@ -9,7 +12,9 @@ if __name__ == '__main__':
 
     # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
     print('initializing Gst...')
-    Gst.init(None)
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics.serve_from_env()
 
     # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/ElementFactory.html#Gst.ElementFactory.make
     print('creating elements...')
@@ -56,13 +61,15 @@ if __name__ == '__main__':
     if gst_message is not None:
 
         message_type = gst_message.type
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/flags.html#Gst.MessageType.get_name
+        metrics.count_bus_message(Gst.MessageType.get_name(message_type))
         if message_type == Gst.MessageType.ERROR:
             gerror, debug = gst_message.parse_error()
-            print('error {} happened at {}'.format(gerror.message, debug))
+            log.error('error {} happened at {}'.format(gerror.message, debug))
         elif message_type == Gst.MessageType.EOS:
-            print('EOS reached')
+            log.info('EOS reached')
         else:
-            print('this should not happen, the received message type is unexpectedly {}'.format(message_type))
+            log.warning('this should not happen, the received message type is unexpectedly {}'.format(message_type))
 
     # set state NULL
     # call unref(), but which will leave many CRITICAL error messages as follows...
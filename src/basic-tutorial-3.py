@@ -1,7 +1,12 @@
 import sys
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+import logging
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+
+import metrics
+from metrics import log
+import media_cache
 
 class CustomData():
 
@@ -51,10 +56,10 @@ class CustomData():
         print('successfully build a pipeline')
         return True
 
-    def setup_source(self):
+    def setup_source(self, uri):
         # https://lazka.github.io/pgi-docs/#GObject-2.0/classes/Object.html#GObject.Object.set_property
         print('modifying the source properties...')
-        self._source.set_property('uri', 'https://www.freedesktop.org/software/gstreamer-sdk/data/media/sintel_trailer-480p.webm')
+        self._source.set_property('uri', uri)
         # https://lazka.github.io/pgi-docs/#GObject-2.0/classes/Object.html#GObject.Object.connect
         print('connecting to the pad-added signal...')
         self._source.connect("pad-added", self.pad_added_handler)
@@ -126,21 +131,24 @@ class CustomData():
             if gst_message is not None:
 
                 message_type = gst_message.type
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/flags.html#Gst.MessageType.get_name
+                metrics.count_bus_message(Gst.MessageType.get_name(message_type))
                 if message_type == Gst.MessageType.ERROR:
                     gerror, debug = gst_message.parse_error()
-                    print('error {} happened at {}'.format(gerror.message, debug))
+                    log.error('error {} happened at {}'.format(gerror.message, debug))
                     terminated = True
                 elif message_type == Gst.MessageType.EOS:
-                    print('EOS reached')
+                    log.info('EOS reached')
                     terminated = True
                 elif message_type == Gst.MessageType.STATE_CHANGED:
                     # We are only interested in state-changed messages from the pipeline
-                    print('received a state change message {} from {}'.format(message_type, gst_message.src))
-                    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Message.html#Gst.Message.parse_state_changed
-                    oldState, newState, pending = gst_message.parse_state_changed()
-                    print('state changed from {} to {}'.format(oldState, newState))
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug('received a state change message {} from {}'.format(message_type, gst_message.src))
+                        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Message.html#Gst.Message.parse_state_changed
+                        oldState, newState, pending = gst_message.parse_state_changed()
+                        log.debug('state changed from {} to {}'.format(oldState, newState))
                 else:
-                    print('this should not happen, the received message type is unexpectedly {}'.format(message_type))
+                    log.warning('this should not happen, the received message type is unexpectedly {}'.format(message_type))
 
     def dispose(self):
         # not call unref(), but which will leave many CRITICAL error messages as follows...
@@ -156,7 +164,9 @@ if __name__ == '__main__':
     
     # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
     print('initializing Gst...')
-    Gst.init(None)
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics.serve_from_env()
 
     if not customData.create_pipeline():
         customData.dispose()
@@ -166,7 +176,16 @@ if __name__ == '__main__':
         customData.dispose()
         sys.exit(1)
 
-    customData.setup_source()
+    # Play a local copy of the media, downloaded into the cache on the first run
+    print('resolving the media uri...')
+    try:
+        uri = media_cache.resolve_uri(media_cache.SINTEL_TRAILER_URI)
+    except media_cache.CacheError as error:
+        print(error)
+        customData.dispose()
+        sys.exit(1)
+
+    customData.setup_source(uri)
 
     if not customData.play_pipeline():
         customData.dispose()
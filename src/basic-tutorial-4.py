@@ -1,12 +1,25 @@
 import sys
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+import time
+import logging
+import argparse
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst, GLib
+
+import metrics
+from metrics import log
+import media_cache
+from seek_engine import SeekEngine, SEEK_MODES
+
+# How the bus is listened to: polling with timed_pop_filtered, or a bus watch in a GLib main loop
+BUS_MODES = ('poll', 'watch')
 
 class CustomData():
 
-    def __init__(self):
+    def __init__(self, mode='poll', position_interval=100, seek_mode='key-unit', reaction_latency=False):
         self._playbin = None
+        self._seek_engine = None
+        self._seek_mode = seek_mode
         self._playing = False
         self._seek_enabled = False
         self._seek_done = False
@@ -16,6 +29,25 @@ class CustomData():
         self._bus = None
         self._current = None
 
+        self._mode = mode
+        # Position sampling interval in milliseconds
+        self._position_interval = position_interval
+        self._position_timer = 0
+        self._main_loop = None
+        # [position, callback, fired] entries checked at every position sample
+        self._position_thresholds = []
+        self.add_position_threshold(10 * Gst.SECOND, self.seek_once)
+
+        # Message seqnum -> time it was posted, for the ERROR/EOS reaction latency
+        # Off by default: it calls into Python for every message posted from every streaming thread
+        self._measure_reaction = reaction_latency
+        self._posted = {}
+        self._reaction_latency = {}
+        # Times the listening thread came back to Python, and how many of those had nothing to do
+        self._wakeups = 0
+        self._idle_wakeups = 0
+        self._listen_time = 0.0
+
     def create_pipeline(self):
         # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/ElementFactory.html#Gst.ElementFactory.make
         print('creating elements...')
@@ -26,12 +58,13 @@ class CustomData():
             return False
 
         print('successfully created a playbin')
+        self._seek_engine = SeekEngine(self._playbin)
         return True
 
-    def setup_source(self):
+    def setup_source(self, uri):
         # https://lazka.github.io/pgi-docs/#GObject-2.0/classes/Object.html#GObject.Object.set_property
         print('modifying the source properties...')
-        self._playbin.set_property('uri', 'https://www.freedesktop.org/software/gstreamer-sdk/data/media/sintel_trailer-480p.webm')
+        self._playbin.set_property('uri', uri)
         self._playbin.set_property('video-sink', Gst.ElementFactory.make("glimagesink", "glimagesink"))
 
     def play_pipeline(self):
@@ -48,84 +81,202 @@ class CustomData():
 
     def handle_message(self, gst_message):
         message_type = gst_message.type
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/flags.html#Gst.MessageType.get_name
+        metrics.count_bus_message(Gst.MessageType.get_name(message_type))
         if message_type == Gst.MessageType.ERROR:
             gerror, debug = gst_message.parse_error()
-            print('error {} happened at {}'.format(gerror.message, debug))
+            log.error('error {} happened at {}'.format(gerror.message, debug))
             self._terminate = True
         elif message_type == Gst.MessageType.EOS:
-            print('EOS reached')
+            log.info('EOS reached')
             self._terminate = True
         elif message_type == Gst.MessageType.DURATION_CHANGED:
-            print('duration changed')
+            log.debug('duration changed')
             # The duration has changed, mark the current one as invalid
             self._duration = Gst.CLOCK_TIME_NONE
+        elif message_type == Gst.MessageType.ASYNC_DONE or message_type == Gst.MessageType.SEGMENT_DONE:
+            # A seek finished, the seek engine may run the next one
+            self._seek_engine.handle_message(gst_message)
         elif message_type == Gst.MessageType.STATE_CHANGED:
             # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Message.html#Gst.Message.parse_state_changed
             oldState, newState, pending = gst_message.parse_state_changed()
             if gst_message.src == self._playbin:
-                print('playbin state changed from {} to {}'.format(oldState, newState))
+                log.info('playbin state changed from {} to {}'.format(oldState, newState))
                 self._playing = newState == Gst.State.PLAYING
 
+                if self._mode == 'watch':
+                    self.update_position_timer()
+
                 if self._playing:
                     #We just moved to PLAYING. Check if seeking is possible
-                    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.query
-                    query = Gst.Query.new_seeking(Gst.Format.TIME)
-                    if self._playbin.query(query):
-                        fmt, self._seek_enabled, start, end = query.parse_seeking()
-                        if self._seek_enabled:
-                            print('seeking is enabled')
-                        else:
-                            print('seeking is disabled')
+                    self._seek_enabled = self._seek_engine.query_seekable()
+                    if self._seek_enabled:
+                        log.info('seeking is enabled')
                     else:
-                        print('seeking query failed')
+                        log.info('seeking is disabled')
+        else:
+            log.warning('this should not happen, the received message type is unexpectedly {}'.format(message_type))
+
+    """
+    Calls callback(position) when the sampled position passes the given position.
+    The threshold stays armed until the callback returns True
+    """
+    def add_position_threshold(self, position, callback):
+        self._position_thresholds.append([position, callback, False])
+
+    def sample_position(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.query_position
+        # Query the current position of the stream
+        queried, self._current = self._playbin.query_position(Gst.Format.TIME)
+        if not queried:
+            print('can not get the current position')
+            return
+
+        if self._duration == Gst.CLOCK_TIME_NONE:
+            queried, self._duration = self._playbin.query_duration(Gst.Format.TIME)
+            if not queried:
+                print('can not get the duration')
+                return
+
+        # Runs on every position poll
+        if log.isEnabledFor(logging.INFO):
+            log.info('current position = {}, the duration = {}'.format(self._current, self._duration))
+
+        for threshold in self._position_thresholds:
+            position, callback, fired = threshold
+            if not fired and self._current > position:
+                threshold[2] = callback(self._current)
+
+    def seek_once(self, position):
+        # If seeking is enabled and we have not done it yet, seek
+        if not self._seek_enabled:
+            return False
+        if self._seek_done:
+            return True
+        print('reached 10s, performing {} seek...'.format(self._seek_mode))
+        if self._seek_engine.seek(30 * Gst.SECOND, self._seek_mode):
+            print('seek succeeded')
+            self._seek_done = True
         else:
-            print('this should not happen, the received message type is unexpectedly {}'.format(message_type))
+            print('seek failed')
+            self._seek_done = False
+        return self._seek_done
+
+    """
+    Runs in the thread posting the message, so it sees ERROR and EOS as soon as they are posted
+    """
+    def on_sync_message(self, bus, gst_message):
+        if gst_message.type & (Gst.MessageType.ERROR | Gst.MessageType.EOS):
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Message.html#Gst.Message.get_seqnum
+            self._posted[gst_message.get_seqnum()] = time.monotonic()
+
+    def record_reaction(self, gst_message):
+        if not self._posted:
+            return
+        posted = self._posted.pop(gst_message.get_seqnum(), None)
+        if posted is None:
+            return
+        latency = time.monotonic() - posted
+        type_name = Gst.MessageType.get_name(gst_message.type)
+        self._reaction_latency[type_name] = latency
+        metrics.REGISTRY.histogram('bus_reaction_seconds', 'Time from posting an ERROR/EOS to handling it',
+                                   mode=self._mode, type=type_name).observe(latency)
 
     def listen_to_bus(self):
 
         # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.get_bus
-        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.timed_pop_filtered
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.enable_sync_message_emission
         print('listening to the bus...')
         self._bus = self._playbin.get_bus()
+        if self._measure_reaction:
+            self._bus.enable_sync_message_emission()
+            sync_handler = self._bus.connect('sync-message', self.on_sync_message)
+
+        start = time.monotonic()
+        if self._mode == 'watch':
+            self.watch_bus()
+        else:
+            self.poll_bus()
+        self._listen_time = time.monotonic() - start
 
+        if self._measure_reaction:
+            self._bus.disconnect(sync_handler)
+            self._bus.disable_sync_message_emission()
+
+    def poll_bus(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.timed_pop_filtered
+        # The poll timeout doubles as the clock for position sampling
+        # Messages handled by handle_message
+        handled = (Gst.MessageType.STATE_CHANGED | Gst.MessageType.ERROR | Gst.MessageType.EOS | Gst.MessageType.DURATION_CHANGED |
+                   Gst.MessageType.ASYNC_DONE | Gst.MessageType.SEGMENT_DONE)
         while not self._terminate:
-            gst_message = self._bus.timed_pop_filtered(100 * Gst.MSECOND, Gst.MessageType.STATE_CHANGED | Gst.MessageType.ERROR | Gst.MessageType.EOS | Gst.MessageType.DURATION_CHANGED)
+            gst_message = self._bus.timed_pop_filtered(self._position_interval * Gst.MSECOND, handled)
+            self._wakeups += 1
 
             if gst_message is not None:
 
+                self.record_reaction(gst_message)
                 self.handle_message(gst_message)
 
             else:
 
                 # We got no message, this means the timeout expired
                 if self._playing:
+                    self.sample_position()
+                else:
+                    self._idle_wakeups += 1
+
+    def watch_bus(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.add_signal_watch
+        # Only the detailed signals of the handled messages call back into Python
+        self._bus.add_signal_watch()
+        handlers = [self._bus.connect('message::{}'.format(name), self.on_message)
+                    for name in ('error', 'eos', 'state-changed', 'duration-changed', 'async-done', 'segment-done')]
+
+        # https://lazka.github.io/pgi-docs/#GLib-2.0/classes/MainLoop.html#GLib.MainLoop
+        self._main_loop = GLib.MainLoop()
+        self._main_loop.run()
+
+        self.stop_position_timer()
+        for handler in handlers:
+            self._bus.disconnect(handler)
+        self._bus.remove_signal_watch()
+
+    def on_message(self, bus, gst_message):
+        self._wakeups += 1
+        self.record_reaction(gst_message)
+        self.handle_message(gst_message)
+        if self._terminate:
+            self._main_loop.quit()
 
-                    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.query_position
-                    # Query the current position of the stream
-                    queried, self._current = self._playbin.query_position(Gst.Format.TIME)
-                    if not queried:
-                        print('can not get the current position')
-                        continue
-
-                    if self._duration == Gst.CLOCK_TIME_NONE:
-                        queried, self._duration = self._playbin.query_duration(Gst.Format.TIME)
-                        if not queried:
-                            print('can not get the duration')
-                            continue
-
-                    print('current position = {}, the duration = {}'.format(self._current, self._duration))
-
-                    # If seeking is enabled, we have not done it yet, and the time is right, seek
-                    if self._seek_enabled and not self._seek_done and self._current > 10 * Gst.SECOND:
-                        print('reached 10s, performing seek...')
-                        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.seek_simple
-                        if self._playbin.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, 30 * Gst.SECOND):
-                            print('seek succeeded')
-                            self._seek_done = True
-                        else:
-                            print('seek failed')
-                            self._seek_done = False
+    def update_position_timer(self):
+        # The timer only runs while playing, so nothing wakes us up otherwise
+        if self._playing and self._position_timer == 0:
+            # https://lazka.github.io/pgi-docs/#GLib-2.0/functions.html#GLib.timeout_add
+            self._position_timer = GLib.timeout_add(self._position_interval, self.on_position_timer)
+        elif not self._playing:
+            self.stop_position_timer()
 
+    def stop_position_timer(self):
+        if self._position_timer != 0:
+            # https://lazka.github.io/pgi-docs/#GLib-2.0/functions.html#GLib.source_remove
+            GLib.source_remove(self._position_timer)
+            self._position_timer = 0
+
+    def on_position_timer(self):
+        self._wakeups += 1
+        self.sample_position()
+        return True
+
+    def report(self):
+        if self._listen_time <= 0:
+            return
+        print('bus mode {}: {} wakeups in {:.1f}s ({:.1f}/s), {} of them idle'.format(
+            self._mode, self._wakeups, self._listen_time, self._wakeups / self._listen_time, self._idle_wakeups))
+        for type_name, latency in self._reaction_latency.items():
+            print('bus mode {}: reacted to {} {:.3f}ms after it was posted'.format(self._mode, type_name, latency * 1000))
+        if self._seek_engine is not None:
+            self._seek_engine.report()
 
     def dispose(self):
         # not call unref(), but which will leave many CRITICAL error messages as follows...
@@ -133,23 +284,43 @@ class CustomData():
         print('disposing customData...')
         if self._playbin is None:
             return
+        self._seek_engine.close()
         self._playbin.set_state(Gst.State.NULL)
         #self._pipeline.unref()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=BUS_MODES, default='poll', help='poll the bus, or watch it from a GLib main loop')
+    parser.add_argument('--position-interval', type=int, default=100, help='position sampling interval in milliseconds')
+    parser.add_argument('--seek-mode', choices=sorted(SEEK_MODES), default='key-unit', help='how the seek to 30s snaps to keyframes')
+    parser.add_argument('--reaction-latency', action='store_true', help='measure the time from posting an ERROR/EOS to handling it, with a sync handler on every message')
+    args = parser.parse_args()
+
     print('declaring variables of classes inherits from Gst.Object that should be unreferenced')
     gst_bus = None
-    customData = CustomData()
+    customData = CustomData(mode=args.mode, position_interval=args.position_interval, seek_mode=args.seek_mode,
+                            reaction_latency=args.reaction_latency)
     
     # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
     print('initializing Gst...')
-    Gst.init(None)
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics.serve_from_env()
 
     if not customData.create_pipeline():
         customData.dispose()
         sys.exit(1)
 
-    customData.setup_source()
+    # Play a local copy of the media, downloaded into the cache on the first run
+    print('resolving the media uri...')
+    try:
+        uri = media_cache.resolve_uri(media_cache.SINTEL_TRAILER_URI)
+    except media_cache.CacheError as error:
+        print(error)
+        customData.dispose()
+        sys.exit(1)
+
+    customData.setup_source(uri)
 
     if not customData.play_pipeline():
         customData.dispose()
@@ -159,5 +330,6 @@ if __name__ == '__main__':
 
     print('disposing the customData...')
     customData.dispose()
+    customData.report()
 
     print('finished running a dynamic pipeline example')
\ No newline at end of file
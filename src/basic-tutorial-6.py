@@ -1,7 +1,11 @@
 import sys
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+import logging
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+
+import metrics
+from metrics import log
 
 def print_field(field_id, value):
     # https://lazka.github.io/pgi-docs/#Gst-1.0/callbacks.html#Gst.StructureForeachFunc
@@ -81,7 +85,9 @@ if __name__ == '__main__':
 
     # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
     print('initializing Gst...')
-    Gst.init(None)
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics.serve_from_env()
 
     # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/ElementFactory.html#Gst.ElementFactory.find
     print('finding element factories...')
@@ -144,12 +150,14 @@ if __name__ == '__main__':
         if gst_message is not None:
 
             message_type = gst_message.type
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/flags.html#Gst.MessageType.get_name
+            metrics.count_bus_message(Gst.MessageType.get_name(message_type))
             if message_type == Gst.MessageType.ERROR:
                 gerror, debug = gst_message.parse_error()
-                print('error {} happened at {}'.format(gerror.message, debug))
+                log.error('error {} happened at {}'.format(gerror.message, debug))
                 terminated = True
             elif message_type == Gst.MessageType.EOS:
-                print('EOS reached')
+                log.info('EOS reached')
                 terminated = True
             elif message_type == Gst.MessageType.STATE_CHANGED:
                 if gst_message.src == pipeline:
@@ -157,10 +165,10 @@ if __name__ == '__main__':
                     oldState, newState, pending = gst_message.parse_state_changed()
                     print('state changed from {} to {}'.format(oldState, newState))
                     print_pad_capabilities(sink, 'sink')
-                else:
-                    print('received a state change message {} from {}'.format(message_type, gst_message.src))
+                elif log.isEnabledFor(logging.DEBUG):
+                    log.debug('received a state change message {} from {}'.format(message_type, gst_message.src))
             else:
-                print('this should not happen, the received message type is unexpectedly {}'.format(message_type))
+                log.warning('this should not happen, the received message type is unexpectedly {}'.format(message_type))
 
 
     # set state NULL
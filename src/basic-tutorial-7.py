@@ -1,18 +1,41 @@
 import sys
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+import argparse
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+
+import metrics
+from metrics import log
+from queue_monitor import QueueMonitor
+from element_profiler import ElementProfiler
+from caps_negotiation import negotiate, report_converters
+from pipeline_graph import PipelineGraph
 
 # Pipelines with more than one sink usually need to be multithreaded, 
 # because, to be synchronized, sinks usually block execution until all other sinks are ready, 
 # and they cannot get ready if there is only one thread, being blocked by the first sink.
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queue-monitor', action='store_true', help='report the level and stall time of every queue')
+    parser.add_argument('--auto-tune-queues', action='store_true', help='grow the limits of overrunning queues, then make them leaky')
+    parser.add_argument('--negotiate', action='store_true', help='make the sources produce what the sinks take, and report the converters')
+    parser.add_argument('--profile', action='store_true', help='report the throughput and processing time of every element')
+    parser.add_argument('--profile-window', type=float, default=0.0, help='profile for this many seconds out of every --profile-period (default: always)')
+    parser.add_argument('--profile-period', type=float, default=10.0, help='seconds between the starts of two profile windows')
+    parser.add_argument('--graph', action='store_true', help='write the pipeline graph with its caps, rates and queue levels on SIGUSR1, and serve it next to the metrics')
+    args = parser.parse_args()
+
     pipeline = None
+    queue_monitor = None
+    profiler = None
+    graph = None
 
     # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
     print('initializing Gst...')
-    Gst.init(None)
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics_server = metrics.serve_from_env()
 
     # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/ElementFactory.html#Gst.ElementFactory.make
     print('creating elements...')
@@ -74,6 +97,15 @@ if __name__ == '__main__':
         pipeline.set_state(Gst.State.NULL)
         sys.exit(1)
 
+    if args.negotiate:
+        # Both branches take the audio as it comes out of audio_source, and wavescope draws what the video sink takes
+        negotiate(pipeline, audio_source)
+        negotiate(pipeline, visual, None, {'width': 320, 'height': 200, 'framerate': (25, 1)})
+
+    if args.queue_monitor or args.auto_tune_queues:
+        queue_monitor = QueueMonitor(pipeline, auto_tune=args.auto_tune_queues)
+        queue_monitor.start()
+
     # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.set_state
     print('start playing the pipeline...')
     gst_state_change_return = pipeline.set_state(Gst.State.PLAYING)
@@ -82,22 +114,47 @@ if __name__ == '__main__':
         pipeline.set_state(Gst.State.NULL)
         sys.exit(1)
 
+    # After the state change, so that the elements created inside autoaudiosink and autovideosink are found
+    if args.profile:
+        profiler = ElementProfiler(pipeline)
+        profiler.start(args.profile_window, args.profile_period)
+    if args.graph:
+        graph = PipelineGraph(pipeline, profiler)
+        graph.start()
+        graph.serve(metrics_server)
+        # The bus is polled below, not from a GLib main loop
+        graph.dump_on_signal(main_loop=False)
+
     # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.get_bus
     # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.timed_pop_filtered
     print('wait until error or EOS')
     gst_bus = pipeline.get_bus()
-    gst_message = gst_bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+    gst_message = None
+    try:
+        # Wait in short steps, so that Ctrl-C still disposes the pipeline and reports the queues
+        while gst_message is None:
+            gst_message = gst_bus.timed_pop_filtered(100 * Gst.MSECOND, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+    except KeyboardInterrupt:
+        gst_message = None
 
     if gst_message is not None:
 
         message_type = gst_message.type
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/flags.html#Gst.MessageType.get_name
+        metrics.count_bus_message(Gst.MessageType.get_name(message_type))
         if message_type == Gst.MessageType.ERROR:
             gerror, debug = gst_message.parse_error()
-            print('error {} happened at {}'.format(gerror.message, debug))
+            log.error('error {} happened at {}'.format(gerror.message, debug))
         elif message_type == Gst.MessageType.EOS:
-            print('EOS reached')
+            log.info('EOS reached')
         else:
-            print('this should not happen, the received message type is unexpectedly {}'.format(message_type))
+            log.warning('this should not happen, the received message type is unexpectedly {}'.format(message_type))
+
+    if args.negotiate:
+        report_converters(pipeline)
+    if graph is not None:
+        graph.dump()
+        graph.stop()
 
     # set state NULL
     # call unref(), but which will leave many CRITICAL error messages as follows...
@@ -106,4 +163,11 @@ if __name__ == '__main__':
     if pipeline is not None:
         pipeline.set_state(Gst.State.NULL)
 
+    if queue_monitor is not None:
+        queue_monitor.stop()
+        queue_monitor.report()
+    if profiler is not None:
+        profiler.stop()
+        profiler.report()
+
     print('finished running multithreading and pad availability example')
\ No newline at end of file
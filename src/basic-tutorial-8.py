@@ -1,21 +1,43 @@
 import sys
-import gi
-gi.require_version('Gst', '1.0')
-gi.require_version('GstAudio', '1.0')
-gi.require_version('GLib', '2.0')
-gi.require_version('GstApp', '1.0')
-from gi.repository import Gst, GstAudio, GLib, GstApp
+import time
+import argparse
+import logging
+import threading
+import numpy as np
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst, GstAudio, GLib, GstApp
+
+from waveform import WaveformGenerator, BYTES_PER_SAMPLE
+from buffer_pool import AppSrcBufferPool
+from sample_access import SampleConsumer, SampleFormat
+from queue_monitor import QueueMonitor
+from latency_tracer import LatencyTracer
+from element_profiler import ElementProfiler
+from tee_branches import TeeBranches
+from shm_ring import ShmRingPublisher
+from audio_analysis import AudioAnalyzer
+from caps_negotiation import negotiate, report_converters
+from pipeline_graph import PipelineGraph
+import metrics
+from metrics import log
 
 # Amount of bytes we are sending in each buffer
 CHUNK_SIZE = 1024
-# Samples per second we are sending
+# Samples per second we are sending, unless the sinks prefer another rate
 SAMPLE_RATE = 44100
+# What push_data can produce: the waveform in S16, copied to every channel
+PRODUCIBLE_CAPS = 'audio/x-raw, format=(string)S16LE, layout=(string)interleaved, rate=(int)[ 1, 2147483647 ], channels=(int)[ 1, 8 ]'
+# How appsrc is fed: from an idle handler in the main loop, or from a producer thread
+FEED_MODES = ('idle', 'thread')
 
 class CustomData():
 
-    def __init__(self):
+    def __init__(self, chunk_size=CHUNK_SIZE, pool_size=0, sample_callback=None, feed_mode='idle', max_bytes=0, headless=False):
 
         self.pipeline = None
+        # Without the wavescope branch, e.g. with the audio analysis on the app branch instead
+        self.headless = headless
 
         self.app_source = None
         self.tee = None
@@ -34,17 +56,52 @@ class CustomData():
 
         self.bus = None
 
+        # Amount of bytes we are sending in each buffer
+        self.chunk_size = chunk_size
         # Number of samples generated so far (for timestamp generation) 
         self.num_samples = 0
-        # For waveform generation
-        self.a = 0
-        self.b = 1
-        self.c = 0
-        self.d = 1
+        # Rate and channels of the app_source caps, set by configure_appsrc
+        self.sample_rate = SAMPLE_RATE
+        self.channels = 1
+        # The waveform of a buffer, before it is copied to every channel
+        self.mono = None
+        # For waveform generation, keeps its state across buffers
+        self.waveform = WaveformGenerator()
+        # Pre-allocated buffers recycled for appsrc, disabled when pool_size is 0
+        self.pool_size = pool_size
+        self.buffer_pool = None
+
+        # Hands the app_sink samples to sample_callback as read-only NumPy arrays
+        self.sample_callback = sample_callback or self.process_samples
+        self.sample_consumer = SampleConsumer(self.consume_samples)
 
         # To control the GSource
         self.sourceid = 0
 
+        # To control the producer thread, used instead of the GSource in the thread feed mode
+        self.feed_mode = feed_mode
+        # appsrc queue limit in bytes, 0 keeps the appsrc default
+        self.max_bytes = max_bytes
+        self.producer = None
+        # Tags the pushed buffers with their origin time when latency tracing is on
+        self.latency_tracer = None
+        self.need_data = threading.Event()
+        self.stopping = threading.Event()
+
+        # Feed statistics
+        registry = metrics.REGISTRY
+        self.buffers_pushed = registry.counter('appsrc_buffers_pushed_total', 'Buffers pushed into app_source')
+        self.bytes_pushed = registry.counter('appsrc_bytes_pushed_total', 'Bytes pushed into app_source')
+        self.push_latency = registry.histogram('appsrc_push_seconds', 'Time to generate and push one buffer')
+        self.feed_starts = registry.counter('appsrc_feed_starts_total', 'need-data signals received')
+        self.feed_stops = registry.counter('appsrc_feed_stops_total', 'enough-data signals received')
+        self.feeding = registry.gauge('appsrc_feeding', 'Whether app_source is being fed')
+        self.buffers_pulled = registry.counter('appsink_buffers_pulled_total', 'Samples pulled from app_sink')
+        self.bytes_pulled = registry.counter('appsink_bytes_pulled_total', 'Bytes pulled from app_sink')
+        self.pull_latency = registry.histogram('appsink_pull_seconds', 'Time to pull and consume one sample')
+        self.main_loop_cpu_time = 0.0
+        self.main_loop_wall_time = 0.0
+
         # GLib's Main Loop
         self.main_loop = None
 
@@ -60,11 +117,12 @@ class CustomData():
         self.audio_resample = Gst.ElementFactory.make("audioresample", "audio_resample")
         self.audio_sink = Gst.ElementFactory.make("autoaudiosink", "audio_sink")
 
-        self.video_queue = Gst.ElementFactory.make("queue", "video_queue")
-        self.audio_convert2 = Gst.ElementFactory.make("audioconvert", "audio_convert2")
-        self.visual = Gst.ElementFactory.make("wavescope", "visual")
-        self.video_convert = Gst.ElementFactory.make("videoconvert", "video_convert")
-        self.video_sink = Gst.ElementFactory.make("autovideosink", "video_sink")
+        if not self.headless:
+            self.video_queue = Gst.ElementFactory.make("queue", "video_queue")
+            self.audio_convert2 = Gst.ElementFactory.make("audioconvert", "audio_convert2")
+            self.visual = Gst.ElementFactory.make("wavescope", "visual")
+            self.video_convert = Gst.ElementFactory.make("videoconvert", "video_convert")
+            self.video_sink = Gst.ElementFactory.make("autovideosink", "video_sink")
 
         self.app_queue = Gst.ElementFactory.make("queue", "app_queue")
         self.app_sink = Gst.ElementFactory.make("appsink", "app_sink")
@@ -76,10 +134,13 @@ class CustomData():
         return not (
                 self.app_source is None or self.tee is None or \
                 self.audio_queue is None or self.audio_convert1 is None or self.audio_resample is None or self.audio_sink is None or \
-                self.video_queue is None or self.audio_convert2 is None or self.visual is None or self.video_convert is None or self.video_sink is None or \
+                (not self.headless and (self.video_queue is None or self.audio_convert2 is None or self.visual is None or \
+                    self.video_convert is None or self.video_sink is None)) or \
                 self.app_queue is None or self.app_sink is None or self.pipeline is None)
 
     def setup_wavescope(self):
+        if self.headless:
+            return
         # https://lazka.github.io/pgi-docs/#GObject-2.0/classes/Object.html#GObject.Object.set_property
         print('setting up wavescope...')
         self.visual.set_property('shader', 0)
@@ -90,12 +151,31 @@ class CustomData():
         print('configuring app_source...')
         
         self.app_source.set_property("caps", audio_caps)
+        audio_format = SampleFormat.from_caps(audio_caps)
+        self.sample_rate = audio_format.rate
+        self.channels = audio_format.channels
         # https://lazka.github.io/pgi-docs/#GstApp-1.0/classes/AppSrc.html#GstApp.AppSrc.props.format
         self.app_source.set_property("format", Gst.Format.TIME)
+        if self.max_bytes > 0:
+            # https://lazka.github.io/pgi-docs/#GstApp-1.0/classes/AppSrc.html#GstApp.AppSrc.props.max_bytes
+            self.app_source.set_property("max-bytes", self.max_bytes)
+        if self.feed_mode == 'thread':
+            # push-buffer blocks while the appsrc queue is full, so the producer thread
+            # can never run ahead of downstream
+            # https://lazka.github.io/pgi-docs/#GstApp-1.0/classes/AppSrc.html#GstApp.AppSrc.props.block
+            self.app_source.set_property("block", True)
+
+        if self.pool_size > 0:
+            print('pre-allocating {} buffers...'.format(self.pool_size))
+            frame_size = BYTES_PER_SAMPLE * self.channels
+            self.buffer_pool = AppSrcBufferPool(self.chunk_size // frame_size * frame_size, self.pool_size, audio_caps)
+            if not self.buffer_pool.start():
+                return False
 
         print('connecting to signals...')
         self.app_source.connect("need-data", self.start_feed)
         self.app_source.connect("enough-data", self.stop_feed)
+        return True
 
     def configure_appsink(self, audio_caps):
         
@@ -116,41 +196,54 @@ class CustomData():
         self.pipeline.add(self.audio_convert1)
         self.pipeline.add(self.audio_resample)
         self.pipeline.add(self.audio_sink)
-        self.pipeline.add(self.video_queue)
-        self.pipeline.add(self.audio_convert2)
-        self.pipeline.add(self.visual)
-        self.pipeline.add(self.video_convert)
-        self.pipeline.add(self.video_sink)
         self.pipeline.add(self.app_queue)
         self.pipeline.add(self.app_sink)
         if not self.app_source.link(self.tee) or not self.audio_queue.link(self.audio_convert1) or \
             not self.audio_convert1.link(self.audio_resample) or not self.audio_resample.link(self.audio_sink) or \
-            not self.video_queue.link(self.audio_convert2) or not self.audio_convert2.link(self.visual) or \
-            not self.visual.link(self.video_convert) or not self.video_convert.link(self.video_sink) or \
             not self.app_queue.link(self.app_sink):
             print('failed to link')
-            pipeline.set_state(Gst.State.NULL)
+            self.pipeline.set_state(Gst.State.NULL)
+            sys.exit(1)
+        if self.headless:
+            return
+        self.pipeline.add(self.video_queue)
+        self.pipeline.add(self.audio_convert2)
+        self.pipeline.add(self.visual)
+        self.pipeline.add(self.video_convert)
+        self.pipeline.add(self.video_sink)
+        if not self.video_queue.link(self.audio_convert2) or not self.audio_convert2.link(self.visual) or \
+            not self.visual.link(self.video_convert) or not self.video_convert.link(self.video_sink):
+            print('failed to link')
+            self.pipeline.set_state(Gst.State.NULL)
             sys.exit(1)
 
     def link_request_pads(self):
         print('linking request pads...')
         tee_audio_pad = self.tee.get_request_pad("src_%u")
         queue_audio_pad = self.audio_queue.get_static_pad("sink")
-        tee_video_pad = self.tee.get_request_pad("src_%u")
-        queue_video_pad = self.video_queue.get_static_pad("sink")
         tee_app_pad = self.tee.get_request_pad("src_%u")
         queue_app_pad = self.app_queue.get_static_pad("sink")
         if not tee_audio_pad.link(queue_audio_pad) == Gst.PadLinkReturn.OK \
-            or not tee_video_pad.link(queue_video_pad) == Gst.PadLinkReturn.OK \
             or not tee_app_pad.link(queue_app_pad) == Gst.PadLinkReturn.OK:
             print('tee could not be linked')
-            pipeline.set_state(Gst.State.NULL)
+            self.pipeline.set_state(Gst.State.NULL)
+            sys.exit(1)
+        if self.headless:
+            return
+        tee_video_pad = self.tee.get_request_pad("src_%u")
+        queue_video_pad = self.video_queue.get_static_pad("sink")
+        if not tee_video_pad.link(queue_video_pad) == Gst.PadLinkReturn.OK:
+            print('tee could not be linked')
+            self.pipeline.set_state(Gst.State.NULL)
             sys.exit(1)
 
     def setup_bus(self):
         # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.get_bus
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.add_signal_watch
         print('listening to the bus...')
-        self.bus = self._pipeline.get_bus()
+        self.bus = self.pipeline.get_bus()
+        self.bus.add_signal_watch()
+        self.bus.connect("message", self.message_cb)
         self.bus.connect("message::error", self.error_cb)
 
     def play_pipeline(self):
@@ -165,12 +258,63 @@ class CustomData():
         print('successfully played the pipeline')
         return True
 
-    def run_main(self):
+    def run_main(self, duration=0):
         print("running GLib main loop...")
         # https://lazka.github.io/pgi-docs/#GLib-2.0/classes/MainLoop.html#GLib.MainLoop
         # https://lazka.github.io/pgi-docs/#GLib-2.0/classes/MainLoop.html#GLib.MainLoop.run
         self.main_loop = GLib.MainLoop()
-        self.main_loop.run()
+        if duration > 0:
+            # https://lazka.github.io/pgi-docs/#GLib-2.0/functions.html#GLib.timeout_add_seconds
+            GLib.timeout_add_seconds(duration, self.quit_main)
+
+        # thread_time() only counts the CPU time of the thread running the main loop
+        cpu_start = time.thread_time()
+        wall_start = time.monotonic()
+        try:
+            self.main_loop.run()
+        except KeyboardInterrupt:
+            print('interrupted')
+        self.main_loop_cpu_time = time.thread_time() - cpu_start
+        self.main_loop_wall_time = time.monotonic() - wall_start
+
+    def quit_main(self):
+        self.main_loop.quit()
+        return False
+
+    """
+    Starts the producer thread of the thread feed mode. It pushes buffers while appsrc
+    needs data, and sleeps on the need_data event otherwise.
+    """
+    def start_producer(self):
+        print('starting the producer thread...')
+        # https://docs.python.org/3/library/threading.html#threading.Thread
+        self.producer = threading.Thread(target=self.produce, name='producer', daemon=True)
+        self.producer.start()
+
+    def produce(self):
+        while not self.stopping.is_set():
+            self.need_data.wait()
+            if self.stopping.is_set():
+                break
+            if not self.push_data():
+                break
+
+    def stop_producer(self):
+        if self.producer is None:
+            return
+        print('stopping the producer thread...')
+        self.stopping.set()
+        self.need_data.set()
+        self.producer.join()
+        self.producer = None
+
+    def report_feed(self):
+        wall_time = self.main_loop_wall_time
+        if wall_time <= 0:
+            return
+        print('feed mode {}: main loop used {:.3f}s CPU in {:.3f}s ({:.1f}%), pushed {:.1f} buffers/s, {:.0f} bytes/s'.format(
+            self.feed_mode, self.main_loop_cpu_time, wall_time, 100 * self.main_loop_cpu_time / wall_time,
+            self.buffers_pushed.value / wall_time, self.bytes_pushed.value / wall_time))
 
     """
     This method is called by the idle GSource in the mainloop, to feed CHUNK_SIZE bytes into appsrc.
@@ -178,60 +322,82 @@ class CustomData():
     and is removed when appsrc has enough data (enough-data signal).
     """
     def push_data(self):
-        print("push_data called")
-        num_samples = CHUNK_SIZE // 2
-
-        print('creating a buffer...')
-        #https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.new_allocate
-        buf = Gst.Buffer.new_allocate(None, num_samples)
+        start = time.perf_counter()
+        # Samples per channel
+        num_samples = self.chunk_size // (BYTES_PER_SAMPLE * self.channels)
+        buffer_size = num_samples * self.channels * BYTES_PER_SAMPLE
+
+        if self.buffer_pool is not None:
+            buf = self.buffer_pool.acquire()
+        else:
+            #https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.new_allocate
+            buf = Gst.Buffer.new_allocate(None, buffer_size)
         # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.util_uint64_scale
-        buf.pts = Gst.util_uint64_scale(self.num_samples, Gst.SECOND, SAMPLE_RATE)
-        buf.duration = Gst.util_uint64_scale(num_samples, Gst.SECOND, SAMPLE_RATE)
+        buf.pts = Gst.util_uint64_scale(self.num_samples, Gst.SECOND, self.sample_rate)
+        buf.duration = Gst.util_uint64_scale(num_samples, Gst.SECOND, self.sample_rate)
+        if self.latency_tracer is not None:
+            self.latency_tracer.tag(buf)
         # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.map
         success, info = buf.map(Gst.MapFlags.WRITE)
         if not success:
             print('failed to create a map')
             return False
         # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/MapInfo.html#Gst.MapInfo
-        raw = list(info.data)
-        self.c += self.d
-        self.d -= self.c / 1000
-        freq = 1100 + 1000 * self.d
-        for i in range(num_samples):
-            self.a += self.b
-            self.b -= self.a / freq
-            raw[i] = 500 * self.a
+        # Write the samples straight into the mapped memory through an S16 view
+        try:
+            samples = np.frombuffer(info.data, dtype=np.int16, count=num_samples * self.channels)
+            if self.channels == 1:
+                self.waveform.fill(samples)
+            else:
+                if self.mono is None or len(self.mono) != num_samples:
+                    self.mono = np.empty(num_samples, dtype=np.int16)
+                self.waveform.fill(self.mono)
+                samples.reshape(num_samples, self.channels)[:] = self.mono[:, np.newaxis]
+        finally:
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.unmap
+            buf.unmap(info)
         self.num_samples += num_samples
 
-        print('pushing the buffer to appsrc...')
         ret = self.app_source.emit("push-buffer", buf)
         if not ret == Gst.FlowReturn.OK:
-            print('failed to push the buffer')
+            log.warning('failed to push the buffer: {}'.format(ret))
             return False
+        self.buffers_pushed.inc()
+        self.bytes_pushed.inc(buffer_size)
+        self.push_latency.observe(time.perf_counter() - start)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('pushed a buffer of {} samples at {}'.format(num_samples, buf.pts))
 
         return True
 
     """
     This signal callback triggers when appsrc needs data. Here, we add an idle handler
-    to the mainloop to start pushing data into the appsrc
+    to the mainloop to start pushing data into the appsrc.
+    In the thread feed mode, we wake up the producer thread instead.
     """
     def start_feed(self, source, size):
-        print("start_feed called")
+        self.feed_starts.inc()
+        self.feeding.set(1)
 
-        if self.sourceid == 0:
-            print("start feeding...")
+        if self.feed_mode == 'thread':
+            self.need_data.set()
+        elif self.sourceid == 0:
+            log.debug('start feeding...')
             # https://lazka.github.io/pgi-docs/#GLib-2.0/functions.html#GLib.idle_add
             self.sourceid = GLib.idle_add(self.push_data)
 
     """
     This callback triggers when appsrc has enough data and we can stop sending.
-    We remove the idle handler from the mainloop
+    We remove the idle handler from the mainloop, or let the producer thread sleep
     """
     def stop_feed(self, source):
-        print("stop_feed called")
+        self.feed_stops.inc()
+        self.feeding.set(0)
 
-        if self.sourceid != 0:
-            print('stop feeding...')
+        if self.feed_mode == 'thread':
+            self.need_data.clear()
+        elif self.sourceid != 0:
+            log.debug('stop feeding...')
             # https://lazka.github.io/pgi-docs/#GLib-2.0/functions.html#GLib.source_remove
             GLib.source_remove(self.sourceid)
             self.sourceid = 0
@@ -240,34 +406,118 @@ class CustomData():
     The appsink has received a buffer
     """
     def new_sample(self, sink):
-        print("new_sample called")
-
         # https://lazka.github.io/pgi-docs/#GObject-2.0/classes/Object.html#GObject.Object.emit
-        sample = self.app_sink.emit("pull-sample")
-        if sample is not None:
-            print('*{}*'.format(sample.get_buffer().get_size()))
-            return Gst.FlowReturn.OK
+        with self.pull_latency.time():
+            return self.sample_consumer.pull(self.app_sink)
+
+    def consume_samples(self, view):
+        self.buffers_pulled.inc()
+        self.bytes_pulled.inc(view.data.nbytes)
+        self.sample_callback(view)
+
+    """
+    The default consumer of the app_sink samples. The data is only valid while this method runs
+    """
+    def process_samples(self, view):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('*{}* {} samples of {}'.format(view.data.nbytes, len(view.data), view.format))
 
-        return Gst.FlowReturn.ERROR
+    """
+    This function is called for every message posted on the bus
+    """
+    def message_cb(self, bus, msg):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/flags.html#Gst.MessageType.get_name
+        metrics.count_bus_message(Gst.MessageType.get_name(msg.type))
 
     """
     This function is called when an error message is posted on the bus
     """
     def error_cb(self, bus, msg):
-        print("error_cb called")
+        gerror, debug = msg.parse_error()
+        log.error('error {} happened at {}'.format(gerror.message, debug))
+        if self.main_loop is not None:
+            self.main_loop.quit()
 
     def dispose(self):
         print('disposing customData...')
         if self.pipeline is None:
             return
+        # Going to NULL flushes appsrc, which unblocks a producer stuck in push-buffer
+        self.stopping.set()
+        self.need_data.set()
         self.pipeline.set_state(Gst.State.NULL)
+        self.stop_producer()
+
+        if self.buffer_pool is not None:
+            print('buffer pool stats: {}'.format(self.buffer_pool.stats()))
+            self.buffer_pool.stop()
+
+        self.sample_consumer.dispose()
+        if self.bus is not None:
+            self.bus.remove_signal_watch()
 
 if __name__ == '__main__':
-    data = CustomData()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='amount of bytes sent in each buffer')
+    parser.add_argument('--pool-size', type=int, default=0, help='recycle this many pre-allocated buffers (0 allocates a new buffer per push)')
+    parser.add_argument('--feed-mode', choices=FEED_MODES, default='idle', help='feed appsrc from a main loop idle handler or from a producer thread')
+    parser.add_argument('--max-bytes', type=int, default=0, help='appsrc queue limit in bytes (0 keeps the default)')
+    parser.add_argument('--duration', type=int, default=0, help='stop after this many seconds and report the feed statistics (0 runs until interrupted)')
+    parser.add_argument('--queue-monitor', action='store_true', help='report the level and stall time of every queue')
+    parser.add_argument('--auto-tune-queues', action='store_true', help='grow the limits of overrunning queues, then make them leaky')
+    parser.add_argument('--trace-latency', action='store_true', help='report the latency from app_source to every element, per path')
+    parser.add_argument('--trace-every', type=int, default=1, help='trace one buffer out of this many')
+    parser.add_argument('--hot-plug', default=None, help='branch attached to and detached from the running tee, e.g. "audioconvert ! wavenc ! filesink location=out.wav"')
+    parser.add_argument('--hot-plug-every', type=float, default=2.0, help='seconds between attaching and detaching the --hot-plug branch')
+    parser.add_argument('--shm-ring', default=None, help='publish the app_sink samples in a shared memory ring of this name, read it with shm_ring.py subscribe')
+    parser.add_argument('--shm-slots', type=int, default=64, help='slots of the --shm-ring')
+    parser.add_argument('--analysis', action='store_true', help='compute the RMS, peak and spectrum of the app_sink samples')
+    parser.add_argument('--analysis-window', type=int, default=2048, help='samples per FFT frame')
+    parser.add_argument('--analysis-hop', type=int, default=1024, help='samples between two FFT frames')
+    parser.add_argument('--analysis-bands', type=int, default=32, help='log-spaced bands the spectrum is decimated into')
+    parser.add_argument('--analysis-rate', type=float, default=10.0, help='analysis results per second')
+    parser.add_argument('--headless', action='store_true', help='leave out the wavescope branch')
+    parser.add_argument('--negotiate', action='store_true', help='feed app_source with the rate and channels the sinks take, and report the converters')
+    parser.add_argument('--profile', action='store_true', help='report the throughput and processing time of every element')
+    parser.add_argument('--profile-window', type=float, default=0.0, help='profile for this many seconds out of every --profile-period (default: always)')
+    parser.add_argument('--profile-period', type=float, default=10.0, help='seconds between the starts of two profile windows')
+    parser.add_argument('--graph', action='store_true', help='write the pipeline graph with its caps, rates and queue levels on SIGUSR1, and serve it next to the metrics')
+    parser.add_argument('--log-level', default=None, help='logging level of the per-buffer output, e.g. DEBUG (default: $GST_EXAMPLES_LOG_LEVEL or INFO)')
+    parser.add_argument('--metrics-port', type=int, default=0, help='serve the metrics in Prometheus text format on this port (default: $GST_EXAMPLES_METRICS_PORT)')
+    parser.add_argument('--metrics-json', default=None, help='write a JSON snapshot of the metrics to this file on exit')
+    args = parser.parse_args()
+
+    metrics.configure_logging(args.log_level)
+    if args.metrics_port > 0:
+        metrics_server = metrics.MetricsServer()
+        metrics_server.start(args.metrics_port)
+    else:
+        metrics_server = metrics.serve_from_env()
+
+    # Other processes read the app_sink samples from shared memory, away from the GIL of the pipeline
+    shm_ring = None
+    sample_callbacks = []
+    if args.shm_ring is not None:
+        shm_ring = ShmRingPublisher(args.shm_ring, slots=args.shm_slots, slot_size=max(args.chunk_size, 64 * 1024))
+        sample_callbacks.append(lambda view: shm_ring.publish(view.data, view.pts, view.duration, view.format.caps))
+    analyzer = None
+    if args.analysis:
+        analyzer = AudioAnalyzer(args.analysis_window, args.analysis_hop, args.analysis_bands, args.analysis_rate)
+        sample_callbacks.append(analyzer.consume)
+
+    def consume_samples(view):
+        for callback in sample_callbacks:
+            callback(view)
+    sample_callback = consume_samples if sample_callbacks else None
+
+    data = CustomData(chunk_size=args.chunk_size, pool_size=args.pool_size, sample_callback=sample_callback,
+                      feed_mode=args.feed_mode, max_bytes=args.max_bytes, headless=args.headless)
     
     # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
     print('initializing Gst...')
-    Gst.init(None)
+    gst_bootstrap.init()
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('startup:\n' + '\n'.join(gst_bootstrap.startup_report()))
 
     if not data.create_elements():
         print('failed to create elements nor a pipeline')
@@ -275,23 +525,92 @@ if __name__ == '__main__':
 
     data.setup_wavescope()
 
+    data.link_always_pads()
+    data.link_request_pads()
+
     # https://lazka.github.io/pgi-docs/#GstAudio-1.0/classes/AudioInfo.html#GstAudio.AudioInfo.set_format
     info = GstAudio.AudioInfo()
     info.set_format(GstAudio.AudioFormat.S16, SAMPLE_RATE, 1, None)
     # https://lazka.github.io/pgi-docs/#GstAudio-1.0/classes/AudioInfo.html#GstAudio.AudioInfo.to_caps
     audio_caps = info.to_caps()
-    data.configure_appsrc(audio_caps)
+    if args.negotiate:
+        # Before app_sink gets its caps, it takes whatever the other branches agree on
+        audio_caps = negotiate(data.pipeline, data.app_source, PRODUCIBLE_CAPS, {'rate': SAMPLE_RATE, 'channels': 1}) or audio_caps
+        if not data.headless:
+            negotiate(data.pipeline, data.visual, None, {'width': 320, 'height': 200, 'framerate': (25, 1)})
+    if not data.configure_appsrc(audio_caps):
+        data.dispose()
+        sys.exit(1)
     data.configure_appsink(audio_caps)
+    data.setup_bus()
 
-    data.link_always_pads()
-    data.link_request_pads()
+    queue_monitor = None
+    if args.queue_monitor or args.auto_tune_queues:
+        queue_monitor = QueueMonitor(data.pipeline, auto_tune=args.auto_tune_queues)
+        queue_monitor.start()
 
     if not data.play_pipeline():
         sys.exit(1)
 
-    data.run_main()
+    # After the state change, so that the elements created inside the sink bins are found
+    if args.trace_latency:
+        data.latency_tracer = LatencyTracer(data.pipeline, data.app_source, sample_every=args.trace_every)
+        data.latency_tracer.start()
+    profiler = None
+    if args.profile:
+        profiler = ElementProfiler(data.pipeline)
+        profiler.start(args.profile_window, args.profile_period)
+    graph = None
+    if args.graph:
+        graph = PipelineGraph(data.pipeline, profiler)
+        graph.start()
+        graph.serve(metrics_server)
+        graph.dump_on_signal()
+
+    # From a thread, detaching waits for the branch to drain while the main loop keeps feeding app_source
+    branches = None
+    if args.hot_plug is not None:
+        branches = TeeBranches(data.pipeline, data.tee)
+        hot_plug_stopping = threading.Event()
+        hot_plug_thread = threading.Thread(target=branches.cycle, args=('hot_plug', args.hot_plug, args.hot_plug_every, hot_plug_stopping), daemon=True)
+        hot_plug_thread.start()
+
+    if args.feed_mode == 'thread':
+        data.start_producer()
+
+    data.run_main(args.duration)
+
+    if branches is not None:
+        hot_plug_stopping.set()
+        hot_plug_thread.join()
+    if args.negotiate:
+        report_converters(data.pipeline)
+    if graph is not None:
+        graph.dump()
+        graph.stop()
 
     print('disposing the data...')
     data.dispose()
+    data.report_feed()
+    if shm_ring is not None:
+        print('published {} samples in {}'.format(shm_ring.sequence, shm_ring.name))
+        shm_ring.close()
+    if analyzer is not None:
+        analyzer.report()
+    if queue_monitor is not None:
+        queue_monitor.stop()
+        queue_monitor.report()
+    if data.latency_tracer is not None:
+        data.latency_tracer.stop()
+        data.latency_tracer.report()
+    if profiler is not None:
+        profiler.stop()
+        profiler.report()
+    if branches is not None:
+        branches.report()
+
+    if args.metrics_json is not None:
+        with open(args.metrics_json, 'w') as f:
+            f.write(metrics.REGISTRY.to_json(indent=2))
 
     print('finished running a short cutting the pipeline example')
\ No newline at end of file
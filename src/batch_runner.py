@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+
+# Runs the uridecodebin topology of basic-tutorial-3.py over many local files
+# with a pool of worker processes, one per core by default.
+#
+# Each worker initializes Gst and builds its pipeline once, then reuses it for
+# every job by going back to NULL and swapping the uri. A job that fails or
+# does not reach EOS within --timeout is retried up to --retries times.
+#
+# A worker that crashes breaks the whole pool, and every unfinished job fails
+# with BrokenProcessPool, whether it was running or still queued. The workers
+# mark the jobs they are running in a dict shared through a Manager, so the
+# jobs that never started are queued again in a fresh pool as they were. When
+# more than one job was running, the pool killed the others along with the one
+# that crashed: each of them runs again alone in a pool of one worker, and an
+# attempt is only charged for a crash there.
+#
+#     python3 batch_runner.py ~/media --workers 8 --timeout 60 --json results.json
+
+class DecodeWorker():
+
+    def __init__(self):
+        self._pipeline = None
+        self._source = None
+        self._convert = None
+        self._sink = None
+        self.jobs = 0
+
+    def create_pipeline(self):
+        # The same topology as basic-tutorial-3.py, with a fakesink that does not sync to the clock
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/ElementFactory.html#Gst.ElementFactory.make
+        self._source = Gst.ElementFactory.make("uridecodebin", "source")
+        self._convert = Gst.ElementFactory.make("audioconvert", "convert")
+        self._sink = Gst.ElementFactory.make("fakesink", "sink")
+        self._pipeline = Gst.Pipeline.new("test-pipeline")
+        if self._source is None or self._convert is None or self._sink is None or self._pipeline is None:
+            raise RuntimeError('failed to create elements or a pipeline')
+
+        self._sink.set_property('sync', False)
+        self._pipeline.add(self._source)
+        self._pipeline.add(self._convert)
+        self._pipeline.add(self._sink)
+        if not self._convert.link(self._sink):
+            raise RuntimeError('failed to link from convert to sink')
+        self._source.connect("pad-added", self.pad_added_handler)
+
+    def pad_added_handler(self, src, new_pad):
+        sink_pad = self._convert.get_static_pad('sink')
+        if sink_pad.is_linked():
+            return
+        new_pad_caps = new_pad.get_current_caps()
+        if new_pad_caps is None or not new_pad_caps.get_structure(0).get_name().startswith('audio/x-raw'):
+            return
+        new_pad.link(sink_pad)
+
+    def reset(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.set_state
+        self._pipeline.set_state(Gst.State.NULL)
+        # Drop the messages left over by the previous job
+        bus = self._pipeline.get_bus()
+        while bus.pop() is not None:
+            pass
+
+    def decode(self, path, timeout):
+        # Not after a failed job, which dropped its pipeline
+        reused = self._pipeline is not None
+        if self._pipeline is None:
+            self.create_pipeline()
+        self.jobs += 1
+
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.filename_to_uri
+        self._source.set_property('uri', Gst.filename_to_uri(os.path.abspath(path)))
+        try:
+            if self._pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+                raise RuntimeError('failed to play')
+
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.timed_pop_filtered
+            bus = self._pipeline.get_bus()
+            gst_message = bus.timed_pop_filtered(int(timeout * Gst.SECOND), Gst.MessageType.ERROR | Gst.MessageType.EOS)
+            if gst_message is None:
+                raise TimeoutError('no EOS after {}s'.format(timeout))
+            if gst_message.type == Gst.MessageType.ERROR:
+                gerror, debug = gst_message.parse_error()
+                raise RuntimeError(gerror.message)
+
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.query_duration
+            queried, duration = self._pipeline.query_duration(Gst.Format.TIME)
+            if not queried:
+                queried, duration = self._pipeline.query_position(Gst.Format.TIME)
+            media_seconds = duration / Gst.SECOND if queried else 0.0
+        except Exception:
+            # Do not reuse a pipeline that failed, build a new one for the next job
+            self._pipeline.set_state(Gst.State.NULL)
+            self._pipeline = None
+            raise
+        else:
+            self.reset()
+        return media_seconds, reused
+
+# The worker of the current process and the shared path -> pid of the running jobs, set by init_worker
+_worker = None
+_running = None
+
+def init_worker(running):
+    global _worker, _running
+    gst_bootstrap.init()
+    _worker = DecodeWorker()
+    _running = running
+
+def decode_file(path, timeout):
+    start = time.monotonic()
+    result = {'path': path, 'pid': os.getpid(), 'ok': False, 'error': None, 'media_seconds': 0.0, 'reused_pipeline': False}
+    # A call to the manager, so the mark is stored before decoding starts, even if this process crashes while decoding
+    _running[path] = os.getpid()
+    try:
+        result['media_seconds'], result['reused_pipeline'] = _worker.decode(path, timeout)
+        result['ok'] = True
+    except Exception as error:
+        result['error'] = '{}: {}'.format(type(error).__name__, error)
+    finally:
+        _running.pop(path, None)
+    result['wall_seconds'] = time.monotonic() - start
+    return result
+
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+    return files
+
+def run_batch(files, workers, timeout, retries):
+    # path -> attempts so far
+    attempts = {path: 0 for path in files}
+    pending = list(files)
+    results = {}
+    # Jobs that were running next to another one when a worker crashed, to run alone
+    suspects = set()
+    manager = multiprocessing.Manager()
+    running = manager.dict()
+
+    while pending:
+        running.clear()
+        isolated = [path for path in pending if path in suspects]
+        if isolated:
+            batch = isolated[:1]
+            suspects.discard(batch[0])
+            pending.remove(batch[0])
+        else:
+            batch = pending
+            pending = []
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=1 if isolated else workers, initializer=init_worker, initargs=(running,))
+        futures = {executor.submit(decode_file, path, timeout): path for path in batch}
+        # The jobs that were running when the pool broke, read once when the first future fails with BrokenProcessPool
+        crashed = None
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    if crashed is None:
+                        crashed = set(running.keys())
+                        # A worker that died before marking any job, e.g. in init_worker, charges them all so that the batch ends
+                        if not crashed:
+                            crashed = set(futures.values())
+                    if path not in crashed:
+                        # Never started, or finished with its result lost with the pool
+                        pending.append(path)
+                        continue
+                    if len(crashed) > 1:
+                        # Which of the running jobs crashed is found by running them alone
+                        suspects.add(path)
+                        pending.append(path)
+                        continue
+                    result = {'path': path, 'ok': False, 'error': 'worker process died', 'media_seconds': 0.0, 'wall_seconds': 0.0}
+                attempts[path] += 1
+                result['attempts'] = attempts[path]
+                results[path] = result
+                if not result['ok'] and attempts[path] <= retries:
+                    print('retrying {} after {}'.format(path, result['error']))
+                    pending.append(path)
+                else:
+                    print('{} {} ({:.1f} media seconds in {:.2f}s, attempt {})'.format(
+                        'decoded' if result['ok'] else 'FAILED', path, result['media_seconds'], result['wall_seconds'], result['attempts']))
+        finally:
+            # A broken pool cannot take new jobs, retries go to a fresh one
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    manager.shutdown()
+    return [results[path] for path in files]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='decode many local files with the basic-tutorial-3 pipeline')
+    parser.add_argument('paths', nargs='+', help='media files, or directories to search recursively')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: one per core)')
+    parser.add_argument('--timeout', type=float, default=300.0, help='seconds a job may take before it is failed')
+    parser.add_argument('--retries', type=int, default=1, help='times a failed job is retried')
+    parser.add_argument('--json', default=None, help='write the per-job results to this file')
+    args = parser.parse_args()
+
+    files = collect_files(args.paths)
+    if not files:
+        print('no files to decode')
+        sys.exit(1)
+
+    print('decoding {} files with {} workers...'.format(len(files), args.workers))
+    start = time.monotonic()
+    results = run_batch(files, args.workers, args.timeout, args.retries)
+    elapsed = time.monotonic() - start
+
+    succeeded = [result for result in results if result['ok']]
+    media_seconds = sum(result['media_seconds'] for result in succeeded)
+    print('{} of {} files decoded in {:.2f}s: {:.2f} files/s, {:.1f} media-seconds per wall-second'.format(
+        len(succeeded), len(results), elapsed, len(succeeded) / elapsed, media_seconds / elapsed))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'elapsed_seconds': elapsed, 'workers': args.workers, 'jobs': results}, f, indent=2)
+
+    if len(succeeded) != len(results):
+        sys.exit(1)
@@ -0,0 +1,390 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+
+# Headless benchmarks of the tutorial pipelines.
+#
+# Every tutorial topology is rebuilt with local sources (videotestsrc,
+# audiotestsrc, appsrc, or a media file generated on the fly) and fakesinks
+# that do not sync to the clock, then run to EOS in its own process, so that
+# peak RSS and CPU time are not shared between benchmarks.
+#
+#     python3 benchmark.py run --output results.json
+#     python3 benchmark.py compare baseline.json results.json
+#
+# compare exits with status 1 when a benchmark got worse than the baseline by
+# more than --tolerance.
+
+BENCHMARKS = (
+    'basic-tutorial-1',
+    'basic-tutorial-2',
+    'basic-tutorial-3',
+    'basic-tutorial-4',
+    'basic-tutorial-6',
+    'basic-tutorial-7',
+    'basic-tutorial-8',
+)
+
+# Benchmarks that play the generated media file rather than a test source
+MEDIA_BENCHMARKS = ('basic-tutorial-1', 'basic-tutorial-3', 'basic-tutorial-4')
+
+# metric -> True when higher is better
+METRICS = {
+    'buffers_per_second': True,
+    'startup_seconds': False,
+    'cpu_seconds': False,
+    'peak_rss_kb': False,
+}
+
+# Candidate encoders for the generated media file, the first available one is used.
+# Each entry is (required factories, file extension, pipeline description)
+MEDIA_PIPELINES = (
+    (('vp8enc', 'vorbisenc', 'webmmux'), 'webm',
+     'videotestsrc num-buffers={video_buffers} ! video/x-raw,width=320,height=240,framerate=30/1 ! vp8enc deadline=1 ! queue ! '
+     'webmmux name=mux ! filesink location={location} '
+     'audiotestsrc num-buffers={audio_buffers} ! audioconvert ! vorbisenc ! queue ! mux.'),
+    (('theoraenc', 'vorbisenc', 'oggmux'), 'ogg',
+     'videotestsrc num-buffers={video_buffers} ! video/x-raw,width=320,height=240,framerate=30/1 ! theoraenc ! queue ! '
+     'oggmux name=mux ! filesink location={location} '
+     'audiotestsrc num-buffers={audio_buffers} ! audioconvert ! vorbisenc ! queue ! mux.'),
+    (('wavenc',), 'wav',
+     'audiotestsrc num-buffers={audio_buffers} ! wavenc ! filesink location={location}'),
+)
+
+def init_gst():
+    import gst_bootstrap
+    return gst_bootstrap.init()
+
+def wait_for(Gst, bus, types, timeout):
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.timed_pop_filtered
+    return bus.timed_pop_filtered(int(timeout * Gst.SECOND), types | Gst.MessageType.ERROR)
+
+def generate_media(directory, seconds):
+    Gst = init_gst()
+    for factories, extension, description in MEDIA_PIPELINES:
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/ElementFactory.html#Gst.ElementFactory.find
+        if any(Gst.ElementFactory.find(name) is None for name in factories):
+            continue
+        location = os.path.join(directory, 'media.{}'.format(extension))
+        # audiotestsrc sends 1024 samples per buffer at 44100 Hz by default
+        pipeline = Gst.parse_launch(description.format(
+            video_buffers=int(seconds * 30), audio_buffers=int(seconds * 44100 / 1024) + 1, location=location))
+        pipeline.set_state(Gst.State.PLAYING)
+        message = wait_for(Gst, pipeline.get_bus(), Gst.MessageType.EOS, 600)
+        pipeline.set_state(Gst.State.NULL)
+        if message is not None and message.type == Gst.MessageType.EOS:
+            return 'file://' + os.path.abspath(location)
+        print('failed to generate {} media, trying the next encoder...'.format(extension))
+    return None
+
+def make_fakesink(Gst, name):
+    sink = Gst.ElementFactory.make('fakesink', name)
+    sink.set_property('sync', False)
+    return sink
+
+def build_playbin(Gst, media_uri):
+    playbin = Gst.ElementFactory.make('playbin', 'playbin')
+    playbin.set_property('uri', media_uri)
+    playbin.set_property('video-sink', make_fakesink(Gst, 'video_sink'))
+    playbin.set_property('audio-sink', make_fakesink(Gst, 'audio_sink'))
+    return playbin
+
+def build_uridecodebin(Gst, media_uri):
+    pipeline = Gst.Pipeline.new('test-pipeline')
+    source = Gst.ElementFactory.make('uridecodebin', 'source')
+    convert = Gst.ElementFactory.make('audioconvert', 'convert')
+    sink = make_fakesink(Gst, 'sink')
+    for element in (source, convert, sink):
+        pipeline.add(element)
+    convert.link(sink)
+    source.set_property('uri', media_uri)
+
+    def pad_added_handler(src, new_pad):
+        sink_pad = convert.get_static_pad('sink')
+        caps = new_pad.get_current_caps()
+        if sink_pad.is_linked() or caps is None or not caps.get_structure(0).get_name().startswith('audio/x-raw'):
+            return
+        new_pad.link(sink_pad)
+
+    source.connect('pad-added', pad_added_handler)
+    return pipeline
+
+def build_pipeline(Gst, name, num_buffers, media_uri):
+    # Returns the pipeline, a function to call right after asking for PLAYING and
+    # a function to call once it is PLAYING. Both functions can be None.
+    if name in ('basic-tutorial-1', 'basic-tutorial-4'):
+        playbin = build_playbin(Gst, media_uri)
+        if name == 'basic-tutorial-1':
+            return playbin, None, None
+
+        def seek():
+            # Like tutorial 4, seek once while playing
+            queried, duration = playbin.query_duration(Gst.Format.TIME)
+            if queried:
+                playbin.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, duration // 2)
+        return playbin, None, seek
+
+    if name == 'basic-tutorial-3':
+        return build_uridecodebin(Gst, media_uri), None, None
+
+    if name == 'basic-tutorial-2':
+        description = 'videotestsrc pattern=0 num-buffers={n} ! fakesink sync=false'
+    elif name == 'basic-tutorial-6':
+        description = 'audiotestsrc num-buffers={n} ! fakesink sync=false'
+    elif name == 'basic-tutorial-7':
+        description = ('audiotestsrc freq=215 num-buffers={n} ! tee name=tee '
+                       'tee. ! queue ! audioconvert ! audioresample ! fakesink sync=false '
+                       'tee. ! queue ! wavescope shader=0 style=1 ! videoconvert ! fakesink sync=false')
+    elif name == 'basic-tutorial-8':
+        return build_appsrc_pipeline(Gst, num_buffers)
+    else:
+        raise ValueError('unknown benchmark {}'.format(name))
+    return Gst.parse_launch(description.format(n=num_buffers)), None, None
+
+def build_appsrc_pipeline(Gst, num_buffers):
+    import numpy as np
+    from waveform import WaveformGenerator, BYTES_PER_SAMPLE
+
+    chunk_size = 1024
+    sample_rate = 44100
+    pipeline = Gst.parse_launch(
+        'appsrc name=app_source format=time block=true caps="audio/x-raw,format=S16LE,channels=1,rate={rate},layout=interleaved" ! tee name=tee '
+        'tee. ! queue ! audioconvert ! audioresample ! fakesink sync=false '
+        'tee. ! queue ! audioconvert ! wavescope shader=0 style=1 ! videoconvert ! fakesink sync=false '
+        'tee. ! queue ! appsink name=app_sink emit-signals=true sync=false'.format(rate=sample_rate))
+    app_source = pipeline.get_by_name('app_source')
+    app_sink = pipeline.get_by_name('app_sink')
+
+    def new_sample(sink):
+        sample = sink.emit('pull-sample')
+        return Gst.FlowReturn.OK if sample is not None else Gst.FlowReturn.ERROR
+
+    app_sink.connect('new-sample', new_sample)
+
+    def feed():
+        waveform = WaveformGenerator()
+        num_samples = chunk_size // BYTES_PER_SAMPLE
+        for i in range(num_buffers):
+            buf = Gst.Buffer.new_allocate(None, chunk_size)
+            buf.pts = Gst.util_uint64_scale(i * num_samples, Gst.SECOND, sample_rate)
+            buf.duration = Gst.util_uint64_scale(num_samples, Gst.SECOND, sample_rate)
+            success, info = buf.map(Gst.MapFlags.WRITE)
+            waveform.fill(np.frombuffer(info.data, dtype=np.int16, count=num_samples))
+            buf.unmap(info)
+            if app_source.emit('push-buffer', buf) != Gst.FlowReturn.OK:
+                return
+        app_source.emit('end-of-stream')
+
+    def start_feeding():
+        threading.Thread(target=feed, daemon=True).start()
+
+    # appsrc needs data to preroll, so feeding starts before the pipeline is PLAYING
+    return pipeline, start_feeding, None
+
+def count_rendered(Gst, pipeline):
+    # Sum of the buffers rendered by every sink, including the ones inside playbin
+    # https://lazka.github.io/pgi-docs/#GstBase-1.0/classes/BaseSink.html#GstBase.BaseSink.props.stats
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.iterate_recurse
+    rendered = 0
+    iterator = pipeline.iterate_recurse()
+    while True:
+        result, element = iterator.next()
+        if result != Gst.IteratorResult.OK:
+            break
+        if element.find_property('stats') is None:
+            continue
+        stats = element.get_property('stats')
+        found, value = stats.get_uint64('rendered')
+        if found:
+            rendered += value
+    return rendered
+
+def run_single(name, num_buffers, media_uri, timeout):
+    start = time.perf_counter()
+    Gst = init_gst()
+    init_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pipeline, on_started, on_playing = build_pipeline(Gst, name, num_buffers, media_uri)
+    build_seconds = time.perf_counter() - start
+    bus = pipeline.get_bus()
+
+    start = time.perf_counter()
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        pipeline.set_state(Gst.State.NULL)
+        return {'name': name, 'error': 'failed to play'}
+
+    if on_started is not None:
+        on_started()
+
+    # Wait until the pipeline itself reaches PLAYING
+    error = None
+    startup_seconds = None
+    while startup_seconds is None:
+        message = wait_for(Gst, bus, Gst.MessageType.STATE_CHANGED, timeout)
+        if message is None:
+            error = 'timed out waiting for PLAYING'
+            break
+        if message.type == Gst.MessageType.ERROR:
+            error = message.parse_error()[0].message
+            break
+        if message.src == pipeline and message.parse_state_changed()[1] == Gst.State.PLAYING:
+            startup_seconds = time.perf_counter() - start
+
+    playing = time.perf_counter()
+    if error is None:
+        if on_playing is not None:
+            on_playing()
+        message = wait_for(Gst, bus, Gst.MessageType.EOS, timeout)
+        if message is None:
+            error = 'timed out waiting for EOS'
+        elif message.type == Gst.MessageType.ERROR:
+            error = message.parse_error()[0].message
+    run_seconds = time.perf_counter() - playing
+
+    rendered = count_rendered(Gst, pipeline)
+    pipeline.set_state(Gst.State.NULL)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    result = {
+        'name': name,
+        'init_seconds': init_seconds,
+        'build_seconds': build_seconds,
+        'startup_seconds': startup_seconds,
+        'run_seconds': run_seconds,
+        'buffers': rendered,
+        'buffers_per_second': rendered / run_seconds if run_seconds > 0 else 0.0,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_kb': usage.ru_maxrss,
+    }
+    if error is not None:
+        result['error'] = error
+    return result
+
+def run_all(names, num_buffers, media_seconds, timeout):
+    this_file = os.path.abspath(__file__)
+    results = {
+        'num_buffers': num_buffers,
+        'media_seconds': media_seconds,
+        'python': sys.version.split()[0],
+        'benchmarks': {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix='gst-benchmark-') as directory:
+        media_uri = None
+        if any(name in MEDIA_BENCHMARKS for name in names):
+            print('generating {}s of local media...'.format(media_seconds))
+            output = subprocess.run([sys.executable, this_file, 'generate', directory, '--media-seconds', str(media_seconds)],
+                                    capture_output=True, text=True)
+            media_uri = output.stdout.strip().splitlines()[-1] if output.returncode == 0 and output.stdout.strip() else None
+            if media_uri is None:
+                print('failed to generate media, skipping {}'.format(', '.join(MEDIA_BENCHMARKS)))
+
+        for name in names:
+            if name in MEDIA_BENCHMARKS and media_uri is None:
+                continue
+            print('running {}...'.format(name))
+            command = [sys.executable, this_file, 'single', name, '--num-buffers', str(num_buffers), '--timeout', str(timeout)]
+            if media_uri is not None:
+                command += ['--media', media_uri]
+            output = subprocess.run(command, capture_output=True, text=True)
+            if output.returncode != 0:
+                result = {'name': name, 'error': output.stderr.strip().splitlines()[-1] if output.stderr.strip() else 'exit status {}'.format(output.returncode)}
+            else:
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+            results['benchmarks'][name] = result
+            print_result(result)
+    return results
+
+def print_result(result):
+    if 'error' in result:
+        print('  {}: error: {}'.format(result['name'], result['error']))
+    if 'buffers_per_second' not in result:
+        return
+    print('  {}: startup {:.3f}s, {:.0f} buffers/s, cpu {:.2f}s, peak rss {} KB'.format(
+        result['name'], result['startup_seconds'] or 0.0, result['buffers_per_second'], result['cpu_seconds'], result['peak_rss_kb']))
+
+def compare(baseline, current, tolerance):
+    regressions = []
+    for name, result in sorted(current['benchmarks'].items()):
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            print('{}: no baseline'.format(name))
+            continue
+        if 'error' in result and 'error' not in base:
+            regressions.append((name, 'error', result['error']))
+            print('{}: REGRESSION, failed with {}'.format(name, result['error']))
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old = base.get(metric)
+            new = result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            print('{}: {} {:.4g} -> {:.4g} ({:+.1%}){}'.format(name, metric, old, new, change, ' REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append((name, metric, change))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='headless benchmarks of the tutorial pipelines')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and write the results as JSON')
+    run_parser.add_argument('names', nargs='*', default=list(BENCHMARKS), help='benchmarks to run (default: all)')
+    run_parser.add_argument('--num-buffers', type=int, default=1000, help='buffers produced by the test sources')
+    run_parser.add_argument('--media-seconds', type=float, default=10.0, help='length of the generated media file')
+    run_parser.add_argument('--timeout', type=float, default=120.0, help='seconds to wait for each pipeline')
+    run_parser.add_argument('--output', default=None, help='write the results to this JSON file')
+
+    compare_parser = commands.add_parser('compare', help='flag regressions against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative change before flagging a regression')
+
+    single_parser = commands.add_parser('single', help='run one benchmark in this process and print its result (used by run)')
+    single_parser.add_argument('name', choices=BENCHMARKS)
+    single_parser.add_argument('--num-buffers', type=int, default=1000)
+    single_parser.add_argument('--media', default=None)
+    single_parser.add_argument('--timeout', type=float, default=120.0)
+
+    generate_parser = commands.add_parser('generate', help='generate the local media file and print its URI (used by run)')
+    generate_parser.add_argument('directory')
+    generate_parser.add_argument('--media-seconds', type=float, default=10.0)
+
+    args = parser.parse_args()
+
+    if args.command == 'single':
+        print(json.dumps(run_single(args.name, args.num_buffers, args.media, args.timeout)))
+    elif args.command == 'generate':
+        media_uri = generate_media(args.directory, args.media_seconds)
+        if media_uri is None:
+            sys.exit(1)
+        print(media_uri)
+    elif args.command == 'run':
+        unknown = [name for name in args.names if name not in BENCHMARKS]
+        if unknown:
+            parser.error('unknown benchmarks: {}'.format(', '.join(unknown)))
+        results = run_all(args.names, args.num_buffers, args.media_seconds, args.timeout)
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print('results written to {}'.format(args.output))
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.tolerance)
+        if regressions:
+            print('{} regressions found'.format(len(regressions)))
+            sys.exit(1)
+        print('no regressions found')
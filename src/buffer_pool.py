@@ -0,0 +1,83 @@
+from gst_bootstrap import Gst
+
+# Recycling buffer pool for feeding appsrc.
+#
+# All buffers are allocated up front when the pool is activated. A buffer goes
+# back to the pool by itself once the last reference to it is dropped, i.e.
+# when every downstream element has released it. If the pool is empty because
+# downstream is still holding all of its buffers, we count a miss and fall
+# back to Gst.Buffer.new_allocate, so the feed never stalls on the pool.
+#
+# In steady state allocations stays at the pool size and only reuses grows.
+
+class AppSrcBufferPool():
+
+    def __init__(self, buffer_size, num_buffers=16, caps=None):
+        self.buffer_size = buffer_size
+        self.num_buffers = num_buffers
+        self.caps = caps
+
+        # Counters
+        self.allocations = 0
+        self.reuses = 0
+        self.misses = 0
+
+        self._pool = None
+        self._acquire_params = None
+        # Preallocated buffers not handed out yet, their first hand-out is not a reuse
+        self._unused = 0
+
+    def start(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/BufferPool.html#Gst.BufferPool.new
+        self._pool = Gst.BufferPool.new()
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/BufferPool.html#Gst.BufferPool.config_set_params
+        # min == max, so that every buffer is allocated when the pool is activated
+        config = self._pool.get_config()
+        Gst.BufferPool.config_set_params(config, self.caps, self.buffer_size, self.num_buffers, self.num_buffers)
+        if not self._pool.set_config(config):
+            print('failed to configure the buffer pool')
+            return False
+
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/BufferPool.html#Gst.BufferPool.set_active
+        if not self._pool.set_active(True):
+            print('failed to activate the buffer pool')
+            return False
+        self.allocations += self.num_buffers
+        self._unused = self.num_buffers
+
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/BufferPoolAcquireParams.html
+        # Do not block when all buffers are in use, we fall back to allocating instead
+        self._acquire_params = Gst.BufferPoolAcquireParams()
+        self._acquire_params.flags = Gst.BufferPoolAcquireFlags.DONTWAIT
+        return True
+
+    def acquire(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/BufferPool.html#Gst.BufferPool.acquire_buffer
+        ret, buf = self._pool.acquire_buffer(self._acquire_params)
+        if ret == Gst.FlowReturn.OK and buf is not None:
+            # The free buffers of a Gst.BufferPool are a FIFO, returned buffers queue up behind
+            # the preallocated ones, so the first num_buffers hand-outs are the fresh buffers
+            if self._unused > 0:
+                self._unused -= 1
+            else:
+                self.reuses += 1
+            return buf
+
+        self.misses += 1
+        self.allocations += 1
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.new_allocate
+        return Gst.Buffer.new_allocate(None, self.buffer_size)
+
+    def stop(self):
+        if self._pool is None:
+            return
+        # Buffers still held downstream are freed when they are released
+        self._pool.set_active(False)
+        self._pool = None
+
+    def stats(self):
+        return {
+            'allocations': self.allocations,
+            'reuses': self.reuses,
+            'misses': self.misses,
+        }
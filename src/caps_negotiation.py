@@ -0,0 +1,210 @@
+import sys
+import argparse
+
+import metrics
+from metrics import log
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst, GstBase
+
+# Makes a source produce the caps its consumers prefer, so that the
+# audioconvert, audioresample and videoconvert of basic-tutorial-7.py and
+# basic-tutorial-8.py have nothing left to convert.
+#
+# A converter accepts nearly any caps on its sink pad, so the caps a source
+# sees downstream, e.g. with query_caps like print_pad_capabilities of
+# basic-tutorial-6.py does, say nothing about what the sink wants. negotiate()
+# brings the pipeline to READY, when the sinks inside autoaudiosink and
+# autovideosink exist, and queries the caps of the first element behind the
+# converters, queues and tees of every branch instead. The intersection of
+# those, and of what the source can produce, is fixated close to the
+# preferences and set on the source: as the caps of an appsrc, or with a
+# capsfilter in front of the element following any other source:
+#
+#     caps = negotiate(pipeline, app_source, 'audio/x-raw, format=S16LE, layout=interleaved', {'rate': 44100, 'channels': 1})
+#     caps = negotiate(pipeline, wavescope, None, {'width': 320, 'height': 200, 'framerate': (25, 1)})
+#     ...
+#     report_converters(pipeline)      # once PAUSED or PLAYING
+#
+#     python3 caps_negotiation.py 'audiotestsrc num-buffers=100 ! audioconvert ! audioresample ! autoaudiosink'
+
+# Elements that only convert when the caps of their two sides differ
+CONVERTERS = ('audioconvert', 'audioresample', 'audiorate', 'videoconvert', 'videoscale', 'videorate')
+# Elements that pass the caps on as they are
+PASSTHROUGH = ('queue', 'queue2', 'multiqueue', 'tee', 'capsfilter', 'identity')
+# Values fixated to when the consumers take a range, a fixated range would end up at its minimum
+DEFAULT_PREFERENCES = {'rate': 44100, 'channels': 2, 'width': 320, 'height': 240, 'framerate': (30, 1)}
+
+def factory_name(element):
+    factory = element.get_factory()
+    return factory.get_name() if factory is not None else None
+
+def consumer_pads(src_pad):
+    # The sink pads of the first elements behind src_pad that are neither converters nor passthrough, looking into bins
+    peer = src_pad.get_peer()
+    if peer is None:
+        return []
+    parent = peer.get_parent()
+    if isinstance(parent, Gst.GhostPad):
+        # The inside of the src ghost pad of a bin, continue outside of it
+        return consumer_pads(parent)
+    while isinstance(peer, Gst.GhostPad) and peer.get_target() is not None:
+        # The sink ghost pad of a bin, continue with the pad inside it
+        peer = peer.get_target()
+    element = peer.get_parent_element()
+    if element is None or factory_name(element) not in CONVERTERS + PASSTHROUGH:
+        return [peer]
+    pads = []
+    for pad in element.srcpads:
+        pads.extend(consumer_pads(pad))
+    return pads
+
+def fixate(caps, preferences):
+    # The first structure of caps, with the preferred values where it has a choice
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Structure.html#Gst.Structure.fixate_field_nearest_int
+    structure = caps.get_structure(0).copy()
+    for field, value in dict(DEFAULT_PREFERENCES, **(preferences or {})).items():
+        if not structure.has_field(field):
+            continue
+        if isinstance(value, tuple):
+            structure.fixate_field_nearest_fraction(field, value[0], value[1])
+        elif isinstance(value, int):
+            structure.fixate_field_nearest_int(field, value)
+        else:
+            structure.fixate_field_string(field, value)
+    fixed = Gst.Caps.new_empty()
+    fixed.append_structure(structure)
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Caps.html#Gst.Caps.fixate
+    return fixed.fixate()
+
+def preferred_caps(producer, producible=None, preferences=None):
+    # Caps producer can produce and all its consumers take as they are, None when there are none
+    src_pad = producer.get_static_pad('src')
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.query_caps
+    caps = Gst.Caps.from_string(producible) if isinstance(producible, str) else producible
+    if caps is None:
+        caps = src_pad.query_caps(None)
+    for pad in consumer_pads(src_pad):
+        # In the order of preference of the consumer
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Caps.html#Gst.Caps.intersect_full
+        caps = pad.query_caps(None).intersect_full(caps, Gst.CapsIntersectMode.FIRST)
+        if caps.is_empty():
+            log.warning('{} takes nothing {} can produce, the converters stay in use'.format(pad.get_parent_element().get_name(), producer.get_name()))
+            return None
+    return fixate(caps, preferences)
+
+def apply_caps(producer, caps):
+    if factory_name(producer) == 'appsrc':
+        # https://lazka.github.io/pgi-docs/#GstApp-1.0/classes/AppSrc.html#GstApp.AppSrc.props.caps
+        producer.set_property('caps', caps)
+        return True
+    peer = producer.get_static_pad('src').get_peer()
+    if peer is None:
+        return False
+    downstream = peer.get_parent_element()
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.link_filtered
+    producer.unlink(downstream)
+    if producer.link_filtered(downstream, caps):
+        return True
+    producer.link(downstream)
+    return False
+
+def negotiate(pipeline, producer, producible=None, preferences=None):
+    # Call once the pipeline is linked, before PLAYING. Returns the caps set on producer, or None
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.get_state
+    state = pipeline.get_state(0)[1]
+    if state < Gst.State.READY and pipeline.set_state(Gst.State.READY) == Gst.StateChangeReturn.FAILURE:
+        log.warning('failed to bring the pipeline to READY')
+        return None
+    caps = preferred_caps(producer, producible, preferences)
+    if caps is None or not apply_caps(producer, caps):
+        return None
+    log.info('{} produces {}'.format(producer.get_name(), caps.to_string()))
+    return caps
+
+def find_converters(pipeline):
+    converters = []
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.iterate_recurse
+    iterator = pipeline.iterate_recurse()
+    while True:
+        result, element = iterator.next()
+        if result == Gst.IteratorResult.RESYNC:
+            iterator.resync()
+            converters = []
+            continue
+        if result != Gst.IteratorResult.OK:
+            break
+        if factory_name(element) in CONVERTERS:
+            converters.append(element)
+    return converters
+
+def differences(sink_caps, src_caps):
+    # 'field from -> to' for every field the converter changes
+    sink = sink_caps.get_structure(0)
+    src = src_caps.get_structure(0)
+    changes = []
+    for i in range(sink.n_fields()):
+        field = sink.nth_field_name(i)
+        before = sink.get_value(field)
+        after = src.get_value(field) if src.has_field(field) else None
+        if str(before) != str(after):
+            changes.append('{} {} -> {}'.format(field, before, after))
+    return changes
+
+def converter_states(pipeline):
+    # [(element, factory, converting, changes)] once the caps are negotiated
+    states = []
+    for element in find_converters(pipeline):
+        sink_caps = element.get_static_pad('sink').get_current_caps()
+        src_caps = element.get_static_pad('src').get_current_caps()
+        if sink_caps is None or src_caps is None:
+            states.append((element.get_name(), factory_name(element), None, []))
+            continue
+        # https://lazka.github.io/pgi-docs/#GstBase-1.0/classes/BaseTransform.html#GstBase.BaseTransform.is_passthrough
+        if isinstance(element, GstBase.BaseTransform):
+            converting = not element.is_passthrough()
+        else:
+            converting = not sink_caps.is_equal(src_caps)
+        states.append((element.get_name(), factory_name(element), converting, differences(sink_caps, src_caps)))
+    return states
+
+def report_converters(pipeline):
+    for name, factory, converting, changes in converter_states(pipeline):
+        if converting is None:
+            print('{} ({}): not negotiated'.format(name, factory))
+        elif converting:
+            print('{} ({}): converting {}'.format(name, factory, ', '.join(changes) or 'in place'))
+        else:
+            print('{} ({}): passthrough'.format(name, factory))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='negotiate the caps of the source of a pipeline with its sinks, and report the converters')
+    parser.add_argument('description', help='pipeline description, as for gst-launch-1.0')
+    parser.add_argument('--producer', default=None, help='name of the element to configure (default: the first source)')
+    parser.add_argument('--no-negotiate', action='store_true', help='only report the converters, for comparison')
+    args = parser.parse_args()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
+    print('initializing Gst...')
+    gst_bootstrap.init()
+    metrics.configure_logging()
+
+    pipeline = Gst.parse_launch(args.description)
+    if args.producer is not None:
+        producer = pipeline.get_by_name(args.producer)
+    else:
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.iterate_sources
+        result, producer = pipeline.iterate_sources().next()
+    if producer is None:
+        print('no element to negotiate for')
+        sys.exit(1)
+
+    if not args.no_negotiate:
+        negotiate(pipeline, producer)
+    if pipeline.set_state(Gst.State.PAUSED) == Gst.StateChangeReturn.FAILURE:
+        print('failed to preroll')
+        pipeline.set_state(Gst.State.NULL)
+        sys.exit(1)
+    pipeline.get_state(5 * Gst.SECOND)
+    report_converters(pipeline)
+    pipeline.set_state(Gst.State.NULL)
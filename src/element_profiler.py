@@ -0,0 +1,256 @@
+import sys
+import time
+import argparse
+import threading
+
+import metrics
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+
+# Per-element throughput and processing time from pad probes, to find the
+# bottleneck of a chain like audioconvert ! audioresample in basic-tutorial-7.py
+# or wavescope ! videoconvert in basic-tutorial-8.py.
+#
+# Buffer probes on every pad count the buffers and bytes going in and out of
+# each element. The time a buffer spends inside an element is measured per
+# streaming thread: from the buffer entering a sink pad to the element pushing
+# the result out of a src pad in the same thread. Elements handing buffers to
+# another thread, like queue, have no processing time, and neither have sinks.
+#
+#     profiler = ElementProfiler(pipeline)
+#     profiler.start()                                      # always on
+#     profiler.start(sample_window=1.0, sample_period=10.0) # on for 1s out of every 10s
+#     ...
+#     profiler.stop()
+#     profiler.report()
+#
+# With sampling, the probes are only installed during the sample windows and
+# cost nothing in between, so the profiler can be left enabled in production.
+# Rates are computed over the time the probes were installed.
+#
+# The src pad probes also count the buffers and bytes of every src pad in
+# pads, which pipeline_graph.py turns into the rates of the links.
+#
+#     python3 element_profiler.py 'audiotestsrc num-buffers=2000 ! audioconvert ! audioresample ! fakesink'
+
+class ElementStats():
+
+    def __init__(self, element):
+        self.element = element
+        self.name = element.get_name()
+        factory = element.get_factory()
+        self.factory = factory.get_name() if factory is not None else type(element).__name__
+        self.buffers_in = 0
+        self.bytes_in = 0
+        self.buffers_out = 0
+        self.bytes_out = 0
+        self.processing = metrics.REGISTRY.histogram('element_processing_seconds', 'Time a buffer spends inside an element',
+                                                     element=self.name)
+        self.lock = threading.Lock()
+
+    def busy(self, elapsed):
+        # Fraction of the time the element was processing, the element closest to 1 is the bottleneck
+        if elapsed <= 0:
+            return 0.0
+        return self.processing.sum / elapsed
+
+class PadStats():
+
+    def __init__(self, pad):
+        self.pad = pad
+        self.buffers = 0
+        self.bytes = 0
+
+class ElementProfiler():
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.stats = {}
+        # src pad -> PadStats, updated under the lock of the ElementStats of its element
+        self.pads = {}
+        self._probes = []
+        # element -> perf_counter() when a buffer entered it, per streaming thread
+        self._entered = threading.local()
+        self._lock = threading.Lock()
+        self._enabled_since = None
+        # Seconds the probes were installed for
+        self.enabled_time = 0.0
+        self._sampler = None
+        self._stopping = threading.Event()
+
+    def find_elements(self):
+        elements = []
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.iterate_recurse
+        iterator = self.pipeline.iterate_recurse()
+        while True:
+            result, element = iterator.next()
+            if result == Gst.IteratorResult.RESYNC:
+                iterator.resync()
+                elements = []
+                continue
+            if result != Gst.IteratorResult.OK:
+                break
+            # Bins are profiled through the elements inside them
+            if not isinstance(element, Gst.Bin):
+                elements.append(element)
+        return elements
+
+    def enable(self):
+        with self._lock:
+            if self._enabled_since is not None:
+                return
+            probe_type = Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST
+            for element in self.find_elements():
+                stats = self.stats.get(element.get_name())
+                if stats is None:
+                    stats = self.stats[element.get_name()] = ElementStats(element)
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.add_probe
+                for pad in element.sinkpads:
+                    self._probes.append((pad, pad.add_probe(probe_type, self.on_sink_buffer, stats)))
+                for pad in element.srcpads:
+                    pad_stats = self.pads.get(pad)
+                    if pad_stats is None:
+                        pad_stats = self.pads[pad] = PadStats(pad)
+                    self._probes.append((pad, pad.add_probe(probe_type, self.on_src_buffer, stats, pad_stats)))
+            self._enabled_since = time.perf_counter()
+
+    def disable(self):
+        with self._lock:
+            if self._enabled_since is None:
+                return
+            for pad, probe_id in self._probes:
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.remove_probe
+                pad.remove_probe(probe_id)
+            self._probes = []
+            self.enabled_time += time.perf_counter() - self._enabled_since
+            self._enabled_since = None
+        # A buffer inside an element when the probes went away would be measured across the gap
+        self._entered = threading.local()
+
+    @property
+    def enabled(self):
+        return self._enabled_since is not None
+
+    @staticmethod
+    def measure(info):
+        # Returns (buffers, bytes) of the probed data
+        if info.type & Gst.PadProbeType.BUFFER_LIST:
+            buffer_list = info.get_buffer_list()
+            count = buffer_list.length()
+            return count, sum(buffer_list.get(i).get_size() for i in range(count))
+        return 1, info.get_buffer().get_size()
+
+    def on_sink_buffer(self, pad, info, stats):
+        now = time.perf_counter()
+        buffers, size = self.measure(info)
+        with stats.lock:
+            stats.buffers_in += buffers
+            stats.bytes_in += size
+        entered = self._entered.__dict__
+        entered[stats.name] = now
+        return Gst.PadProbeReturn.OK
+
+    def on_src_buffer(self, pad, info, stats, pad_stats):
+        now = time.perf_counter()
+        buffers, size = self.measure(info)
+        with stats.lock:
+            stats.buffers_out += buffers
+            stats.bytes_out += size
+            pad_stats.buffers += buffers
+            pad_stats.bytes += size
+        # Only when the buffer entered this element in this thread: not for sources, nor after a queue
+        start = self._entered.__dict__.pop(stats.name, None)
+        if start is not None:
+            stats.processing.observe(now - start)
+        return Gst.PadProbeReturn.OK
+
+    def sample(self, window, period):
+        while not self._stopping.is_set():
+            self.enable()
+            if self._stopping.wait(window):
+                break
+            self.disable()
+            self._stopping.wait(max(period - window, 0.0))
+
+    def start(self, sample_window=0.0, sample_period=0.0):
+        # Always on without a sample window, else on for sample_window seconds out of every sample_period
+        self._stopping.clear()
+        if sample_window <= 0 or sample_period <= sample_window:
+            self.enable()
+            return
+        self._sampler = threading.Thread(target=self.sample, args=(sample_window, sample_period), name='element-profiler', daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        self.disable()
+
+    def elapsed(self):
+        # Seconds the probes were installed for, up to now
+        enabled_since = self._enabled_since
+        return self.enabled_time + (time.perf_counter() - enabled_since if enabled_since is not None else 0.0)
+
+    def ranked(self):
+        elapsed = self.elapsed()
+        return elapsed, sorted(self.stats.values(), key=lambda stats: stats.busy(elapsed), reverse=True)
+
+    def report(self):
+        elapsed, ranked = self.ranked()
+        if elapsed <= 0:
+            print('the profiler was never enabled')
+            return
+        print('{:<20} {:<16} {:>9} {:>9} {:>11} {:>11} {:>9} {:>9} {:>6}'.format(
+            'element', 'factory', 'in buf/s', 'out buf/s', 'in KB/s', 'out KB/s', 'mean ms', 'p99 ms', 'busy'))
+        for stats in ranked:
+            processing = stats.processing
+            mean = processing.sum / processing.count if processing.count else 0.0
+            print('{:<20} {:<16} {:>9.1f} {:>9.1f} {:>11.1f} {:>11.1f} {:>9.3f} {:>9.3f} {:>6.1%}'.format(
+                stats.name, stats.factory, stats.buffers_in / elapsed, stats.buffers_out / elapsed,
+                stats.bytes_in / elapsed / 1024, stats.bytes_out / elapsed / 1024,
+                mean * 1e3, processing.quantile(0.99) * 1e3, stats.busy(elapsed)))
+        print('measured over {:.2f}s of enabled probes'.format(elapsed))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='profile the elements of a gst-launch pipeline')
+    parser.add_argument('description', help='pipeline description, as for gst-launch-1.0')
+    parser.add_argument('--duration', type=float, default=0, help='stop after this many seconds (default: run to EOS)')
+    parser.add_argument('--sample-window', type=float, default=0.0, help='seconds the probes stay installed per sample period')
+    parser.add_argument('--sample-period', type=float, default=0.0, help='seconds between the starts of two sample windows')
+    args = parser.parse_args()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
+    print('initializing Gst...')
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics.serve_from_env()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.parse_launch
+    pipeline = Gst.parse_launch(args.description)
+    # Going to READY first creates the elements inside the sink bins, so that they get probes too
+    pipeline.set_state(Gst.State.READY)
+    profiler = ElementProfiler(pipeline)
+    profiler.start(args.sample_window, args.sample_period)
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        print('failed to play')
+        pipeline.set_state(Gst.State.NULL)
+        sys.exit(1)
+
+    bus = pipeline.get_bus()
+    deadline = time.monotonic() + args.duration if args.duration > 0 else None
+    gst_message = None
+    try:
+        while gst_message is None and (deadline is None or time.monotonic() < deadline):
+            gst_message = bus.timed_pop_filtered(100 * Gst.MSECOND, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+    except KeyboardInterrupt:
+        pass
+    profiler.stop()
+    pipeline.set_state(Gst.State.NULL)
+
+    if gst_message is not None and gst_message.type == Gst.MessageType.ERROR:
+        gerror, debug = gst_message.parse_error()
+        print('error {} happened at {}'.format(gerror.message, debug))
+    profiler.report()
@@ -0,0 +1,480 @@
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+from fractions import Fraction
+
+# Index of every element factory in the GStreamer registry, persisted on disk:
+# factory name -> pad templates (direction, presence, parsed caps) -> the
+# factories whose pads can link to them.
+#
+# Answering "which factories accept these caps" from the live registry means
+# walking every factory with Gst.ElementFactory.find and get_static_pad_templates,
+# the way print_pad_templates_information in basic-tutorial-6.py does. The
+# index answers it from a JSON file and a pure Python caps matcher instead, so
+# queries do not import Gst nor load any plugin:
+#
+#     index = FactoryIndex.load()
+#     index.accepting('audio/x-raw, format=(string)S16LE, rate=(int)44100')
+#     index.downstream('audiotestsrc')
+#
+# The index stores a fingerprint of the registry cache file and of the plugin
+# path variables, and is rebuilt with Gst when they change. GStreamer rewrites
+# the registry cache at the next Gst.init after plugins are added or removed.
+#
+#     python3 factory_index.py build
+#     python3 factory_index.py templates audiotestsrc
+#     python3 factory_index.py accepting 'video/x-raw, format=(string)NV12'
+#     python3 factory_index.py bench
+
+INDEX_VERSION = 1
+PLUGIN_PATH_VARIABLES = ('GST_PLUGIN_PATH', 'GST_PLUGIN_PATH_1_0', 'GST_PLUGIN_SYSTEM_PATH', 'GST_PLUGIN_SYSTEM_PATH_1_0')
+SYSTEM_MEMORY = 'memory:SystemMemory'
+
+class CapsParseError(ValueError):
+    pass
+
+def default_index_path():
+    path = os.environ.get('GST_EXAMPLES_FACTORY_INDEX')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.cache', 'gst-examples', 'factory-index.json')
+
+def registry_files():
+    for name in ('GST_REGISTRY_1_0', 'GST_REGISTRY'):
+        if os.environ.get(name):
+            return [os.environ[name]]
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return sorted(glob.glob(os.path.join(cache_home, 'gstreamer-1.0', 'registry.*.bin')))
+
+def registry_fingerprint():
+    # Cheap enough to check on every load: a few stat() calls, no Gst
+    fingerprint = hashlib.sha256()
+    for name in PLUGIN_PATH_VARIABLES:
+        fingerprint.update('{}={}\n'.format(name, os.environ.get(name, '')).encode())
+    for path in registry_files():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        fingerprint.update('{} {} {}\n'.format(path, stat.st_size, stat.st_mtime_ns).encode())
+    return fingerprint.hexdigest()
+
+# Caps strings are parsed into JSON friendly values:
+#     'ANY', or a list of [name, features, fields] structures
+#     features is None for (ANY), else a sorted list without memory:SystemMemory
+#     field values are int, float, str and bool, or {'f': [num, den]} for a fraction,
+#     {'l': [...]} for a list, {'r': [min, max]} for a range, {'a': [...]} for an
+#     array, and {'o': text} for types the matcher does not look into
+
+OPENING = {'{': '}', '[': ']', '<': '>', '(': ')'}
+
+def _split_top(text, separator):
+    # Splits on separator outside of brackets and quotes
+    parts = []
+    depth = 0
+    quoted = False
+    start = 0
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if quoted:
+            if c == '\\':
+                i += 1
+            elif c == '"':
+                quoted = False
+        elif c == '"':
+            quoted = True
+        elif c in OPENING:
+            depth += 1
+        elif c in '}]>)':
+            depth -= 1
+        elif c == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    if depth != 0 or quoted:
+        raise CapsParseError('unbalanced caps {!r}'.format(text))
+    parts.append(text[start:])
+    return parts
+
+def _parse_scalar(text, value_type):
+    if text.startswith('"'):
+        return text[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    if value_type in ('int', 'i', 'uint', 'int64', 'uint64', 'gint', 'guint'):
+        return int(text, 0)
+    if value_type in ('float', 'f', 'double', 'd', 'gdouble'):
+        return float(text)
+    if value_type in ('fraction', 'GstFraction'):
+        num, _, den = text.partition('/')
+        return {'f': [int(num), int(den or 1)]}
+    if value_type in ('boolean', 'bool', 'b'):
+        return text.lower() in ('true', 'yes', 't', '1')
+    if value_type in ('string', 's', 'gchararray'):
+        return text
+    if value_type is not None:
+        return {'o': text}
+    # Untyped, guess like gst_structure_from_string does
+    for guess in ('int', 'float', 'fraction'):
+        try:
+            return _parse_scalar(text, guess)
+        except ValueError:
+            pass
+    return text
+
+def _parse_value(text, value_type):
+    text = text.strip()
+    if text.startswith('(') and ')' in text:
+        value_type, _, text = text[1:].partition(')')
+        value_type = value_type.strip()
+        text = text.strip()
+    if not text:
+        raise CapsParseError('missing value')
+    if text[0] in '{[<':
+        if text[-1] != OPENING[text[0]]:
+            raise CapsParseError('unbalanced value {!r}'.format(text))
+        items = [_parse_value(item, value_type) for item in _split_top(text[1:-1], ',') if item.strip()]
+        if text[0] == '{':
+            return {'l': items}
+        if text[0] == '<':
+            return {'a': items}
+        if len(items) not in (2, 3):
+            raise CapsParseError('bad range {!r}'.format(text))
+        return {'r': items[:2]}
+    try:
+        return _parse_scalar(text, value_type)
+    except ValueError:
+        raise CapsParseError('bad {} value {!r}'.format(value_type, text))
+
+def parse_caps(text):
+    text = text.strip()
+    if text in ('ANY', ''):
+        return 'ANY' if text else []
+    if text in ('EMPTY', 'NONE'):
+        return []
+    structures = []
+    for structure_text in _split_top(text, ';'):
+        if not structure_text.strip():
+            continue
+        parts = _split_top(structure_text, ',')
+        head = parts[0].strip()
+        features = []
+        if '(' in head:
+            head, _, feature_text = head.partition('(')
+            feature_text = feature_text.rstrip(')')
+            if feature_text.strip() == 'ANY':
+                features = None
+            else:
+                features = sorted(f.strip() for f in feature_text.split(',') if f.strip() and f.strip() != SYSTEM_MEMORY)
+        fields = {}
+        for part in parts[1:]:
+            if not part.strip():
+                continue
+            key, equals, value = part.partition('=')
+            if not equals:
+                raise CapsParseError('field without a value {!r}'.format(part))
+            fields[key.strip()] = _parse_value(value, None)
+        structures.append([head.strip(), features, fields])
+    return structures
+
+def _number(value):
+    if isinstance(value, dict):
+        num, den = value['f']
+        return Fraction(num, den)
+    return value
+
+def _values_intersect(a, b):
+    a_kind = next(iter(a)) if isinstance(a, dict) else None
+    b_kind = next(iter(b)) if isinstance(b, dict) else None
+    if a_kind == 'l':
+        return any(_values_intersect(item, b) for item in a['l'])
+    if b_kind == 'l':
+        return any(_values_intersect(a, item) for item in b['l'])
+    if a_kind == 'o' or b_kind == 'o':
+        # Not looked into, assume they can intersect
+        return True
+    if a_kind == 'r' and b_kind == 'r':
+        return _number(a['r'][0]) <= _number(b['r'][1]) and _number(b['r'][0]) <= _number(a['r'][1])
+    if a_kind == 'r' or b_kind == 'r':
+        bounds, value = (a['r'], b) if a_kind == 'r' else (b['r'], a)
+        if isinstance(value, (str, bool)) or (isinstance(value, dict) and 'a' in value):
+            return False
+        return _number(bounds[0]) <= _number(value) <= _number(bounds[1])
+    if a_kind == 'a' or b_kind == 'a':
+        if a_kind != b_kind or len(a['a']) != len(b['a']):
+            return False
+        return all(_values_intersect(x, y) for x, y in zip(a['a'], b['a']))
+    if isinstance(a, str) or isinstance(b, str):
+        return a == b
+    return _number(a) == _number(b)
+
+def structures_intersect(a, b):
+    a_name, a_features, a_fields = a
+    b_name, b_features, b_fields = b
+    if a_name != b_name:
+        return False
+    if a_features is not None and b_features is not None and a_features != b_features:
+        return False
+    for key, value in a_fields.items():
+        other = b_fields.get(key)
+        if other is not None and not _values_intersect(value, other):
+            return False
+    return True
+
+def caps_intersect(a, b):
+    # Pure Python counterpart of Gst.Caps.can_intersect for parsed caps
+    if a == 'ANY':
+        return b == 'ANY' or bool(b)
+    if b == 'ANY':
+        return bool(a)
+    return any(structures_intersect(x, y) for x in a for y in b)
+
+def build_index():
+    # Only building needs Gst, queries on a loaded index never import it
+    import gst_bootstrap
+    Gst = gst_bootstrap.init()
+
+    directions = {Gst.PadDirection.SRC: 'src', Gst.PadDirection.SINK: 'sink'}
+    presences = {Gst.PadPresence.ALWAYS: 'always', Gst.PadPresence.SOMETIMES: 'sometimes', Gst.PadPresence.REQUEST: 'request'}
+
+    factories = {}
+    # Gst.Caps of every template, for the compatibility pass: (factory, template, caps, media types)
+    live = {'src': [], 'sink': []}
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Registry.html#Gst.Registry.get_feature_list
+    # Reading the templates from the registry cache does not load the plugins
+    for factory in Gst.Registry.get().get_feature_list(Gst.ElementFactory):
+        templates = []
+        for pad_template in factory.get_static_pad_templates():
+            direction = directions.get(pad_template.direction)
+            if direction is None:
+                continue
+            caps_string = pad_template.static_caps.string or 'ANY'
+            try:
+                parsed = parse_caps(caps_string)
+            except CapsParseError:
+                parsed = 'ANY'
+            template = {
+                'name': pad_template.name_template,
+                'direction': direction,
+                'presence': presences.get(pad_template.presence, 'always'),
+                'caps': caps_string,
+                'structures': parsed,
+                'links': [],
+            }
+            templates.append(template)
+            media_types = None if parsed == 'ANY' else set(structure[0] for structure in parsed)
+            live[direction].append((factory.get_name(), template, pad_template.static_caps.get(), media_types))
+        factories[factory.get_name()] = {
+            'rank': factory.get_rank(),
+            'plugin': factory.get_plugin_name(),
+            'klass': factory.get_metadata('klass') or '',
+            'templates': templates,
+        }
+
+    # Factories whose sink templates can link to each src template, checked with Gst itself.
+    # ANY templates match everything and are kept out of the lists, see FactoryIndex.downstream
+    sinks_by_media_type = {}
+    for sink in live['sink']:
+        for media_type in sink[3] or ():
+            sinks_by_media_type.setdefault(media_type, []).append(sink)
+    for factory_name, template, caps, media_types in live['src']:
+        if media_types is None:
+            continue
+        linked = set()
+        for media_type in media_types:
+            for sink_factory, sink_template, sink_caps, sink_media_types in sinks_by_media_type.get(media_type, ()):
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Caps.html#Gst.Caps.can_intersect
+                if sink_factory not in linked and caps.can_intersect(sink_caps):
+                    linked.add(sink_factory)
+        template['links'] = sorted(linked, key=lambda name: (-factories[name]['rank'], name))
+
+    return {
+        'version': INDEX_VERSION,
+        # After Gst.init, which may have just rewritten the registry cache
+        'fingerprint': registry_fingerprint(),
+        'gst_version': Gst.version_string(),
+        'built': time.time(),
+        'factories': factories,
+    }
+
+class FactoryIndex():
+
+    def __init__(self, data):
+        self.data = data
+        self.factories = data['factories']
+        # direction -> media type -> [(factory name, template)], and the ANY templates per direction
+        self._by_media_type = {'src': {}, 'sink': {}}
+        self._any = {'src': [], 'sink': []}
+        for name, factory in self.factories.items():
+            for template in factory['templates']:
+                direction = template['direction']
+                if template['structures'] == 'ANY':
+                    self._any[direction].append((name, template))
+                    continue
+                for media_type in set(structure[0] for structure in template['structures']):
+                    self._by_media_type[direction].setdefault(media_type, []).append((name, template))
+        # (direction, caps string, include ANY) -> answer
+        self._answers = {}
+
+    @classmethod
+    def load(cls, path=None, rebuild=True):
+        # Returns the index at path, rebuilding and saving it first when it is missing or stale
+        path = path or default_index_path()
+        data = None
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        if data is not None and (data.get('version') != INDEX_VERSION or data.get('fingerprint') != registry_fingerprint()):
+            data = None
+        if data is None:
+            if not rebuild:
+                return None
+            data = build_index()
+            cls.save(data, path)
+        return cls(data)
+
+    @staticmethod
+    def save(data, path=None):
+        path = path or default_index_path()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='factory-index-', suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(temporary_path, path)
+
+    @property
+    def stale(self):
+        return self.data.get('fingerprint') != registry_fingerprint()
+
+    def templates(self, factory_name, direction=None):
+        factory = self.factories.get(factory_name)
+        if factory is None:
+            return []
+        return [template for template in factory['templates'] if direction is None or template['direction'] == direction]
+
+    def _matching(self, direction, caps_string, include_any):
+        key = (direction, caps_string, include_any)
+        answer = self._answers.get(key)
+        if answer is not None:
+            return answer
+        caps = parse_caps(caps_string)
+        if caps == 'ANY':
+            candidates = [entry for entries in self._by_media_type[direction].values() for entry in entries]
+        else:
+            candidates = [entry for structure in caps for entry in self._by_media_type[direction].get(structure[0], ())]
+        names = set(name for name, template in candidates if caps_intersect(template['structures'], caps))
+        if include_any and caps:
+            names.update(name for name, template in self._any[direction])
+        answer = sorted(names, key=lambda name: (-self.factories[name]['rank'], name))
+        self._answers[key] = answer
+        return answer
+
+    def accepting(self, caps_string, include_any=False):
+        # Factories with a sink template that can link to caps, highest rank first.
+        # Elements like queue or tee accept ANY caps and are only listed with include_any
+        return self._matching('sink', caps_string, include_any)
+
+    def producing(self, caps_string, include_any=False):
+        # Factories with a src template that can link to caps, highest rank first
+        return self._matching('src', caps_string, include_any)
+
+    def downstream(self, factory_name):
+        # Factories that can link to any src template of factory_name, from the precomputed lists.
+        # A src template with ANY caps links to everything, it is answered with every factory with a sink template
+        linked = []
+        for template in self.templates(factory_name, 'src'):
+            if template['structures'] == 'ANY':
+                return sorted(set(name for entries in self._by_media_type['sink'].values() for name, t in entries),
+                              key=lambda name: (-self.factories[name]['rank'], name))
+            linked.extend(name for name in template['links'] if name not in linked)
+        return linked
+
+def print_templates(index, factory_name):
+    templates = index.templates(factory_name)
+    if not templates:
+        print('{} is not in the index'.format(factory_name))
+        return False
+    for template in templates:
+        print('{} {} pad, {}: {}'.format(template['name'], template['direction'], template['presence'], template['caps']))
+        if template['links']:
+            print('    links to {}'.format(', '.join(template['links'])))
+    return True
+
+def bench(index, caps_string, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        index._answers.clear()
+        index.accepting(caps_string)
+    uncached = (time.perf_counter() - start) / iterations
+    start = time.perf_counter()
+    for i in range(iterations):
+        index.accepting(caps_string)
+    cached = (time.perf_counter() - start) / iterations
+    print('index: {} factories accept {}, {:.1f}us per query ({:.2f}us when repeated)'.format(
+        len(index.accepting(caps_string)), caps_string, uncached * 1e6, cached * 1e6))
+
+    # The same question asked of the live registry, the way basic-tutorial-6.py walks it
+    import gst_bootstrap
+    start = time.perf_counter()
+    Gst = gst_bootstrap.init()
+    init_time = time.perf_counter() - start
+    caps = Gst.Caps.from_string(caps_string)
+    start = time.perf_counter()
+    accepting = set()
+    for factory in Gst.Registry.get().get_feature_list(Gst.ElementFactory):
+        for pad_template in factory.get_static_pad_templates():
+            if pad_template.direction == Gst.PadDirection.SINK:
+                template_caps = pad_template.static_caps.get()
+                if not template_caps.is_any() and template_caps.can_intersect(caps):
+                    accepting.add(factory.get_name())
+    live = time.perf_counter() - start
+    print('registry: {} factories accept {}, {:.1f}us per query after {:.1f}ms of Gst.init'.format(
+        len(accepting), caps_string, live * 1e6, init_time * 1e3))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='persisted index of the element factories and their pad templates')
+    parser.add_argument('--index', default=None, help='index file (default: $GST_EXAMPLES_FACTORY_INDEX or ~/.cache/gst-examples/factory-index.json)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('build', help='rebuild the index from the registry')
+    templates_parser = commands.add_parser('templates', help='print the pad templates of factories')
+    templates_parser.add_argument('factories', nargs='+')
+    accepting_parser = commands.add_parser('accepting', help='list the factories that accept caps')
+    accepting_parser.add_argument('caps')
+    accepting_parser.add_argument('--include-any', action='store_true', help='also list the factories accepting ANY caps')
+    producing_parser = commands.add_parser('producing', help='list the factories that produce caps')
+    producing_parser.add_argument('caps')
+    downstream_parser = commands.add_parser('downstream', help='list the factories a factory can link to')
+    downstream_parser.add_argument('factory')
+    bench_parser = commands.add_parser('bench', help='time a query against the index and against the live registry')
+    bench_parser.add_argument('caps', nargs='?', default='audio/x-raw, format=(string)S16LE, layout=(string)interleaved, rate=(int)44100, channels=(int)1')
+    bench_parser.add_argument('--iterations', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.monotonic()
+        data = build_index()
+        FactoryIndex.save(data, args.index)
+        print('indexed {} factories in {:.2f}s'.format(len(data['factories']), time.monotonic() - start))
+        sys.exit(0)
+
+    start = time.perf_counter()
+    index = FactoryIndex.load(args.index)
+    print('loaded {} factories in {:.1f}ms'.format(len(index.factories), (time.perf_counter() - start) * 1e3))
+    if args.command == 'templates':
+        if not all([print_templates(index, name) for name in args.factories]):
+            sys.exit(1)
+    elif args.command == 'accepting':
+        print('\n'.join(index.accepting(args.caps, args.include_any)))
+    elif args.command == 'producing':
+        print('\n'.join(index.producing(args.caps)))
+    elif args.command == 'downstream':
+        print('\n'.join(index.downstream(args.factory)))
+    elif args.command == 'bench':
+        bench(index, args.caps, args.iterations)
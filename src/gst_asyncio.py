@@ -0,0 +1,207 @@
+import sys
+import time
+import asyncio
+import argparse
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+
+# asyncio layer for driving many pipelines from one event loop.
+#
+# Every bus exposes a file descriptor that is readable while messages are
+# pending. AsyncPipeline registers it with loop.add_reader() and pops the
+# messages from the event loop thread, so no thread is blocked per bus:
+#
+#     pipeline = AsyncPipeline(Gst.parse_launch('videotestsrc num-buffers=30 ! fakesink'))
+#     await pipeline.set_state_async(Gst.State.PLAYING)
+#     async for message in pipeline.messages(Gst.MessageType.STATE_CHANGED):
+#         ...
+#     await pipeline.wait()    # returns the EOS message or raises PipelineError
+#     await pipeline.close()
+#
+# The pipelines built by the tutorials' CustomData classes can be wrapped the same
+# way, e.g. AsyncPipeline(customData._pipeline).
+#
+# Run this file directly to supervise many concurrent pipelines:
+#     python3 gst_asyncio.py --pipelines 200
+
+class PipelineError(Exception):
+
+    def __init__(self, message, debug=None, source=None):
+        super().__init__(message)
+        self.debug = debug
+        self.source = source
+
+    @classmethod
+    def from_message(cls, gst_message):
+        gerror, debug = gst_message.parse_error()
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Object.html#Gst.Object.get_path_string
+        source = gst_message.src.get_path_string() if gst_message.src is not None else None
+        return cls(gerror.message, debug, source)
+
+class AsyncPipeline():
+
+    def __init__(self, pipeline, loop=None):
+        self.pipeline = pipeline
+        self._loop = loop or asyncio.get_event_loop()
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.get_bus
+        self._bus = pipeline.get_bus()
+        # (message type mask, asyncio.Queue) per running messages() iterator
+        self._subscribers = []
+        # Futures waiting for the pipeline to reach a state
+        self._state_waiters = []
+        # Resolved with the EOS message, or failed with a PipelineError
+        self._done = self._loop.create_future()
+
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.get_pollfd
+        self._fd = self._bus.get_pollfd().fd
+        self._loop.add_reader(self._fd, self._drain_bus)
+
+    @property
+    def done(self):
+        return self._done.done()
+
+    def _drain_bus(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.pop
+        while True:
+            gst_message = self._bus.pop()
+            if gst_message is None:
+                return
+            self._dispatch(gst_message)
+
+    def _dispatch(self, gst_message):
+        message_type = gst_message.type
+
+        for types, queue in self._subscribers:
+            if message_type & types:
+                queue.put_nowait(gst_message)
+
+        if message_type == Gst.MessageType.ERROR:
+            error = PipelineError.from_message(gst_message)
+            if not self._done.done():
+                self._done.set_exception(error)
+                # Do not warn about an exception nobody retrieved, the caller may never wait()
+                self._done.exception()
+            self._fail_state_waiters(error)
+        elif message_type == Gst.MessageType.EOS:
+            if not self._done.done():
+                self._done.set_result(gst_message)
+        elif message_type & (Gst.MessageType.STATE_CHANGED | Gst.MessageType.ASYNC_DONE) and gst_message.src == self.pipeline:
+            self._check_state_waiters()
+
+        # Iterators return after EOS or ERROR
+        if message_type & (Gst.MessageType.ERROR | Gst.MessageType.EOS):
+            for types, queue in self._subscribers:
+                queue.put_nowait(None)
+
+    def _check_state_waiters(self):
+        if not self._state_waiters:
+            return
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.get_state
+        ret, current, pending = self.pipeline.get_state(0)
+        waiting = []
+        for state, future in self._state_waiters:
+            if future.done():
+                continue
+            if current == state and pending == Gst.State.VOID_PENDING:
+                future.set_result(ret)
+            else:
+                waiting.append((state, future))
+        self._state_waiters = waiting
+
+    def _fail_state_waiters(self, error):
+        for state, future in self._state_waiters:
+            if not future.done():
+                future.set_exception(error)
+        self._state_waiters = []
+
+    async def set_state_async(self, state, timeout=None):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.set_state
+        ret = self.pipeline.set_state(state)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            # The ERROR message explaining why is usually already on the bus
+            self._drain_bus()
+            if self._done.done() and self._done.exception() is not None:
+                raise self._done.exception()
+            raise PipelineError('failed to change the state to {}'.format(state))
+        if ret != Gst.StateChangeReturn.ASYNC:
+            return ret
+
+        future = self._loop.create_future()
+        self._state_waiters.append((state, future))
+        # The state may have been reached before the waiter was registered
+        self._check_state_waiters()
+        return await asyncio.wait_for(future, timeout)
+
+    async def messages(self, types=None):
+        # Yields every message matching types (all of them by default) until EOS or ERROR
+        if types is None:
+            types = Gst.MessageType.ANY
+        queue = asyncio.Queue()
+        subscriber = (types, queue)
+        self._subscribers.append(subscriber)
+        try:
+            if self._done.done():
+                return
+            while True:
+                gst_message = await queue.get()
+                if gst_message is None:
+                    return
+                yield gst_message
+        finally:
+            self._subscribers.remove(subscriber)
+
+    async def wait(self, timeout=None):
+        # Returns the EOS message, raises PipelineError on ERROR
+        return await asyncio.wait_for(asyncio.shield(self._done), timeout)
+
+    async def close(self):
+        if self._fd is None:
+            return
+        self._loop.remove_reader(self._fd)
+        self._fd = None
+        # Going to NULL is synchronous, keep it off the event loop thread
+        await self._loop.run_in_executor(None, self.pipeline.set_state, Gst.State.NULL)
+
+# Topologies of the tutorials that run to EOS by themselves
+DEMO_PIPELINES = (
+    'videotestsrc pattern=0 num-buffers={n} ! fakesink',
+    'audiotestsrc num-buffers={n} ! fakesink',
+    'audiotestsrc freq=215 num-buffers={n} ! tee name=tee tee. ! queue ! audioconvert ! audioresample ! fakesink '
+    'tee. ! queue ! fakesink',
+)
+
+async def run_one(index, num_buffers):
+    description = DEMO_PIPELINES[index % len(DEMO_PIPELINES)].format(n=num_buffers)
+    pipeline = AsyncPipeline(Gst.parse_launch(description))
+    try:
+        await pipeline.set_state_async(Gst.State.PLAYING)
+        await pipeline.wait()
+        return None
+    except PipelineError as error:
+        return '{}: {}'.format(error.source, error)
+    finally:
+        await pipeline.close()
+
+async def supervise(count, num_buffers):
+    start = time.monotonic()
+    results = await asyncio.gather(*[run_one(i, num_buffers) for i in range(count)])
+    elapsed = time.monotonic() - start
+    errors = [result for result in results if result is not None]
+    for error in errors:
+        print('error {}'.format(error))
+    print('{} pipelines reached EOS in {:.2f}s from one event loop, {} failed'.format(count - len(errors), elapsed, len(errors)))
+    return not errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pipelines', type=int, default=100, help='number of concurrent pipelines')
+    parser.add_argument('--num-buffers', type=int, default=300, help='buffers produced by each pipeline')
+    args = parser.parse_args()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
+    print('initializing Gst...')
+    gst_bootstrap.init()
+
+    if not asyncio.run(supervise(args.pipelines, args.num_buffers)):
+        sys.exit(1)
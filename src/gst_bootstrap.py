@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import time
+import errno
+import runpy
+import select
+import signal
+import socket
+import struct
+import argparse
+import importlib
+import tempfile
+import traceback
+import contextlib
+
+# Fast startup for the examples.
+#
+# Lazy namespaces: importing gi and a GI namespace, and Gst.init with its
+# registry scan, take most of the startup time of a short script. The
+# namespaces exported here are only imported when an attribute is first used,
+# and every step is timed:
+#
+#     import gst_bootstrap
+#     from gst_bootstrap import Gst, GLib    # nothing imported yet
+#     gst_bootstrap.init()                   # imports Gst and calls Gst.init(None)
+#     print('\n'.join(gst_bootstrap.startup_report()))
+#
+# Fork server: a parent that has already imported the namespaces and called
+# Gst.init keeps a few forked workers waiting on a Unix socket. Each job takes
+# one worker, which receives the client's stdin/stdout/stderr, argv, working
+# directory and environment, and runs the script with runpy. The worker exits
+# with the job, and the parent forks a replacement right away:
+#
+#     python3 gst_bootstrap.py serve --workers 4 &
+#     python3 gst_bootstrap.py run basic-tutorial-2.py
+#
+# Environment variables that Gst reads in Gst.init, like GST_PLUGIN_PATH or
+# GST_DEBUG, are the server's, not the client's. Run the scripts directly when
+# changing them.
+
+NAMESPACE_VERSIONS = {
+    'Gst': '1.0', 'GstApp': '1.0', 'GstAudio': '1.0', 'GstBase': '1.0', 'GstVideo': '1.0',
+    'GLib': '2.0', 'GObject': '2.0',
+}
+DEFAULT_PRELOAD = ('Gst', 'GstApp', 'GstAudio', 'GstBase', 'GstVideo', 'GLib')
+
+# [(step, seconds)] in the order the steps ran
+STARTUP = []
+# perf_counter() when this module was imported
+_imported_at = time.perf_counter()
+
+def _process_age():
+    # Seconds since the process started, from /proc, or None where it is not available
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rpartition(')')[2].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+# Time spent in the interpreter and in imports before this module, at 10ms resolution
+_age_at_import = _process_age()
+
+@contextlib.contextmanager
+def timed(step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP.append((step, time.perf_counter() - start))
+
+class LazyNamespace():
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            if 'gi' not in sys.modules:
+                with timed('import gi'):
+                    import gi
+            import gi
+            with timed('gi.require_version {}'.format(self._name)):
+                gi.require_version(self._name, NAMESPACE_VERSIONS.get(self._name, '1.0'))
+            with timed('import {}'.format(self._name)):
+                self._module = importlib.import_module('gi.repository.' + self._name)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attribute):
+        # Only called for attributes not cached yet: after the first access, Gst.X is a plain instance attribute
+        # lookup instead of a Python call, which matters on per-buffer paths like push_data of basic-tutorial-8.py
+        value = getattr(self.load(), attribute)
+        setattr(self, attribute, value)
+        return value
+
+    def __repr__(self):
+        return '<lazy namespace {}{}>'.format(self._name, '' if self._module is None else ' (loaded)')
+
+Gst = LazyNamespace('Gst')
+GstApp = LazyNamespace('GstApp')
+GstAudio = LazyNamespace('GstAudio')
+GstBase = LazyNamespace('GstBase')
+GstVideo = LazyNamespace('GstVideo')
+GLib = LazyNamespace('GLib')
+GObject = LazyNamespace('GObject')
+
+def namespace(name):
+    return globals()[name] if isinstance(globals().get(name), LazyNamespace) else LazyNamespace(name)
+
+def init(argv=None):
+    # Gst.init(argv) once, timed. Returns the Gst module
+    gst = Gst.load()
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.is_initialized
+    if not gst.is_initialized():
+        with timed('Gst.init'):
+            gst.init(argv)
+    return gst
+
+def startup_report():
+    lines = []
+    if _age_at_import is not None:
+        lines.append('{:>9.1f}ms  interpreter and imports before gst_bootstrap'.format(_age_at_import * 1e3))
+    for step, seconds in STARTUP:
+        lines.append('{:>9.1f}ms  {}'.format(seconds * 1e3, step))
+    total = (_age_at_import or 0.0) + time.perf_counter() - _imported_at
+    lines.append('{:>9.1f}ms  total since the process started'.format(total * 1e3))
+    return lines
+
+def default_socket_path():
+    path = os.environ.get('GST_EXAMPLES_BOOTSTRAP_SOCKET')
+    if path:
+        return path
+    runtime_directory = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_directory:
+        return os.path.join(runtime_directory, 'gst-examples-bootstrap.sock')
+    return os.path.join(tempfile.gettempdir(), 'gst-examples-bootstrap-{}.sock'.format(os.getuid()))
+
+def _recv_exactly(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return data
+
+def _reopen_stdio():
+    # fds 0, 1 and 2 now belong to the client, rebuild the Python streams on top of them
+    sys.stdin = open(0, 'r', closefd=False)
+    sys.stdout = open(1, 'w', buffering=1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = open(2, 'w', buffering=1, closefd=False)
+
+def run_job(conn):
+    # Runs in a forked worker: take over the client's stdio and run its script
+    pid, uid, gid = struct.unpack('3i', conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    if uid != os.getuid():
+        os._exit(1)
+
+    header, fds, flags, address = socket.recv_fds(conn, 4, 3)
+    header += _recv_exactly(conn, 4 - len(header))
+    (length,) = struct.unpack('!I', header)
+    job = json.loads(_recv_exactly(conn, length))
+
+    for fd, target in zip(fds, (0, 1, 2)):
+        os.dup2(fd, target)
+        os.close(fd)
+    _reopen_stdio()
+    os.chdir(job['cwd'])
+    os.environ.clear()
+    os.environ.update(job['env'])
+    sys.argv = job['argv']
+    sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    # Tells the client the script is starting, and which process to interrupt
+    conn.sendall(struct.pack('!i', os.getpid()))
+    code = 0
+    try:
+        runpy.run_path(sys.argv[0], run_name='__main__')
+    except SystemExit as exit:
+        if exit.code is None:
+            code = 0
+        elif isinstance(exit.code, int):
+            code = exit.code
+        else:
+            print(exit.code, file=sys.stderr)
+            code = 1
+    except BaseException as error:
+        # A second Ctrl-C must not cut the cleanup short
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        traceback.print_exc()
+        code = 130 if isinstance(error, KeyboardInterrupt) else 1
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for stream in (sys.stdout, sys.stderr):
+        with contextlib.suppress(Exception):
+            stream.flush()
+    with contextlib.suppress(OSError):
+        conn.sendall(struct.pack('!i', code))
+    os._exit(code)
+
+def _spawn_worker(listener, notify_read, notify_write):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    # In the worker: wait for one job, ask the parent for a replacement, run it
+    try:
+        os.close(notify_read)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        conn, address = listener.accept()
+        os.write(notify_write, struct.pack('i', os.getpid()))
+        os.close(notify_write)
+        listener.close()
+        run_job(conn)
+    except BaseException:
+        traceback.print_exc()
+    os._exit(1)
+
+def serve(path, workers, preload):
+    # Everything the workers should inherit happens before the first fork.
+    # Do not start pipelines or threads here, threads do not survive fork()
+    for name in preload:
+        namespace(name).load()
+    init()
+    print('\n'.join(startup_report()))
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    listener.bind(path)
+    os.chmod(path, 0o600)
+    listener.listen(64)
+
+    notify_read, notify_write = os.pipe()
+    # pid -> True while waiting for a job, False once running one
+    children = {}
+    for i in range(workers):
+        children[_spawn_worker(listener, notify_read, notify_write)] = True
+    print('serving on {} with {} ready workers'.format(path, workers))
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        while True:
+            readable, writable, errored = select.select([notify_read], [], [], 1.0)
+            if readable:
+                data = os.read(notify_read, 4 * 64)
+                for (pid,) in struct.iter_unpack('i', data):
+                    children[pid] = False
+                    children[_spawn_worker(listener, notify_read, notify_write)] = True
+            # Reap the workers whose job is done
+            while children:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if pid == 0:
+                    break
+                ready = children.pop(pid, False)
+                if ready:
+                    # A ready worker died without a job, replace it
+                    children[_spawn_worker(listener, notify_read, notify_write)] = True
+    except KeyboardInterrupt:
+        print('stopping the server...')
+    finally:
+        listener.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        # Jobs in progress run to completion, ready workers are stopped
+        for pid, ready in children.items():
+            if ready:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGTERM)
+
+def run(path, argv, show_timings=False):
+    # Runs argv[0] with argv in a worker of the server at path, returns its exit code
+    start = time.perf_counter()
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(path)
+    payload = json.dumps({'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}).encode()
+    socket.send_fds(conn, [struct.pack('!I', len(payload))], [0, 1, 2])
+    conn.sendall(payload)
+    (pid,) = struct.unpack('!i', _recv_exactly(conn, 4))
+    if show_timings:
+        print('worker {} started the script {:.1f}ms after connecting'.format(pid, (time.perf_counter() - start) * 1e3), file=sys.stderr)
+
+    while True:
+        try:
+            (code,) = struct.unpack('!i', _recv_exactly(conn, 4))
+            return code
+        except KeyboardInterrupt:
+            # Forward Ctrl-C to the script and keep waiting for its exit code
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGINT)
+        except ConnectionError:
+            print('worker {} exited without an exit code'.format(pid), file=sys.stderr)
+            return 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='lazy GI imports, startup timings and a pre-initialized fork server')
+    parser.add_argument('--socket', default=None, help='server socket (default: $GST_EXAMPLES_BOOTSTRAP_SOCKET or one per user)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    timings_parser = commands.add_parser('timings', help='print the startup time breakdown of the namespaces')
+    timings_parser.add_argument('--preload', default=','.join(DEFAULT_PRELOAD), help='comma separated namespaces to import')
+    serve_parser = commands.add_parser('serve', help='run the fork server')
+    serve_parser.add_argument('--workers', type=int, default=2, help='ready workers waiting for a job')
+    serve_parser.add_argument('--preload', default=','.join(DEFAULT_PRELOAD), help='comma separated namespaces to import before forking')
+    run_parser = commands.add_parser('run', help='run a script in a worker of the fork server')
+    run_parser.add_argument('--timings', action='store_true', help='print how long the worker took to start the script')
+    run_parser.add_argument('script')
+    run_parser.add_argument('arguments', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    path = args.socket or default_socket_path()
+    if args.command == 'timings':
+        for name in args.preload.split(','):
+            namespace(name).load()
+        init()
+        print('\n'.join(startup_report()))
+    elif args.command == 'serve':
+        serve(path, args.workers, [name for name in args.preload.split(',') if name])
+    elif args.command == 'run':
+        try:
+            sys.exit(run(path, [args.script] + args.arguments, args.timings))
+        except OSError as error:
+            if error.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                print('no fork server on {}, start one with python3 gst_bootstrap.py serve'.format(path), file=sys.stderr)
+                sys.exit(1)
+            raise
@@ -0,0 +1,177 @@
+import threading
+import collections
+
+import metrics
+from gst_bootstrap import Gst
+
+# End-to-end latency of the buffers of a source, e.g. the app_source of
+# basic-tutorial-8.py, through the tee and queues to every sink.
+#
+# Each traced buffer gets an origin time on the pipeline clock. Producers that
+# create their buffers, like push_data in basic-tutorial-8.py, tag them with
+# tag() before pushing: the origin travels with the buffer in a
+# ReferenceTimestampMeta. When the producer does not call tag(), buffers are
+# timed when they leave the source pad instead and found again downstream by
+# their PTS. Once it does, the source pad no longer times the buffers left
+# untagged by sample_every, so that every latency starts at the push. A probe
+# on the sink pads of every element downstream measures the arrival, and the
+# latency is observed in the buffer_latency_seconds histogram of the path the
+# buffer took, e.g. app_source>tee>app_queue>app_sink:
+#
+#     tracer = LatencyTracer(pipeline, app_source)
+#     tracer.start()          # once the pipeline is linked and at least READY
+#     ...
+#     tracer.stop()
+#     tracer.report()
+#
+# A Python probe on every element costs time in every streaming thread, trace
+# one buffer out of sample_every to keep the overhead down.
+
+# Caps of the ReferenceTimestampMeta carrying the origin
+REFERENCE_CAPS = 'timestamp/x-gst-examples-latency'
+# Origins of untagged buffers kept for the PTS lookup
+MAX_PENDING_ORIGINS = 4096
+
+def upstream_element(pad):
+    # The element feeding pad, looking through the ghost pads of bins
+    peer = pad.get_peer()
+    while peer is not None:
+        if isinstance(peer, Gst.GhostPad):
+            # The src ghost pad of a bin, continue from the pad inside it
+            peer = peer.get_target()
+            continue
+        parent = peer.get_parent()
+        if isinstance(parent, Gst.GhostPad):
+            # Inside a bin, continue from the sink ghost pad to the element outside
+            peer = parent.get_peer()
+            continue
+        return parent
+    return None
+
+class LatencyTracer():
+
+    def __init__(self, pipeline, source, elements=None, sample_every=1):
+        self.pipeline = pipeline
+        self.source = source
+        # Elements to measure at, every element downstream of the source when None
+        self.elements = elements
+        self.sample_every = max(1, sample_every)
+
+        self._caps = Gst.Caps.from_string(REFERENCE_CAPS)
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pipeline.html#Gst.Pipeline.get_pipeline_clock
+        self._clock = pipeline.get_pipeline_clock()
+        self._tagged = 0
+        self._untagged = 0
+        # Set by the first tag(), the producer then chooses the traced buffers
+        self._producer_tags = False
+        self._lock = threading.Lock()
+        # PTS -> origin of the untagged buffers
+        self._origins = collections.OrderedDict()
+        # path -> histogram
+        self.paths = {}
+        self._probes = []
+
+    def now(self):
+        return self._clock.get_time()
+
+    def tag(self, buffer):
+        # Stores the origin in a writable buffer about to be pushed into the source
+        self._producer_tags = True
+        self._tagged += 1
+        if self._tagged % self.sample_every:
+            return
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.add_reference_timestamp_meta
+        buffer.add_reference_timestamp_meta(self._caps, self.now(), Gst.CLOCK_TIME_NONE)
+
+    def origin(self, buffer):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.get_reference_timestamp_meta
+        meta = buffer.get_reference_timestamp_meta(self._caps)
+        if meta is not None:
+            return meta.timestamp
+        with self._lock:
+            return self._origins.get(buffer.pts)
+
+    def path_to(self, element):
+        names = [element.get_name()]
+        current = element
+        while current is not None and current != self.source and len(names) < 64:
+            sink_pads = [pad for pad in current.sinkpads if pad.is_linked()]
+            if not sink_pads:
+                return None
+            current = upstream_element(sink_pads[0])
+            if current is not None:
+                names.append(current.get_name())
+        if current != self.source:
+            return None
+        return '>'.join(reversed(names))
+
+    def find_elements(self):
+        if self.elements is not None:
+            return self.elements
+        elements = []
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.iterate_recurse
+        iterator = self.pipeline.iterate_recurse()
+        while True:
+            result, element = iterator.next()
+            if result == Gst.IteratorResult.RESYNC:
+                iterator.resync()
+                elements = []
+                continue
+            if result != Gst.IteratorResult.OK:
+                break
+            # Bins are measured at the elements inside them
+            if element != self.source and not isinstance(element, Gst.Bin):
+                elements.append(element)
+        return elements
+
+    def start(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.add_probe
+        for pad in self.source.srcpads:
+            self._probes.append((pad, pad.add_probe(Gst.PadProbeType.BUFFER, self.on_source_buffer)))
+        for element in self.find_elements():
+            path = self.path_to(element)
+            if path is None:
+                # Not downstream of the source
+                continue
+            histogram = metrics.REGISTRY.histogram('buffer_latency_seconds', 'Time from a buffer leaving the source to it reaching an element',
+                                                   path=path)
+            self.paths[path] = histogram
+            for pad in element.sinkpads:
+                self._probes.append((pad, pad.add_probe(Gst.PadProbeType.BUFFER, self.on_arrival, histogram)))
+
+    def on_source_buffer(self, pad, info):
+        if self._producer_tags:
+            return Gst.PadProbeReturn.OK
+        buffer = info.get_buffer()
+        if buffer.get_reference_timestamp_meta(self._caps) is not None:
+            return Gst.PadProbeReturn.OK
+        self._untagged += 1
+        if self._untagged % self.sample_every or buffer.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        with self._lock:
+            self._origins[buffer.pts] = self.now()
+            while len(self._origins) > MAX_PENDING_ORIGINS:
+                self._origins.popitem(last=False)
+        return Gst.PadProbeReturn.OK
+
+    def on_arrival(self, pad, info, histogram):
+        # Runs in the streaming thread of each branch
+        origin = self.origin(info.get_buffer())
+        if origin is not None:
+            histogram.observe((self.now() - origin) / Gst.SECOND)
+        return Gst.PadProbeReturn.OK
+
+    def stop(self):
+        for pad, probe_id in self._probes:
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.remove_probe
+            pad.remove_probe(probe_id)
+        self._probes = []
+        with self._lock:
+            self._origins.clear()
+
+    def report(self):
+        for path, histogram in sorted(self.paths.items()):
+            if histogram.count == 0:
+                continue
+            print('{}: {} buffers, p50 {:.3f}ms p99 {:.3f}ms max {:.3f}ms'.format(
+                path, histogram.count, histogram.quantile(0.5) * 1e3, histogram.quantile(0.99) * 1e3, histogram.max * 1e3))
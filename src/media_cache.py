@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import argparse
+import tempfile
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Local content-addressed cache for the remote media played by the tutorials.
+#
+# resolve_uri() maps an http(s) URI to a file:// URI in the cache, downloading
+# it on the first use. Files are stored under objects/ by the SHA-256 of their
+# content, so two URIs serving the same bytes share one file. When the cache
+# grows over its size limit, the least recently used files are evicted.
+#
+# Environment variables:
+#     GST_EXAMPLES_CACHE_DIR        cache directory, ~/.cache/gst-examples/media by default
+#     GST_EXAMPLES_CACHE_MAX_BYTES  size limit, 2 GiB by default
+#     GST_EXAMPLES_OFFLINE=1        never download, fail fast with CacheMissError on a miss
+#     GST_EXAMPLES_CACHE=0          disable the cache and play remote URIs directly
+#
+# A failed download raises FetchError. Both are a CacheError, which the
+# tutorials catch to exit before building their pipeline.
+#
+# Warm the cache before going offline with
+#     python3 media_cache.py prefetch https://www.freedesktop.org/software/gstreamer-sdk/data/media/sintel_trailer-480p.webm
+
+# The media used by basic-tutorial-1.py, basic-tutorial-3.py and basic-tutorial-4.py
+SINTEL_TRAILER_URI = 'https://www.freedesktop.org/software/gstreamer-sdk/data/media/sintel_trailer-480p.webm'
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+REMOTE_SCHEMES = ('http', 'https')
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+
+class CacheError(Exception):
+    pass
+
+class CacheMissError(CacheError):
+    pass
+
+class FetchError(CacheError):
+    pass
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() not in ('', '0', 'false', 'no', 'off')
+
+class MediaCache():
+
+    def __init__(self, directory=None, max_bytes=None, offline=None, timeout=30):
+        if directory is None:
+            directory = os.environ.get('GST_EXAMPLES_CACHE_DIR',
+                                       os.path.join(os.path.expanduser('~'), '.cache', 'gst-examples', 'media'))
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('GST_EXAMPLES_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        if offline is None:
+            offline = _env_flag('GST_EXAMPLES_OFFLINE', False)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.timeout = timeout
+
+        self._index_path = os.path.join(directory, 'index.json')
+        self._lock_path = os.path.join(directory, 'index.lock')
+        self._objects = os.path.join(directory, 'objects')
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects, digest[:2], digest)
+
+    def _lock(self):
+        # Serializes index updates between processes sharing the cache
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(self._lock_path, 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'uris': {}, 'objects': {}}
+
+    def _save_index(self, index):
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix='index-', suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(path, self._index_path)
+
+    def lookup(self, uri):
+        # Returns the cached path of uri, or None, and marks it as recently used
+        with self._lock():
+            index = self._load_index()
+            digest = index['uris'].get(uri)
+            if digest is None:
+                return None
+            path = self._object_path(digest)
+            if not os.path.exists(path):
+                # Removed behind our back, forget it
+                del index['uris'][uri]
+                index['objects'].pop(digest, None)
+                self._save_index(index)
+                return None
+            index['objects'][digest]['last_used'] = time.time()
+            self._save_index(index)
+            return path
+
+    def fetch(self, uri):
+        # Downloads uri into the cache and returns its path
+        os.makedirs(self._objects, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, download_path = tempfile.mkstemp(dir=self._objects, prefix='download-')
+        try:
+            try:
+                with os.fdopen(fd, 'wb') as f, urllib.request.urlopen(uri, timeout=self.timeout) as response:
+                    while True:
+                        block = response.read(DOWNLOAD_BLOCK_SIZE)
+                        if not block:
+                            break
+                        sha256.update(block)
+                        f.write(block)
+                        size += len(block)
+            # HTTPError is a URLError, a timeout is an OSError
+            except (urllib.error.URLError, http.client.HTTPException, OSError) as error:
+                raise FetchError('failed to download {}: {}'.format(uri, getattr(error, 'reason', error))) from error
+
+            digest = sha256.hexdigest()
+            path = self._object_path(digest)
+            with self._lock():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if os.path.exists(path):
+                    # Same content under another URI
+                    os.unlink(download_path)
+                else:
+                    os.replace(download_path, path)
+                index = self._load_index()
+                index['uris'][uri] = digest
+                index['objects'][digest] = {'size': size, 'last_used': time.time()}
+                self._evict(index, keep=digest)
+                self._save_index(index)
+            return path
+        finally:
+            if os.path.exists(download_path):
+                os.unlink(download_path)
+
+    def _evict(self, index, keep=None):
+        objects = index['objects']
+        total = sum(entry['size'] for entry in objects.values())
+        for digest in sorted(objects, key=lambda digest: objects[digest]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            total -= objects.pop(digest)['size']
+            try:
+                os.unlink(self._object_path(digest))
+            except FileNotFoundError:
+                pass
+            index['uris'] = {uri: cached for uri, cached in index['uris'].items() if cached != digest}
+
+    def evict(self):
+        with self._lock():
+            index = self._load_index()
+            self._evict(index)
+            self._save_index(index)
+
+    def resolve(self, uri):
+        # Returns a file:// URI for remote URIs, other URIs are returned unchanged
+        if urllib.parse.urlsplit(uri).scheme not in REMOTE_SCHEMES:
+            return uri
+        path = self.lookup(uri)
+        if path is None:
+            if self.offline:
+                raise CacheMissError('{} is not cached and the cache is offline'.format(uri))
+            path = self.fetch(uri)
+        return 'file://' + urllib.request.pathname2url(os.path.abspath(path))
+
+    def entries(self):
+        index = self._load_index()
+        objects = index['objects']
+        return [(uri, digest, objects.get(digest, {}).get('size', 0)) for uri, digest in sorted(index['uris'].items())]
+
+    def clear(self):
+        with self._lock():
+            shutil.rmtree(self._objects, ignore_errors=True)
+            self._save_index({'uris': {}, 'objects': {}})
+
+def resolve_uri(uri):
+    # Used by the tutorials before they hand a URI to playbin or uridecodebin
+    if not _env_flag('GST_EXAMPLES_CACHE', True):
+        return uri
+    return MediaCache().resolve(uri)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local cache of the media played by the tutorials')
+    parser.add_argument('--directory', default=None, help='cache directory (default: $GST_EXAMPLES_CACHE_DIR or ~/.cache/gst-examples/media)')
+    parser.add_argument('--max-bytes', type=int, default=None, help='cache size limit')
+    commands = parser.add_subparsers(dest='command', required=True)
+    prefetch_parser = commands.add_parser('prefetch', help='download URIs into the cache')
+    prefetch_parser.add_argument('uris', nargs='*', default=[SINTEL_TRAILER_URI])
+    resolve_parser = commands.add_parser('resolve', help='print the file:// URI of cached URIs')
+    resolve_parser.add_argument('uris', nargs='+')
+    commands.add_parser('list', help='list the cached URIs')
+    commands.add_parser('clear', help='remove everything from the cache')
+    args = parser.parse_args()
+
+    cache = MediaCache(args.directory, args.max_bytes, offline=args.command == 'resolve')
+    if args.command == 'prefetch':
+        for uri in args.uris:
+            start = time.monotonic()
+            try:
+                print('{} -> {} ({:.2f}s)'.format(uri, cache.resolve(uri), time.monotonic() - start))
+            except CacheError as error:
+                print(error)
+                sys.exit(1)
+    elif args.command == 'resolve':
+        try:
+            for uri in args.uris:
+                print(cache.resolve(uri))
+        except CacheError as error:
+            print(error)
+            sys.exit(1)
+    elif args.command == 'list':
+        for uri, digest, size in cache.entries():
+            print('{} {} {} bytes'.format(digest, uri, size))
+    elif args.command == 'clear':
+        cache.clear()
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metrics shared by the tutorials: counters, gauges and latency histograms kept
+# in a registry, exported as JSON or in the Prometheus text format.
+#
+# Per-buffer and per-message output goes through the 'gst-examples' logger.
+# Wrap anything more expensive than a constant string in
+#     if log.isEnabledFor(logging.DEBUG):
+# so that nothing is formatted when debug logging is off.
+#
+# Environment variables:
+#     GST_EXAMPLES_LOG_LEVEL     logging level, INFO by default
+#     GST_EXAMPLES_METRICS_PORT  serve /metrics and /metrics.json on this port
+
+log = logging.getLogger('gst-examples')
+
+def configure_logging(level=None):
+    if level is None:
+        level = os.environ.get('GST_EXAMPLES_LOG_LEVEL', 'INFO')
+    logging.basicConfig(format='%(message)s')
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+
+# Latency buckets in seconds, from 1us to 10s
+DEFAULT_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005,
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in items) + '}'
+
+class Counter():
+    kind = 'counter'
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+        # Counters are updated from streaming threads as well as the main thread
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def prometheus_lines(self):
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels), self.value)]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+class Histogram():
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # One count per bucket, plus one for values above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def time(self):
+        # with histogram.time(): ...
+        return _Timer(self)
+
+    def quantile(self, q):
+        # Estimated by linear interpolation inside the bucket holding the quantile
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            maximum = self.max
+        if count == 0:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else maximum
+                upper = min(upper, maximum)
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return maximum
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+    def prometheus_lines(self):
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += bucket_count
+            lines.append('{}_bucket{} {}'.format(self.name, _format_labels(self.labels, ('le', bound)), cumulative))
+        lines.append('{}_sum{} {}'.format(self.name, _format_labels(self.labels), self.sum))
+        lines.append('{}_count{} {}'.format(self.name, _format_labels(self.labels), self.count))
+        return lines
+
+class _Timer():
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class Registry():
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        labels = tuple(sorted(labels.items()))
+        key = (name, labels)
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = cls(name, help, labels, **kwargs)
+                    self._metrics[key] = metric
+        return metric
+
+    def counter(self, name, help='', **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', **labels):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self):
+        result = {}
+        for metric in self.metrics():
+            entry = result.setdefault(metric.name, {'type': metric.kind, 'help': metric.help, 'values': []})
+            entry['values'].append({'labels': dict(metric.labels), 'value': metric.snapshot()})
+        return result
+
+    def to_json(self, indent=None):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self):
+        lines = []
+        described = set()
+        for metric in sorted(self.metrics(), key=lambda metric: metric.name):
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help:
+                    lines.append('# HELP {} {}'.format(metric.name, metric.help))
+                lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.prometheus_lines())
+        return '\n'.join(lines) + '\n'
+
+# The registry shared by everything in a process
+REGISTRY = Registry()
+
+def count_bus_message(message_type_name):
+    REGISTRY.counter('gst_bus_messages_total', 'Bus messages handled', type=message_type_name).inc()
+
+class MetricsServer():
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        # path -> (content type, callable returning the body as str)
+        self.routes = {
+            '/metrics': ('text/plain; version=0.0.4', registry.to_prometheus),
+            '/metrics.json': ('application/json', registry.to_json),
+        }
+        self._server = None
+        self._thread = None
+
+    def add_route(self, path, content_type, render):
+        self.routes[path] = (content_type, render)
+
+    def start(self, port, host=''):
+        routes = self.routes
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                route = routes.get(self.path.split('?', 1)[0])
+                if route is None:
+                    self.send_error(404)
+                    return
+                content_type, render = route
+                body = render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug('metrics server: ' + format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        log.info('serving metrics on port {}'.format(self._server.server_address[1]))
+        return self._server.server_address[1]
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+
+def serve_from_env(registry=REGISTRY):
+    port = os.environ.get('GST_EXAMPLES_METRICS_PORT')
+    if not port:
+        return None
+    server = MetricsServer(registry)
+    server.start(int(port))
+    return server
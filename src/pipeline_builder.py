@@ -0,0 +1,347 @@
+import sys
+import time
+import argparse
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst, GObject
+
+# Builds a pipeline from a declarative spec instead of a chain of
+# Gst.ElementFactory.make / pipeline.add / link calls:
+#
+#     spec = {
+#         'name': 'test-pipeline',
+#         'elements': [
+#             {'name': 'source', 'factory': 'uridecodebin', 'properties': {'uri': uri}},
+#             {'name': 'convert', 'factory': 'audioconvert'},
+#             {'name': 'sink', 'factory': 'autoaudiosink'},
+#         ],
+#         # (upstream, downstream) or (upstream, downstream, caps)
+#         'links': [('source', 'convert', 'audio/x-raw'), ('convert', 'sink')],
+#     }
+#     built = PipelineBuilder().build(spec)
+#     built.pipeline.set_state(Gst.State.PLAYING)
+#
+# Each Gst.ElementFactory is looked up once and cached, together with the
+# presence of its src pad templates. That presence decides how every link is
+# made in the same pass:
+#     always pads     linked right away, with the caps as a filter if given
+#     request pads    a pad is requested and linked, like the tee in tutorials 7 and 8
+#     sometimes pads  linked from pad-added once a pad matching the caps shows up,
+#                     like the uridecodebin in tutorial 3
+#
+# Run this file directly to compare the construction time with the hand-written
+# code of tutorials 3, 7 and 8.
+
+class BuildError(Exception):
+    pass
+
+class BuiltPipeline():
+
+    def __init__(self, pipeline, elements):
+        self.pipeline = pipeline
+        # name -> Gst.Element
+        self.elements = elements
+        # Sometimes-pad links still waiting for their pad: [(upstream, downstream, caps)]
+        self.pending_links = []
+
+    def __getitem__(self, name):
+        return self.elements[name]
+
+class PipelineBuilder():
+
+    # Shared by every builder: factory name -> (Gst.ElementFactory, {src template name: presence})
+    _factories = {}
+
+    def factory(self, factory_name):
+        cached = self._factories.get(factory_name)
+        if cached is None:
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/ElementFactory.html#Gst.ElementFactory.find
+            factory = Gst.ElementFactory.find(factory_name)
+            if factory is None:
+                raise BuildError('no element factory named {}'.format(factory_name))
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/ElementFactory.html#Gst.ElementFactory.get_static_pad_templates
+            src_templates = {template.name_template: template.presence
+                             for template in factory.get_static_pad_templates()
+                             if template.direction == Gst.PadDirection.SRC}
+            cached = (factory, src_templates)
+            self._factories[factory_name] = cached
+        return cached
+
+    def build(self, spec):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pipeline.html#Gst.Pipeline.new
+        pipeline = Gst.Pipeline.new(spec.get('name'))
+        elements = {}
+        src_templates = {}
+
+        for element_spec in spec['elements']:
+            name = element_spec['name']
+            factory, templates = self.factory(element_spec['factory'])
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/ElementFactory.html#Gst.ElementFactory.create
+            element = factory.create(name)
+            if element is None:
+                raise BuildError('failed to create {} from {}'.format(name, element_spec['factory']))
+            self.set_properties(element, element_spec.get('properties'))
+            pipeline.add(element)
+            elements[name] = element
+            src_templates[name] = templates
+
+        built = BuiltPipeline(pipeline, elements)
+        for link in spec.get('links', ()):
+            upstream, downstream = link[0], link[1]
+            caps = Gst.Caps.from_string(link[2]) if len(link) > 2 and link[2] is not None else None
+            if upstream not in elements or downstream not in elements:
+                raise BuildError('link {} -> {} refers to an unknown element'.format(upstream, downstream))
+            self.link(built, upstream, downstream, caps, src_templates[upstream])
+
+        if built.pending_links:
+            self.connect_pad_added(built)
+        return built
+
+    def set_properties(self, element, properties):
+        if not properties:
+            return
+        values = {}
+        for name, value in properties.items():
+            # Enum and flag properties can be given by their nick, e.g. 'leaky': 'downstream'
+            pspec = element.find_property(name)
+            if pspec is None:
+                raise BuildError('{} has no property {}'.format(element.get_name(), name))
+            if isinstance(value, str) and pspec.value_type != GObject.TYPE_STRING:
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.util_set_object_arg
+                Gst.util_set_object_arg(element, name, value)
+            else:
+                values[name] = value
+        if values:
+            # https://lazka.github.io/pgi-docs/#GObject-2.0/classes/Object.html#GObject.Object.set_properties
+            element.set_properties(**values)
+
+    def link(self, built, upstream, downstream, caps, templates):
+        src = built.elements[upstream]
+        sink = built.elements[downstream]
+        presences = set(templates.values())
+
+        if Gst.PadPresence.ALWAYS in presences:
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.link_filtered
+            linked = src.link_filtered(sink, caps) if caps is not None else src.link(sink)
+            if not linked:
+                raise BuildError('failed to link {} -> {}'.format(upstream, downstream))
+        elif Gst.PadPresence.REQUEST in presences:
+            template_name = next(name for name, presence in templates.items() if presence == Gst.PadPresence.REQUEST)
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.request_pad_simple
+            if hasattr(src, 'request_pad_simple'):
+                src_pad = src.request_pad_simple(template_name)
+            else:
+                src_pad = src.get_request_pad(template_name)
+            if src_pad is None:
+                raise BuildError('failed to request a {} pad from {}'.format(template_name, upstream))
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.get_compatible_pad
+            sink_pad = sink.get_compatible_pad(src_pad, caps)
+            if sink_pad is None or src_pad.link(sink_pad) != Gst.PadLinkReturn.OK:
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.release_request_pad
+                src.release_request_pad(src_pad)
+                raise BuildError('failed to link the request pad {} -> {}'.format(upstream, downstream))
+        elif Gst.PadPresence.SOMETIMES in presences:
+            built.pending_links.append((upstream, downstream, caps))
+        else:
+            raise BuildError('{} has no src pad to link to {}'.format(upstream, downstream))
+
+    def connect_pad_added(self, built):
+        # One handler per element with sometimes pads, linking whichever pending link matches the new pad
+        for upstream in set(link[0] for link in built.pending_links):
+            built.elements[upstream].connect('pad-added', self.pad_added_handler, built)
+
+    def pad_added_handler(self, src, new_pad, built):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.get_current_caps
+        new_pad_caps = new_pad.get_current_caps() or new_pad.query_caps(None)
+        for link in list(built.pending_links):
+            upstream, downstream, caps = link
+            if built.elements[upstream] != src:
+                continue
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Caps.html#Gst.Caps.can_intersect
+            if caps is not None and not new_pad_caps.can_intersect(caps):
+                continue
+            sink_pad = built.elements[downstream].get_compatible_pad(new_pad, new_pad_caps)
+            if sink_pad is None or sink_pad.is_linked():
+                continue
+            if new_pad.link(sink_pad) == Gst.PadLinkReturn.OK:
+                built.pending_links.remove(link)
+                return
+
+def tutorial_3_spec(uri='file:///dev/null'):
+    return {
+        'name': 'test-pipeline',
+        'elements': [
+            {'name': 'source', 'factory': 'uridecodebin', 'properties': {'uri': uri}},
+            {'name': 'convert', 'factory': 'audioconvert'},
+            {'name': 'sink', 'factory': 'autoaudiosink'},
+        ],
+        'links': [('source', 'convert', 'audio/x-raw'), ('convert', 'sink')],
+    }
+
+def tutorial_7_spec():
+    return {
+        'name': 'test-pipeline',
+        'elements': [
+            {'name': 'audio_source', 'factory': 'audiotestsrc', 'properties': {'freq': 215.0}},
+            {'name': 'tee', 'factory': 'tee'},
+            {'name': 'audio_queue', 'factory': 'queue'},
+            {'name': 'audio_convert', 'factory': 'audioconvert'},
+            {'name': 'audio_resample', 'factory': 'audioresample'},
+            {'name': 'audio_sink', 'factory': 'autoaudiosink'},
+            {'name': 'video_queue', 'factory': 'queue'},
+            {'name': 'visual', 'factory': 'wavescope', 'properties': {'shader': 0, 'style': 1}},
+            {'name': 'csp', 'factory': 'videoconvert'},
+            {'name': 'video_sink', 'factory': 'autovideosink'},
+        ],
+        'links': [
+            ('audio_source', 'tee'),
+            ('tee', 'audio_queue'), ('audio_queue', 'audio_convert'), ('audio_convert', 'audio_resample'), ('audio_resample', 'audio_sink'),
+            ('tee', 'video_queue'), ('video_queue', 'visual'), ('visual', 'csp'), ('csp', 'video_sink'),
+        ],
+    }
+
+def tutorial_8_spec(audio_caps='audio/x-raw,format=S16LE,channels=1,rate=44100,layout=interleaved'):
+    caps = Gst.Caps.from_string(audio_caps)
+    return {
+        'name': 'test-pipeline',
+        'elements': [
+            {'name': 'app_source', 'factory': 'appsrc', 'properties': {'caps': caps, 'format': Gst.Format.TIME}},
+            {'name': 'tee', 'factory': 'tee'},
+            {'name': 'audio_queue', 'factory': 'queue'},
+            {'name': 'audio_convert1', 'factory': 'audioconvert'},
+            {'name': 'audio_resample', 'factory': 'audioresample'},
+            {'name': 'audio_sink', 'factory': 'autoaudiosink'},
+            {'name': 'video_queue', 'factory': 'queue'},
+            {'name': 'audio_convert2', 'factory': 'audioconvert'},
+            {'name': 'visual', 'factory': 'wavescope', 'properties': {'shader': 0, 'style': 1}},
+            {'name': 'video_convert', 'factory': 'videoconvert'},
+            {'name': 'video_sink', 'factory': 'autovideosink'},
+            {'name': 'app_queue', 'factory': 'queue'},
+            {'name': 'app_sink', 'factory': 'appsink', 'properties': {'emit-signals': True, 'caps': caps}},
+        ],
+        'links': [
+            ('app_source', 'tee'),
+            ('tee', 'audio_queue'), ('audio_queue', 'audio_convert1'), ('audio_convert1', 'audio_resample'), ('audio_resample', 'audio_sink'),
+            ('tee', 'video_queue'), ('video_queue', 'audio_convert2'), ('audio_convert2', 'visual'), ('visual', 'video_convert'), ('video_convert', 'video_sink'),
+            ('tee', 'app_queue'), ('app_queue', 'app_sink'),
+        ],
+    }
+
+# The hand-written construction code of the tutorials, for the benchmark
+
+def make_and_add(pipeline, factory_name, name):
+    element = Gst.ElementFactory.make(factory_name, name)
+    pipeline.add(element)
+    return element
+
+def build_tutorial_3_by_hand(uri='file:///dev/null'):
+    pipeline = Gst.Pipeline.new("test-pipeline")
+    source = make_and_add(pipeline, "uridecodebin", "source")
+    convert = make_and_add(pipeline, "audioconvert", "convert")
+    sink = make_and_add(pipeline, "autoaudiosink", "sink")
+    convert.link(sink)
+    source.set_property('uri', uri)
+
+    def pad_added_handler(src, new_pad):
+        sink_pad = convert.get_static_pad('sink')
+        if not sink_pad.is_linked() and new_pad.get_current_caps().get_structure(0).get_name().startswith('audio/x-raw'):
+            new_pad.link(sink_pad)
+
+    source.connect("pad-added", pad_added_handler)
+    return pipeline
+
+def build_tutorial_7_by_hand():
+    pipeline = Gst.Pipeline.new("test-pipeline")
+    audio_source = make_and_add(pipeline, "audiotestsrc", "audio_source")
+    tee = make_and_add(pipeline, "tee", "tee")
+    audio_queue = make_and_add(pipeline, "queue", "audio_queue")
+    audio_convert = make_and_add(pipeline, "audioconvert", "audio_convert")
+    audio_resample = make_and_add(pipeline, "audioresample", "audio_resample")
+    audio_sink = make_and_add(pipeline, "autoaudiosink", "audio_sink")
+    video_queue = make_and_add(pipeline, "queue", "video_queue")
+    visual = make_and_add(pipeline, "wavescope", "visual")
+    video_convert = make_and_add(pipeline, "videoconvert", "csp")
+    video_sink = make_and_add(pipeline, "autovideosink", "video_sink")
+    audio_source.set_property('freq', 215.0)
+    visual.set_property('shader', 0)
+    visual.set_property('style', 1)
+    audio_source.link(tee)
+    audio_queue.link(audio_convert)
+    audio_convert.link(audio_resample)
+    audio_resample.link(audio_sink)
+    video_queue.link(visual)
+    visual.link(video_convert)
+    video_convert.link(video_sink)
+    tee.get_request_pad("src_%u").link(audio_queue.get_static_pad("sink"))
+    tee.get_request_pad("src_%u").link(video_queue.get_static_pad("sink"))
+    return pipeline
+
+def build_tutorial_8_by_hand(audio_caps='audio/x-raw,format=S16LE,channels=1,rate=44100,layout=interleaved'):
+    caps = Gst.Caps.from_string(audio_caps)
+    pipeline = Gst.Pipeline.new("test-pipeline")
+    app_source = make_and_add(pipeline, "appsrc", "app_source")
+    tee = make_and_add(pipeline, "tee", "tee")
+    audio_queue = make_and_add(pipeline, "queue", "audio_queue")
+    audio_convert1 = make_and_add(pipeline, "audioconvert", "audio_convert1")
+    audio_resample = make_and_add(pipeline, "audioresample", "audio_resample")
+    audio_sink = make_and_add(pipeline, "autoaudiosink", "audio_sink")
+    video_queue = make_and_add(pipeline, "queue", "video_queue")
+    audio_convert2 = make_and_add(pipeline, "audioconvert", "audio_convert2")
+    visual = make_and_add(pipeline, "wavescope", "visual")
+    video_convert = make_and_add(pipeline, "videoconvert", "video_convert")
+    video_sink = make_and_add(pipeline, "autovideosink", "video_sink")
+    app_queue = make_and_add(pipeline, "queue", "app_queue")
+    app_sink = make_and_add(pipeline, "appsink", "app_sink")
+    visual.set_property('shader', 0)
+    visual.set_property('style', 1)
+    app_source.set_property("caps", caps)
+    app_source.set_property("format", Gst.Format.TIME)
+    app_sink.set_property("emit-signals", True)
+    app_sink.set_property("caps", caps)
+    app_source.link(tee)
+    audio_queue.link(audio_convert1)
+    audio_convert1.link(audio_resample)
+    audio_resample.link(audio_sink)
+    video_queue.link(audio_convert2)
+    audio_convert2.link(visual)
+    visual.link(video_convert)
+    video_convert.link(video_sink)
+    app_queue.link(app_sink)
+    tee.get_request_pad("src_%u").link(audio_queue.get_static_pad("sink"))
+    tee.get_request_pad("src_%u").link(video_queue.get_static_pad("sink"))
+    tee.get_request_pad("src_%u").link(app_queue.get_static_pad("sink"))
+    return pipeline
+
+def measure(build, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        build()
+    return (time.perf_counter() - start) / iterations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200, help='pipelines built per measurement')
+    args = parser.parse_args()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
+    print('initializing Gst...')
+    gst_bootstrap.init()
+
+    builder = PipelineBuilder()
+    cases = (
+        ('basic-tutorial-3', build_tutorial_3_by_hand, tutorial_3_spec),
+        ('basic-tutorial-7', build_tutorial_7_by_hand, tutorial_7_spec),
+        ('basic-tutorial-8', build_tutorial_8_by_hand, tutorial_8_spec),
+    )
+    for name, by_hand, spec in cases:
+        try:
+            # Warm up both paths, so that plugin loading is not measured
+            by_hand()
+            builder.build(spec())
+        except BuildError as error:
+            print('{}: {}'.format(name, error))
+            sys.exit(1)
+        hand_time = measure(by_hand, args.iterations)
+        builder_time = measure(lambda: builder.build(spec()), args.iterations)
+        print('{}: hand-written {:.1f}us, builder {:.1f}us per pipeline ({:+.1%})'.format(
+            name, hand_time * 1e6, builder_time * 1e6, builder_time / hand_time - 1))
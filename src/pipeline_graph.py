@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+
+import metrics
+from metrics import log
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst, GLib
+from element_profiler import ElementProfiler
+
+# A picture of a running pipeline: every element, grouped by the bins it is
+# in, and every link between elements, annotated with its negotiated caps and
+# the buffers/s and bytes/s of its src pad. Queues also show how full they are.
+#
+#     graph = PipelineGraph(pipeline)         # or PipelineGraph(pipeline, profiler)
+#     graph.start()                           # once the pipeline is PLAYING
+#     graph.serve(metrics_server)             # GET /pipeline.dot and /pipeline.json
+#     graph.dump_on_signal()                  # kill -USR1 <pid> writes both to files
+#     ...
+#     graph.stop()
+#
+# The buffers and bytes are counted by the src pad probes of an
+# ElementProfiler: the one given, e.g. by --profile in basic-tutorial-7.py and
+# basic-tutorial-8.py, so that every pad has one probe, or one the graph
+# starts itself. The rates are those of the last interval the probes were
+# installed in. Nothing is paused to take a snapshot: the caps and the queue
+# levels are read as they are. Render a snapshot with
+#
+#     dot -Tsvg pipeline.dot > pipeline.svg
+#     python3 pipeline_graph.py 'audiotestsrc is-live=true ! queue ! audioconvert ! autoaudiosink' --duration 3
+
+# Caps fields shown on the links, the full caps are in the JSON
+CAPS_FIELDS = ('format', 'rate', 'channels', 'width', 'height', 'framerate')
+QUEUES = ('queue', 'queue2')
+
+
+def downstream_pad(src_pad):
+    # The sink pad of the element src_pad feeds, looking through the ghost pads of bins
+    peer = src_pad.get_peer()
+    while peer is not None:
+        parent = peer.get_parent()
+        if isinstance(parent, Gst.GhostPad):
+            # The inside of the src ghost pad of a bin, continue outside of it
+            peer = parent.get_peer()
+            continue
+        if isinstance(peer, Gst.GhostPad):
+            # The sink ghost pad of a bin, continue with the pad inside it
+            peer = peer.get_target()
+            continue
+        return peer
+    return None
+
+def bin_path(element, pipeline):
+    # Names of the bins between the pipeline and element, outermost first
+    path = []
+    parent = element.get_parent()
+    while parent is not None and parent != pipeline:
+        path.insert(0, parent.get_name())
+        parent = parent.get_parent()
+    return path
+
+def element_path(element, pipeline):
+    # Element names are only unique inside their bin
+    return '/'.join(bin_path(element, pipeline) + [element.get_name()])
+
+def pad_path(pad, pipeline):
+    return '{}.{}'.format(element_path(pad.get_parent_element(), pipeline), pad.get_name())
+
+def short_caps(caps):
+    if caps is None:
+        return 'not negotiated'
+    if caps.is_any():
+        return 'ANY'
+    structure = caps.get_structure(0)
+    fields = [str(structure.get_value(field)) for field in CAPS_FIELDS if structure.has_field(field)]
+    return ' '.join([structure.get_name()] + fields)
+
+def queue_level(queue):
+    level = {}
+    fill = 0.0
+    for unit in ('buffers', 'bytes', 'time'):
+        # https://gstreamer.freedesktop.org/documentation/coreelements/queue.html#queue:current-level-buffers
+        current = queue.get_property('current-level-' + unit)
+        limit = queue.get_property('max-size-' + unit)
+        level[unit] = current
+        level['max_' + unit] = limit
+        # A limit of 0 is no limit
+        if limit:
+            fill = max(fill, current / limit)
+    level['fill'] = fill
+    return level
+
+class PipelineGraph():
+
+    def __init__(self, pipeline, profiler=None, interval=1.0):
+        self.pipeline = pipeline
+        # Counts the buffers and bytes of the src pads, started and stopped here when it is not given
+        self.profiler = profiler
+        self._own_profiler = profiler is None
+        # Seconds the rates are measured over
+        self.interval = interval
+        # src pad -> (buffers/s, bytes/s)
+        self.rates = {}
+        # src pad -> (buffers, bytes, profiler elapsed) of the last measure
+        self._last = {}
+        self._stopping = threading.Event()
+        self._thread = None
+        self._signal_source = None
+
+    def find_elements(self):
+        elements = []
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.iterate_recurse
+        iterator = self.pipeline.iterate_recurse()
+        while True:
+            result, element = iterator.next()
+            if result == Gst.IteratorResult.RESYNC:
+                iterator.resync()
+                elements = []
+                continue
+            if result != Gst.IteratorResult.OK:
+                break
+            # Bins are drawn as the clusters around the elements inside them
+            if not isinstance(element, Gst.Bin):
+                elements.append(element)
+        return elements
+
+    def start(self):
+        if self._own_profiler:
+            self.profiler = ElementProfiler(self.pipeline)
+            self.profiler.start()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.measure_rates, name='pipeline-graph', daemon=True)
+        self._thread.start()
+
+    def measure_rates(self):
+        while not self._stopping.wait(self.interval):
+            # Over the time the probes were installed, which is less than the interval when the profiler samples
+            elapsed = self.profiler.elapsed()
+            for pad, pad_stats in list(self.profiler.pads.items()):
+                buffers, size = pad_stats.buffers, pad_stats.bytes
+                last = self._last.get(pad)
+                if last is not None and elapsed > last[2]:
+                    self.rates[pad] = ((buffers - last[0]) / (elapsed - last[2]), (size - last[1]) / (elapsed - last[2]))
+                # Between two sample windows the last rates stay
+                if last is None or elapsed > last[2]:
+                    self._last[pad] = (buffers, size, elapsed)
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        if self._own_profiler and self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+        if self._signal_source is not None:
+            GLib.source_remove(self._signal_source)
+            self._signal_source = None
+
+    def snapshot(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.get_state
+        state = self.pipeline.get_state(0)[1]
+        elements = []
+        links = []
+        for element in self.find_elements():
+            factory = element.get_factory()
+            entry = {
+                'id': element_path(element, self.pipeline),
+                'name': element.get_name(),
+                'factory': factory.get_name() if factory is not None else type(element).__name__,
+                'bins': bin_path(element, self.pipeline),
+                'state': Gst.Element.state_get_name(element.get_state(0)[1]),
+            }
+            if entry['factory'] in QUEUES:
+                entry['queue'] = queue_level(element)
+            elements.append(entry)
+
+            for pad in element.srcpads:
+                sink_pad = downstream_pad(pad)
+                if sink_pad is None:
+                    continue
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.get_current_caps
+                caps = pad.get_current_caps()
+                rates = self.rates.get(pad)
+                pad_stats = self.profiler.pads.get(pad) if self.profiler is not None else None
+                links.append({
+                    'src': pad_path(pad, self.pipeline),
+                    'sink': pad_path(sink_pad, self.pipeline),
+                    'caps': caps.to_string() if caps is not None else None,
+                    'short_caps': short_caps(caps),
+                    'buffers_per_second': rates[0] if rates is not None else None,
+                    'bytes_per_second': rates[1] if rates is not None else None,
+                    'buffers': pad_stats.buffers if pad_stats is not None else None,
+                })
+        return {
+            'pipeline': self.pipeline.get_name(),
+            'state': Gst.Element.state_get_name(state),
+            'time': time.time(),
+            'elements': elements,
+            'links': links,
+        }
+
+    def json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def dot(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        lines = ['digraph "{}" {{'.format(snapshot['pipeline']), '  rankdir=LR;',
+                 '  node [shape=box, style="rounded,filled", fillcolor="#ffffff", fontname="sans"];',
+                 '  edge [fontname="sans", fontsize=9];',
+                 '  label="{} ({}) {}";'.format(snapshot['pipeline'], snapshot['state'], time.strftime('%H:%M:%S', time.localtime(snapshot['time'])))]
+
+        # Bins as nested clusters
+        tree = {'elements': [], 'bins': {}}
+        for element in snapshot['elements']:
+            node = tree
+            for name in element['bins']:
+                node = node['bins'].setdefault(name, {'elements': [], 'bins': {}})
+            node['elements'].append(element)
+
+        def add_cluster(node, path, indent):
+            for element in node['elements']:
+                label = '{}\\n{}\\n{}'.format(element['name'], element['factory'], element['state'])
+                fill = '#ffffff'
+                if 'queue' in element:
+                    queue = element['queue']
+                    label += '\\n{} buffers {} bytes {:.3f}s ({:.0%})'.format(
+                        queue['buffers'], queue['bytes'], queue['time'] / Gst.SECOND, queue['fill'])
+                    # From white when empty to red when full
+                    shade = int(255 * (1 - min(queue['fill'], 1.0)))
+                    fill = '#ff{:02x}{:02x}'.format(shade, shade)
+                lines.append('{}"{}" [label="{}", fillcolor="{}"];'.format(indent, element['id'], label, fill))
+            for name, child in sorted(node['bins'].items()):
+                lines.append('{}subgraph "cluster_{}{}" {{'.format(indent, path, name))
+                lines.append('{}  label="{}"; style=dashed;'.format(indent, name))
+                add_cluster(child, path + name + '/', indent + '  ')
+                lines.append('{}}}'.format(indent))
+        add_cluster(tree, '', '  ')
+
+        for link in snapshot['links']:
+            label = link['short_caps']
+            if link['buffers_per_second'] is not None:
+                label += '\\n{:.1f} buffers/s {:.1f} KB/s'.format(link['buffers_per_second'], link['bytes_per_second'] / 1024)
+            src, src_pad = link['src'].rsplit('.', 1)
+            sink, sink_pad = link['sink'].rsplit('.', 1)
+            lines.append('  "{}" -> "{}" [label="{}", taillabel="{}", headlabel="{}"];'.format(
+                src, sink, label.replace('"', '\\"'), src_pad, sink_pad))
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, server):
+        # Adds /pipeline.dot and /pipeline.json to a metrics.MetricsServer
+        if server is None:
+            return
+        server.add_route('/pipeline.dot', 'text/vnd.graphviz', self.dot)
+        server.add_route('/pipeline.json', 'application/json', self.json)
+
+    def dump(self, directory=None):
+        # Writes <pipeline>-<time>.dot and .json, where GStreamer dumps its own graphs when GST_DEBUG_DUMP_DOT_DIR is set
+        directory = directory or os.environ.get('GST_DEBUG_DUMP_DOT_DIR') or os.getcwd()
+        snapshot = self.snapshot()
+        base = os.path.join(directory, '{}-{}'.format(snapshot['pipeline'], time.strftime('%Y%m%d-%H%M%S', time.localtime(snapshot['time']))))
+        with open(base + '.dot', 'w') as f:
+            f.write(self.dot(snapshot))
+        with open(base + '.json', 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        log.info('pipeline graph written to {}.dot and {}.json'.format(base, base))
+        return base
+
+    def dump_on_signal(self, signum=signal.SIGUSR1, directory=None, main_loop=True):
+        # With a GLib main loop running, the signal is handled in it. Without one, e.g. in basic-tutorial-7.py
+        # polling the bus, the Python handler runs in the main thread between two polls
+        if main_loop:
+            # https://lazka.github.io/pgi-docs/#GLib-2.0/functions.html#GLib.unix_signal_add
+            def on_signal():
+                self.dump(directory)
+                return GLib.SOURCE_CONTINUE
+            self._signal_source = GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, on_signal)
+        else:
+            signal.signal(signum, lambda signum, frame: self.dump(directory))
+        log.info('kill -{} {} writes the pipeline graph'.format(signal.Signals(signum).name[3:], os.getpid()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='snapshot a running pipeline as DOT and JSON')
+    parser.add_argument('description', help='pipeline description, as for gst-launch-1.0')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds to run before the last snapshot')
+    parser.add_argument('--directory', default=None, help='where to write the snapshot (default: $GST_DEBUG_DUMP_DOT_DIR or the current directory)')
+    args = parser.parse_args()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
+    print('initializing Gst...')
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    server = metrics.serve_from_env()
+
+    pipeline = Gst.parse_launch(args.description)
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        print('failed to play')
+        pipeline.set_state(Gst.State.NULL)
+        sys.exit(1)
+    pipeline.get_state(Gst.CLOCK_TIME_NONE)
+
+    graph = PipelineGraph(pipeline)
+    graph.start()
+    graph.serve(server)
+    graph.dump_on_signal(main_loop=False)
+    bus = pipeline.get_bus()
+    deadline = time.monotonic() + args.duration
+    gst_message = None
+    try:
+        # Wait in short steps, the SIGUSR1 handler only runs between two of them
+        while gst_message is None and time.monotonic() < deadline:
+            gst_message = bus.timed_pop_filtered(100 * Gst.MSECOND, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+    except KeyboardInterrupt:
+        pass
+    if gst_message is not None and gst_message.type == Gst.MessageType.ERROR:
+        gerror, debug = gst_message.parse_error()
+        print('error {} happened at {}'.format(gerror.message, debug))
+    graph.dump(args.directory)
+    graph.stop()
+    pipeline.set_state(Gst.State.NULL)
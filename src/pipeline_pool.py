@@ -0,0 +1,391 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+import metrics
+from metrics import log
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+
+# Pool of warm pipelines reused across media items.
+#
+# basic-tutorial-3.py and basic-tutorial-4.py build their uridecodebin/playbin
+# pipeline for one uri and tear it down in dispose. A pool builds its pipelines
+# once and keeps them at READY. Reusing one only swaps the uri and prerolls
+# again (READY -> PAUSED), nothing is rebuilt:
+#
+#     pool = PipelinePool('playbin', size=4)
+#     pool.start()
+#     pool.prefetch(next_uri)          # optional, preroll ahead of the request
+#     pooled = pool.acquire(uri)       # PAUSED and prerolled
+#     pooled.pipeline.set_state(Gst.State.PLAYING)
+#     ...
+#     pool.release(pooled)             # back to READY
+#     pool.stop()
+#
+# When every pipeline is in use, acquire() builds a new one rather than wait.
+# Released pipelines beyond size are disposed, so the pool shrinks back after
+# a burst.
+#
+# Run this file directly to compare the time to first buffer of pooled and
+# freshly built pipelines.
+
+class PoolError(Exception):
+    pass
+
+def make_fakesink(name):
+    # Headless and as fast as the decoders, like the sinks of benchmark.py
+    sink = Gst.ElementFactory.make('fakesink', name)
+    sink.set_property('sync', False)
+    return sink
+
+def build_playbin():
+    # The playbin of basic-tutorial-4.py with headless sinks
+    playbin = Gst.ElementFactory.make('playbin', 'playbin')
+    audio_sink = make_fakesink('audio_sink')
+    video_sink = make_fakesink('video_sink')
+    playbin.set_property('audio-sink', audio_sink)
+    playbin.set_property('video-sink', video_sink)
+    return playbin, playbin, [audio_sink, video_sink]
+
+def build_uridecodebin():
+    # The uridecodebin topology of basic-tutorial-3.py with a headless sink
+    pipeline = Gst.Pipeline.new('test-pipeline')
+    source = Gst.ElementFactory.make('uridecodebin', 'source')
+    convert = Gst.ElementFactory.make('audioconvert', 'convert')
+    sink = make_fakesink('sink')
+    for element in (source, convert, sink):
+        pipeline.add(element)
+    convert.link(sink)
+
+    def pad_added_handler(src, new_pad):
+        # Runs again for every uri the pipeline is reused with, the pad of the previous one is gone by then
+        sink_pad = convert.get_static_pad('sink')
+        caps = new_pad.get_current_caps()
+        if sink_pad.is_linked() or caps is None or not caps.get_structure(0).get_name().startswith('audio/x-raw'):
+            return
+        new_pad.link(sink_pad)
+
+    source.connect('pad-added', pad_added_handler)
+    return pipeline, source, [sink]
+
+# Topology name -> function returning (pipeline, element with the uri property, sinks)
+TOPOLOGIES = {
+    'playbin': build_playbin,
+    'uridecodebin': build_uridecodebin,
+}
+
+class PooledPipeline():
+
+    def __init__(self, pipeline, uri_element, sinks):
+        self.pipeline = pipeline
+        self.uri_element = uri_element
+        self.sinks = sinks
+        self.uri = None
+        self.uses = 0
+        # time.monotonic() when the first buffer of the current uri reached a sink
+        self.first_buffer_time = None
+        self._first_buffer = threading.Event()
+        self._probes = []
+
+    def arm_first_buffer_probe(self):
+        self.first_buffer_time = None
+        self._first_buffer.clear()
+        self.remove_probes()
+        for sink in self.sinks:
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.add_probe
+            pad = sink.get_static_pad('sink')
+            self._probes.append((pad, pad.add_probe(Gst.PadProbeType.BUFFER, self.on_first_buffer)))
+
+    def on_first_buffer(self, pad, info):
+        # Runs in the streaming thread
+        if self.first_buffer_time is None:
+            self.first_buffer_time = time.monotonic()
+            self._first_buffer.set()
+        # One buffer per pad is enough, do not call back into Python for the rest
+        self._probes = [probe for probe in self._probes if probe != (pad, info.id)]
+        return Gst.PadProbeReturn.REMOVE
+
+    def remove_probes(self):
+        # Only called while no streaming thread runs, at READY or NULL
+        for pad, probe_id in self._probes:
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.remove_probe
+            pad.remove_probe(probe_id)
+        self._probes = []
+
+    def wait_first_buffer(self, timeout):
+        return self._first_buffer.wait(timeout)
+
+    def drain_bus(self):
+        bus = self.pipeline.get_bus()
+        while bus.pop() is not None:
+            pass
+
+    def preroll(self, uri, timeout):
+        # READY -> swap the uri -> PAUSED, and wait for the preroll
+        self.pipeline.set_state(Gst.State.READY)
+        self.drain_bus()
+        self.uri_element.set_property('uri', uri)
+        self.uri = uri
+        self.uses += 1
+        self.arm_first_buffer_probe()
+
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.set_state
+        if self.pipeline.set_state(Gst.State.PAUSED) == Gst.StateChangeReturn.FAILURE:
+            raise PoolError('failed to preroll {}'.format(uri))
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.timed_pop_filtered
+        gst_message = self.pipeline.get_bus().timed_pop_filtered(
+            int(timeout * Gst.SECOND), Gst.MessageType.ASYNC_DONE | Gst.MessageType.ERROR)
+        if gst_message is None:
+            raise PoolError('{} did not preroll within {}s'.format(uri, timeout))
+        if gst_message.type == Gst.MessageType.ERROR:
+            gerror, debug = gst_message.parse_error()
+            raise PoolError('failed to preroll {}: {}'.format(uri, gerror.message))
+        if self.first_buffer_time is None:
+            # Prerolled on a gap or EOS, there is nothing to play
+            raise PoolError('no buffer of {} reached the sinks'.format(uri))
+
+    def reset(self):
+        self.pipeline.set_state(Gst.State.READY)
+        self.remove_probes()
+        self.drain_bus()
+        self.uri = None
+
+    def dispose(self):
+        self.pipeline.set_state(Gst.State.NULL)
+        self.remove_probes()
+
+class PipelinePool():
+
+    def __init__(self, topology='playbin', size=4, preroll_timeout=10.0, max_uses=0):
+        if topology not in TOPOLOGIES:
+            raise ValueError('unknown topology {}, expected one of {}'.format(topology, ', '.join(TOPOLOGIES)))
+        self.topology = topology
+        self.size = size
+        self.preroll_timeout = preroll_timeout
+        # Rebuild a pipeline after this many media items, 0 to reuse it forever
+        self.max_uses = max_uses
+
+        self._lock = threading.Lock()
+        # Pipelines at READY, and pipelines already prerolled for a uri
+        self._ready = []
+        self._prerolled = []
+        # Slots reserved by release() and _discard() while they reset or build a pipeline outside the lock
+        self._pending = 0
+        self._stopped = False
+
+    def _build(self):
+        pipeline, uri_element, sinks = TOPOLOGIES[self.topology]()
+        pooled = PooledPipeline(pipeline, uri_element, sinks)
+        # Going to READY opens the sinks, do it now rather than on the request path
+        if pipeline.set_state(Gst.State.READY) == Gst.StateChangeReturn.FAILURE:
+            raise PoolError('failed to bring a new {} pipeline to READY'.format(self.topology))
+        return pooled
+
+    def start(self):
+        pipelines = [self._build() for i in range(self.size)]
+        with self._lock:
+            self._ready.extend(pipelines)
+            self._stopped = False
+
+    def prefetch(self, uri):
+        # Prerolls an idle pipeline for uri, so that acquire(uri) finds it ready to play.
+        # Returns False when every pipeline is busy
+        with self._lock:
+            if not self._ready:
+                return False
+            pooled = self._ready.pop()
+        try:
+            pooled.preroll(uri, self.preroll_timeout)
+        except PoolError as error:
+            log.warning('prefetching {} failed: {}'.format(uri, error))
+            self._discard(pooled)
+            return False
+        with self._lock:
+            self._prerolled.append(pooled)
+        return True
+
+    def acquire(self, uri):
+        # Returns a PooledPipeline prerolled in PAUSED for uri
+        start = time.monotonic()
+        with self._lock:
+            if self._stopped:
+                raise PoolError('the pool is stopped')
+            pooled = next((pooled for pooled in self._prerolled if pooled.uri == uri), None)
+            if pooled is not None:
+                self._prerolled.remove(pooled)
+                source = 'prerolled'
+            elif self._ready:
+                pooled = self._ready.pop()
+                source = 'ready'
+            elif self._prerolled:
+                # Take back the pipeline prerolled the longest ago
+                pooled = self._prerolled.pop(0)
+                source = 'ready'
+            else:
+                source = 'new'
+
+        if source == 'new':
+            log.warning('the pool of {} pipelines is exhausted, building a new one'.format(self.size))
+            pooled = self._build()
+        if source != 'prerolled':
+            try:
+                pooled.preroll(uri, self.preroll_timeout)
+            except PoolError:
+                self._discard(pooled)
+                raise
+
+        metrics.REGISTRY.histogram('pipeline_pool_acquire_seconds', 'Time to get a prerolled pipeline from the pool',
+                                   topology=self.topology, source=source).observe(time.monotonic() - start)
+        return pooled
+
+    def _idle(self):
+        # Pipelines waiting in the pool or about to, called with the lock held
+        return len(self._ready) + len(self._prerolled) + self._pending
+
+    def _reserve(self):
+        # Takes one of the size slots, so that concurrent releases cannot both keep a pipeline
+        with self._lock:
+            if self._idle() >= self.size:
+                return False
+            self._pending += 1
+            return True
+
+    def _put_back(self, pooled):
+        # Fills a slot taken by _reserve, pooled is None when nothing could be built for it
+        with self._lock:
+            self._pending -= 1
+            stopped = self._stopped
+            if pooled is not None and not stopped:
+                self._ready.append(pooled)
+        if pooled is not None and stopped:
+            pooled.dispose()
+
+    def release(self, pooled):
+        # Back to READY for the next media item, or rebuilt after max_uses
+        if self._stopped:
+            pooled.dispose()
+            return
+        if self.max_uses > 0 and pooled.uses >= self.max_uses:
+            self._discard(pooled)
+            return
+        # Pipelines built when the pool was exhausted are disposed once the burst is over
+        if not self._reserve():
+            pooled.dispose()
+            return
+        pooled.reset()
+        self._put_back(pooled)
+
+    def _discard(self, pooled):
+        # A pipeline that failed is not reused, a fresh one takes its place
+        pooled.dispose()
+        if self._stopped:
+            return
+        if not self._reserve():
+            return
+        replacement = None
+        try:
+            replacement = self._build()
+        except PoolError as error:
+            log.error('failed to replace a pooled pipeline: {}'.format(error))
+        finally:
+            self._put_back(replacement)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            pipelines = self._ready + self._prerolled
+            self._ready = []
+            self._prerolled = []
+        for pooled in pipelines:
+            pooled.dispose()
+
+    def stats(self):
+        with self._lock:
+            return {'ready': len(self._ready), 'prerolled': len(self._prerolled)}
+
+def measure_fresh(topology, uri, timeout):
+    # Build, set the uri and preroll, the way the tutorials start
+    start = time.monotonic()
+    pipeline, uri_element, sinks = TOPOLOGIES[topology]()
+    pooled = PooledPipeline(pipeline, uri_element, sinks)
+    try:
+        pooled.preroll(uri, timeout)
+        ready = time.monotonic()
+        return pooled.first_buffer_time - start, ready - start
+    finally:
+        pooled.dispose()
+
+def measure_pooled(pool, uri, prefetch):
+    if prefetch:
+        pool.prefetch(uri)
+    start = time.monotonic()
+    pooled = pool.acquire(uri)
+    ready = time.monotonic()
+    try:
+        # A prerolled pipeline already holds its first buffer at the sinks
+        return max(pooled.first_buffer_time - start, 0.0), ready - start
+    finally:
+        pool.release(pooled)
+
+def summarize(name, samples):
+    first_buffer = sorted(sample[0] for sample in samples)
+    ready = sorted(sample[1] for sample in samples)
+    print('{:<10} first buffer p50 {:8.2f}ms p99 {:8.2f}ms   ready to play p50 {:8.2f}ms p99 {:8.2f}ms'.format(
+        name, first_buffer[len(first_buffer) // 2] * 1e3, first_buffer[int(len(first_buffer) * 0.99)] * 1e3,
+        ready[len(ready) // 2] * 1e3, ready[int(len(ready) * 0.99)] * 1e3))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare the time to first buffer of pooled and fresh pipelines')
+    parser.add_argument('uris', nargs='*', help='media to play, a short file is generated when none is given')
+    parser.add_argument('--topology', choices=sorted(TOPOLOGIES), default='playbin')
+    parser.add_argument('--size', type=int, default=2, help='pipelines in the pool')
+    parser.add_argument('--iterations', type=int, default=50, help='media items per measurement')
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds a preroll may take')
+    args = parser.parse_args()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
+    print('initializing Gst...')
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics.serve_from_env()
+
+    uris = [uri if Gst.uri_is_valid(uri) else Gst.filename_to_uri(os.path.abspath(uri)) for uri in args.uris]
+    media_directory = None
+    if not uris:
+        media_directory = tempfile.TemporaryDirectory(prefix='gst-examples-pool-')
+        print('generating media...')
+        import benchmark
+        media_uri = benchmark.generate_media(media_directory.name, 2)
+        if media_uri is None:
+            print('failed to generate media')
+            sys.exit(1)
+        uris = [media_uri]
+
+    pool = PipelinePool(args.topology, size=args.size, preroll_timeout=args.timeout)
+    try:
+        # Warm up the plugins and the file cache so that both sides start equal
+        measure_fresh(args.topology, uris[0], args.timeout)
+        pool.start()
+
+        results = {'fresh': [], 'pooled': [], 'prerolled': []}
+        for i in range(args.iterations):
+            uri = uris[i % len(uris)]
+            results['fresh'].append(measure_fresh(args.topology, uri, args.timeout))
+            results['pooled'].append(measure_pooled(pool, uri, prefetch=False))
+            results['prerolled'].append(measure_pooled(pool, uri, prefetch=True))
+    except PoolError as error:
+        print(error)
+        sys.exit(1)
+    finally:
+        pool.stop()
+        if media_directory is not None:
+            media_directory.cleanup()
+
+    print('{} {} media items, pool of {}:'.format(args.iterations, args.topology, args.size))
+    for name, samples in results.items():
+        summarize(name, samples)
@@ -0,0 +1,218 @@
+import time
+import logging
+import threading
+
+import metrics
+from metrics import log
+from gst_bootstrap import Gst
+
+# Telemetry for the queues of the tee branches of basic-tutorial-7.py and
+# basic-tutorial-8.py.
+#
+# A tee pushes into all its branches from one thread: when the queue of one
+# branch is full, the tee blocks and every other branch starves. The monitor
+# samples current-level-buffers/bytes/time of every queue from a thread and
+# listens to their overrun and underrun signals. An overrun starts a stall of
+# the branch, which ends when the queue lets the next buffer out, measured with
+# a one-shot probe on its src pad. The branch with the most stall time is the
+# one holding the tee back.
+#
+#     monitor = QueueMonitor(pipeline, auto_tune=True)
+#     monitor.start()
+#     ...
+#     monitor.stop()
+#     monitor.report()
+#
+# With auto_tune, an overrunning queue first gets its limits doubled, up to
+# max_buffers, max_bytes and max_time. If it still overruns at those limits, it
+# is switched to leaky=downstream, dropping its oldest buffers instead of
+# blocking the tee, so the other branches keep running at full rate.
+
+# Limits a queue is not grown beyond by auto-tuning, the time in nanoseconds
+MAX_TUNED_BUFFERS = 10000
+MAX_TUNED_BYTES = 64 * 1024 * 1024
+MAX_TUNED_TIME = 10 * 1000000000
+# Overruns at the maximum limits before a queue is switched to leaky
+OVERRUNS_BEFORE_LEAKY = 3
+
+class QueueStats():
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.name = queue.get_name()
+        self.samples = 0
+        self.max_buffers = 0
+        self.max_bytes = 0
+        self.max_time = 0
+        self.overruns = 0
+        self.underruns = 0
+        self.stall_time = 0.0
+        self.stalled_since = None
+        self.overruns_at_limit = 0
+        # What auto-tuning did to this queue
+        self.actions = []
+
+class QueueMonitor():
+
+    def __init__(self, pipeline, interval=0.1, auto_tune=False,
+                 max_buffers=MAX_TUNED_BUFFERS, max_bytes=MAX_TUNED_BYTES, max_time=MAX_TUNED_TIME):
+        self.pipeline = pipeline
+        # Seconds between level samples
+        self.interval = interval
+        self.auto_tune = auto_tune
+        self.max_buffers = max_buffers
+        self.max_bytes = max_bytes
+        self.max_time = max_time
+
+        self.stats = {}
+        self._handlers = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._started = None
+        self._elapsed = 0.0
+
+    def find_queues(self):
+        queues = []
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.iterate_recurse
+        iterator = self.pipeline.iterate_recurse()
+        while True:
+            result, element = iterator.next()
+            if result == Gst.IteratorResult.RESYNC:
+                iterator.resync()
+                queues = []
+                continue
+            if result != Gst.IteratorResult.OK:
+                break
+            factory = element.get_factory()
+            if factory is not None and factory.get_name() == 'queue':
+                queues.append(element)
+        return queues
+
+    def start(self):
+        for queue in self.find_queues():
+            self.stats[queue.get_name()] = QueueStats(queue)
+            # https://gstreamer.freedesktop.org/documentation/coreelements/queue.html#queue::overrun
+            self._handlers.append((queue, queue.connect('overrun', self.on_overrun)))
+            self._handlers.append((queue, queue.connect('underrun', self.on_underrun)))
+        if not self.stats:
+            log.warning('no queue to monitor in {}'.format(self.pipeline.get_name()))
+        self._started = time.monotonic()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.sample_levels, name='queue-monitor', daemon=True)
+        self._thread.start()
+
+    def sample_levels(self):
+        while not self._stopping.wait(self.interval):
+            for stats in self.stats.values():
+                queue = stats.queue
+                # https://gstreamer.freedesktop.org/documentation/coreelements/queue.html#queue:current-level-buffers
+                level_buffers = queue.get_property('current-level-buffers')
+                level_bytes = queue.get_property('current-level-bytes')
+                level_time = queue.get_property('current-level-time')
+                stats.samples += 1
+                stats.max_buffers = max(stats.max_buffers, level_buffers)
+                stats.max_bytes = max(stats.max_bytes, level_bytes)
+                stats.max_time = max(stats.max_time, level_time)
+                metrics.REGISTRY.gauge('queue_level_buffers', 'Buffers in a queue', queue=stats.name).set(level_buffers)
+                metrics.REGISTRY.gauge('queue_level_bytes', 'Bytes in a queue', queue=stats.name).set(level_bytes)
+                metrics.REGISTRY.gauge('queue_level_seconds', 'Time in a queue', queue=stats.name).set(level_time / Gst.SECOND)
+
+    def on_overrun(self, queue):
+        # Runs in the thread pushing into the queue, i.e. the one the tee is blocked in
+        stats = self.stats.get(queue.get_name())
+        if stats is None:
+            return
+        metrics.REGISTRY.counter('queue_overruns_total', 'Times a queue was full', queue=stats.name).inc()
+        with self._lock:
+            stats.overruns += 1
+            stalled = stats.stalled_since is None
+            if stalled:
+                stats.stalled_since = time.monotonic()
+        if stalled:
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.add_probe
+            # The stall ends when the queue lets the next buffer out and has room again
+            queue.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self.on_unstalled, stats)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('{} overrun, {} buffers/{} bytes/{}ns queued'.format(
+                stats.name, queue.get_property('current-level-buffers'), queue.get_property('current-level-bytes'),
+                queue.get_property('current-level-time')))
+        if self.auto_tune:
+            self.tune(stats)
+
+    def on_unstalled(self, pad, info, stats):
+        with self._lock:
+            if stats.stalled_since is not None:
+                stall = time.monotonic() - stats.stalled_since
+                stats.stall_time += stall
+                stats.stalled_since = None
+                metrics.REGISTRY.histogram('queue_stall_seconds', 'Time a full queue blocked its upstream',
+                                           queue=stats.name).observe(stall)
+        return Gst.PadProbeReturn.REMOVE
+
+    def on_underrun(self, queue):
+        stats = self.stats.get(queue.get_name())
+        if stats is None:
+            return
+        with self._lock:
+            stats.underruns += 1
+        metrics.REGISTRY.counter('queue_underruns_total', 'Times a queue ran empty', queue=stats.name).inc()
+
+    def tune(self, stats):
+        # Called from the overrun signal, when the queue is unlocked and re-reads its limits right after
+        queue = stats.queue
+        if queue.get_property('leaky') != 0:
+            return
+        max_buffers = queue.get_property('max-size-buffers')
+        max_bytes = queue.get_property('max-size-bytes')
+        max_time = queue.get_property('max-size-time')
+        # A limit of 0 means unlimited, only the limits that are set can be reached
+        limits = ((max_buffers, self.max_buffers), (max_bytes, self.max_bytes), (max_time, self.max_time))
+        if any(limit and limit < maximum for limit, maximum in limits):
+            if max_buffers:
+                queue.set_property('max-size-buffers', min(max_buffers * 2, self.max_buffers))
+            if max_bytes:
+                queue.set_property('max-size-bytes', min(max_bytes * 2, self.max_bytes))
+            if max_time:
+                queue.set_property('max-size-time', min(max_time * 2, self.max_time))
+            stats.actions.append('grew the limits to {} buffers/{} bytes/{:.2f}s'.format(
+                queue.get_property('max-size-buffers'), queue.get_property('max-size-bytes'),
+                queue.get_property('max-size-time') / Gst.SECOND))
+            log.info('{}: {}'.format(stats.name, stats.actions[-1]))
+            return
+        stats.overruns_at_limit += 1
+        if stats.overruns_at_limit >= OVERRUNS_BEFORE_LEAKY:
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.util_set_object_arg
+            Gst.util_set_object_arg(queue, 'leaky', 'downstream')
+            stats.actions.append('switched to leaky=downstream after {} overruns at its maximum limits'.format(stats.overruns_at_limit))
+            log.warning('{}: {}'.format(stats.name, stats.actions[-1]))
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        for queue, handler in self._handlers:
+            queue.disconnect(handler)
+        self._handlers = []
+        self._elapsed = time.monotonic() - self._started
+        # A stall still running when stopped counts until now
+        with self._lock:
+            for stats in self.stats.values():
+                if stats.stalled_since is not None:
+                    stats.stall_time += time.monotonic() - stats.stalled_since
+                    stats.stalled_since = None
+
+    def report(self):
+        elapsed = self._elapsed or (time.monotonic() - self._started if self._started else 0.0)
+        for stats in sorted(self.stats.values(), key=lambda stats: -stats.stall_time):
+            print('{}: stalled {:.3f}s ({:.1%} of {:.1f}s) in {} overruns, {} underruns, max {} buffers/{} bytes/{:.3f}s queued'.format(
+                stats.name, stats.stall_time, stats.stall_time / elapsed if elapsed else 0.0, elapsed, stats.overruns,
+                stats.underruns, stats.max_buffers, stats.max_bytes, stats.max_time / Gst.SECOND))
+            for action in stats.actions:
+                print('{}: {}'.format(stats.name, action))
+        stalled = [stats for stats in self.stats.values() if stats.stall_time > 0]
+        if stalled:
+            worst = max(stalled, key=lambda stats: stats.stall_time)
+            print('{} held the tee back the longest'.format(worst.name))
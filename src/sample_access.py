@@ -0,0 +1,156 @@
+import numpy as np
+from gst_bootstrap import Gst
+
+# Zero-copy access to the samples pulled from an appsink.
+#
+# SampleConsumer maps each buffer read-only and hands the mapped memory to a
+# callback as a NumPy array (or a plain memoryview), without copying it into
+# Python bytes. The format, channels and rate parsed from the caps come along
+# in a SampleView. The array is only valid while the callback runs: the buffer
+# is unmapped as soon as the callback returns.
+#
+# If the callback keeps a reference to the array, unmapping would leave the
+# array pointing at freed memory. In that case the buffer stays mapped, a
+# warning is printed, and we retry the unmap on the following samples. Copy
+# the array with .copy() if you need to keep the data.
+
+# https://gstreamer.freedesktop.org/documentation/audio/audio-format.html
+AUDIO_DTYPES = {
+    'S8': 'i1', 'U8': 'u1',
+    'S16LE': '<i2', 'S16BE': '>i2', 'U16LE': '<u2', 'U16BE': '>u2',
+    'S32LE': '<i4', 'S32BE': '>i4', 'U32LE': '<u4', 'U32BE': '>u4',
+    'F32LE': '<f4', 'F32BE': '>f4', 'F64LE': '<f8', 'F64BE': '>f8',
+}
+
+class SampleFormat():
+
+    def __init__(self, media_type, format, dtype, channels, rate, interleaved, caps=None):
+        self.media_type = media_type
+        self.format = format
+        self.dtype = dtype
+        self.channels = channels
+        self.rate = rate
+        self.interleaved = interleaved
+        # The caps as a string, e.g. to pass them on to another process
+        self.caps = caps
+
+    @classmethod
+    def from_caps(cls, caps):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Caps.html#Gst.Caps.get_structure
+        structure = caps.get_structure(0)
+        media_type = structure.get_name()
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Structure.html#Gst.Structure.get_string
+        format = structure.get_string('format')
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Structure.html#Gst.Structure.get_int
+        found, channels = structure.get_int('channels')
+        if not found:
+            channels = 1
+        found, rate = structure.get_int('rate')
+        if not found:
+            rate = 0
+        interleaved = structure.get_string('layout') != 'non-interleaved'
+
+        dtype = np.dtype(AUDIO_DTYPES.get(format, 'u1')) if media_type == 'audio/x-raw' else np.dtype('u1')
+        return cls(media_type, format, dtype, channels, rate, interleaved, caps.to_string())
+
+    def __repr__(self):
+        return '{}, format={}, channels={}, rate={}'.format(self.media_type, self.format, self.channels, self.rate)
+
+class SampleView():
+
+    def __init__(self, data, sample_format, pts, duration):
+        # A read-only NumPy array or memoryview of the mapped buffer
+        self.data = data
+        self.format = sample_format
+        self.pts = pts
+        self.duration = duration
+
+    @property
+    def dtype(self):
+        return self.format.dtype
+
+    @property
+    def channels(self):
+        return self.format.channels
+
+    @property
+    def rate(self):
+        return self.format.rate
+
+class SampleConsumer():
+
+    def __init__(self, callback, as_numpy=True):
+        # callback(view) is called for each pulled sample with a SampleView
+        self.callback = callback
+        self.as_numpy = as_numpy
+
+        self._caps = None
+        self._format = None
+        # (buffer, info, memoryview) left mapped because the callback kept the data
+        self._pinned = []
+
+    def _sample_format(self, caps):
+        # Parsing the caps is only needed when they change
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Caps.html#Gst.Caps.is_equal
+        if self._caps is None or not caps.is_equal(self._caps):
+            self._caps = caps
+            self._format = SampleFormat.from_caps(caps)
+        return self._format
+
+    def _release(self, buf, info, view):
+        try:
+            view.release()
+        except BufferError:
+            return False
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.unmap
+        buf.unmap(info)
+        return True
+
+    def _release_pinned(self):
+        self._pinned = [pinned for pinned in self._pinned if not self._release(*pinned)]
+
+    def consume(self, sample):
+        if self._pinned:
+            self._release_pinned()
+
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Sample.html#Gst.Sample.get_buffer
+        buf = sample.get_buffer()
+        sample_format = self._sample_format(sample.get_caps())
+
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.map
+        success, info = buf.map(Gst.MapFlags.READ)
+        if not success:
+            print('failed to map the buffer')
+            return False
+
+        view = memoryview(info.data)
+        try:
+            if self.as_numpy:
+                data = np.frombuffer(view, dtype=sample_format.dtype)
+                if sample_format.channels > 1:
+                    if sample_format.interleaved:
+                        data = data.reshape(-1, sample_format.channels)
+                    else:
+                        data = data.reshape(sample_format.channels, -1)
+            else:
+                data = view
+            self.callback(SampleView(data, sample_format, buf.pts, buf.duration))
+        finally:
+            data = None
+            if not self._release(buf, info, view):
+                print('the sample data is still referenced after the callback, keeping the buffer mapped')
+                self._pinned.append((buf, info, view))
+        return True
+
+    def pull(self, app_sink):
+        # Use as the body of a new-sample handler
+        # https://lazka.github.io/pgi-docs/#GstApp-1.0/classes/AppSink.html#GstApp.AppSink.signals.pull_sample
+        sample = app_sink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.ERROR
+        if not self.consume(sample):
+            return Gst.FlowReturn.ERROR
+        return Gst.FlowReturn.OK
+
+    def dispose(self):
+        self._release_pinned()
@@ -0,0 +1,282 @@
+import time
+import threading
+
+import metrics
+from metrics import log
+from gst_bootstrap import Gst
+
+# Seeking on top of the seeking query of basic-tutorial-4.py.
+#
+#     engine = SeekEngine(playbin)
+#     engine.query_seekable()                       # once PLAYING
+#     engine.seek(30 * Gst.SECOND, 'snap-before')   # flushing seek to the keyframe before 30s
+#     engine.seek(30 * Gst.SECOND, 'accurate')      # decode up to exactly 30s
+#     engine.set_rate(2.0)                          # instant rate change, no flush
+#     engine.segment_seek(10 * Gst.SECOND, 20 * Gst.SECOND, loop=True)
+#
+# Pass the ASYNC_DONE and SEGMENT_DONE messages of the bus to handle_message().
+# A flushing seek is in flight until ASYNC_DONE: requests made meanwhile are
+# coalesced, only the latest one runs once the previous seek is done, like
+# when scrubbing.
+#
+# Each seek is measured from the request to the first buffer that reaches a
+# sink after the seek's FLUSH_STOP (or SEGMENT, for non flushing seeks). The
+# latency and the position the seek landed on are kept in results and in the
+# seek_latency_seconds histogram.
+
+# Mode -> names of the Gst.SeekFlags added to FLUSH
+SEEK_MODES = {
+    'key-unit': ('KEY_UNIT',),
+    'snap-before': ('KEY_UNIT', 'SNAP_BEFORE'),
+    'snap-after': ('KEY_UNIT', 'SNAP_AFTER'),
+    'snap-nearest': ('KEY_UNIT', 'SNAP_NEAREST'),
+    'accurate': ('ACCURATE',),
+}
+# Seconds after which a flushing seek without ASYNC_DONE no longer holds back new requests
+IN_FLIGHT_TIMEOUT = 5.0
+
+def seek_flags(mode):
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/flags.html#Gst.SeekFlags
+    flags = Gst.SeekFlags.NONE
+    for name in SEEK_MODES[mode]:
+        flags |= getattr(Gst.SeekFlags, name)
+    return flags
+
+class SeekResult():
+
+    def __init__(self, kind, mode, target, rate):
+        self.kind = kind
+        self.mode = mode
+        self.target = target
+        self.rate = rate
+        self.stop = None
+        self.seqnum = None
+        self.requested = time.monotonic()
+        self.latency = None
+        # Stream time of the first buffer after the seek
+        self.landed = None
+        self.failed = False
+
+    def __str__(self):
+        if self.failed:
+            return '{} {} to {}: failed'.format(self.kind, self.mode, self.target)
+        if self.latency is None:
+            return '{} {} to {}: no buffer yet'.format(self.kind, self.mode, self.target)
+        landed = 'n/a' if self.landed is None else '{:.3f}s'.format(self.landed / Gst.SECOND)
+        target = 'n/a' if self.target is None else '{:.3f}s'.format(self.target / Gst.SECOND)
+        return '{} {} to {} landed at {} after {:.2f}ms'.format(self.kind, self.mode, target, landed, self.latency * 1e3)
+
+class SeekEngine():
+
+    def __init__(self, pipeline, sinks=None):
+        self.pipeline = pipeline
+        # Leaf sinks to measure at, found in the pipeline at each seek when None
+        self._sinks = sinks
+
+        self.seekable = False
+        self.seek_start = 0
+        self.seek_end = Gst.CLOCK_TIME_NONE
+        self.rate = 1.0
+
+        # The flushing seek waiting for ASYNC_DONE, and the latest request made meanwhile
+        self._in_flight = None
+        self._pending = None
+        self.coalesced = 0
+
+        # (start, stop, flags) of a looping segment seek
+        self._loop_segment = None
+
+        self.results = []
+        self._lock = threading.Lock()
+        # seqnum -> (SeekResult, [(pad, probe id)]) of the seeks still waiting for their first buffer
+        self._measuring = {}
+
+    def query_seekable(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Query.html#Gst.Query.new_seeking
+        query = Gst.Query.new_seeking(Gst.Format.TIME)
+        if not self.pipeline.query(query):
+            log.warning('seeking query failed')
+            self.seekable = False
+            return False
+        fmt, self.seekable, self.seek_start, self.seek_end = query.parse_seeking()
+        return self.seekable
+
+    def find_sinks(self):
+        if self._sinks is not None:
+            return self._sinks
+        sinks = []
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.iterate_recurse
+        iterator = self.pipeline.iterate_recurse() if isinstance(self.pipeline, Gst.Bin) else None
+        if iterator is None:
+            return sinks
+        while True:
+            result, element = iterator.next()
+            if result == Gst.IteratorResult.RESYNC:
+                iterator.resync()
+                sinks = []
+                continue
+            if result != Gst.IteratorResult.OK:
+                break
+            # Sinks inside bins like autovideosink, not the bins themselves
+            if element.has_flag(Gst.ElementFlags.SINK) and not isinstance(element, Gst.Bin):
+                sinks.append(element)
+        return sinks
+
+    def seek(self, position, mode='key-unit', rate=None):
+        # Flushing seek to position. Coalesced when another flushing seek is in flight
+        if mode not in SEEK_MODES:
+            raise ValueError('unknown seek mode {}, expected one of {}'.format(mode, ', '.join(SEEK_MODES)))
+        return self._request(SeekResult('seek', mode, position, self.rate if rate is None else rate))
+
+    def segment_seek(self, start, stop, mode='key-unit', loop=False):
+        # Flushing seek playing [start, stop], posting SEGMENT_DONE instead of EOS at stop.
+        # With loop, every SEGMENT_DONE seeks back to start without flushing
+        if mode not in SEEK_MODES:
+            raise ValueError('unknown seek mode {}, expected one of {}'.format(mode, ', '.join(SEEK_MODES)))
+        request = SeekResult('segment', mode, start, self.rate)
+        request.stop = stop
+        self._loop_segment = (start, stop, seek_flags(mode) | Gst.SeekFlags.SEGMENT) if loop else None
+        return self._request(request)
+
+    def _request(self, request):
+        in_flight = self._in_flight
+        if in_flight is not None and time.monotonic() - in_flight.requested > IN_FLIGHT_TIMEOUT:
+            log.warning('no ASYNC_DONE for {}, not waiting for it any longer'.format(in_flight))
+            in_flight = self._in_flight = None
+        if in_flight is None:
+            return self._run(request)
+        if self._pending is not None:
+            self.coalesced += 1
+            metrics.REGISTRY.counter('seeks_coalesced_total', 'Seek requests replaced by a later one before they ran').inc()
+        self._pending = request
+        return True
+
+    def set_rate(self, rate):
+        # Changes the playback rate without flushing, where the pipeline supports instant rate changes
+        request = SeekResult('rate', 'instant', None, rate)
+        flag = getattr(Gst.SeekFlags, 'INSTANT_RATE_CHANGE', None)
+        if flag is None:
+            # Before GStreamer 1.18: flushing seek to the current position with the new rate
+            queried, position = self.pipeline.query_position(Gst.Format.TIME)
+            return self.seek(position if queried else 0, 'accurate', rate)
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Event.html#Gst.Event.new_seek
+        event = Gst.Event.new_seek(rate, Gst.Format.TIME, flag, Gst.SeekType.NONE, 0, Gst.SeekType.NONE, 0)
+        return self._send(request, event, flushing=False)
+
+    def _run(self, request):
+        flags = Gst.SeekFlags.FLUSH | seek_flags(request.mode)
+        stop_type, stop = Gst.SeekType.NONE, 0
+        if request.kind == 'segment':
+            flags |= Gst.SeekFlags.SEGMENT
+            stop_type, stop = Gst.SeekType.SET, request.stop
+        if request.rate < 0:
+            # Playing backwards from position
+            event = Gst.Event.new_seek(request.rate, Gst.Format.TIME, flags, Gst.SeekType.SET, 0, Gst.SeekType.SET, request.target)
+        else:
+            event = Gst.Event.new_seek(request.rate, Gst.Format.TIME, flags, Gst.SeekType.SET, request.target, stop_type, stop)
+        return self._send(request, event, flushing=True)
+
+    def _send(self, request, event, flushing):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Event.html#Gst.Event.get_seqnum
+        request.seqnum = event.get_seqnum()
+        request.requested = time.monotonic()
+        self._arm(request)
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.send_event
+        if not self.pipeline.send_event(event):
+            log.warning('{} failed'.format(request))
+            request.failed = True
+            self._disarm(request.seqnum)
+            self.results.append(request)
+            return False
+        self.rate = request.rate
+        if flushing:
+            self._in_flight = request
+        self.results.append(request)
+        log.debug('sent {} {} to {}'.format(request.kind, request.mode, request.target))
+        return True
+
+    def _arm(self, request):
+        probes = []
+        with self._lock:
+            self._measuring[request.seqnum] = (request, probes)
+        # Buffers, plus the FLUSH_STOP and SEGMENT events telling which buffers come after the seek
+        probe_type = Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM | Gst.PadProbeType.EVENT_FLUSH
+        for sink in self.find_sinks():
+            for pad in sink.sinkpads:
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.add_probe
+                state = {'after_seek': False, 'segment': None}
+                probe_id = pad.add_probe(probe_type, self.on_sink_data, request.seqnum, state)
+                probes.append((pad, probe_id))
+
+    def _disarm(self, seqnum):
+        with self._lock:
+            request, probes = self._measuring.pop(seqnum, (None, []))
+        for pad, probe_id in probes:
+            pad.remove_probe(probe_id)
+
+    def on_sink_data(self, pad, info, seqnum, state):
+        # Runs in the streaming threads
+        with self._lock:
+            measuring = self._measuring.get(seqnum)
+        if measuring is None:
+            return Gst.PadProbeReturn.REMOVE
+        request, probes = measuring
+
+        if info.type & Gst.PadProbeType.BUFFER:
+            if not state['after_seek']:
+                return Gst.PadProbeReturn.OK
+            buffer = info.get_buffer()
+            with self._lock:
+                if self._measuring.pop(seqnum, None) is None:
+                    return Gst.PadProbeReturn.REMOVE
+            request.latency = time.monotonic() - request.requested
+            segment = state['segment']
+            if segment is not None and buffer.pts != Gst.CLOCK_TIME_NONE:
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Segment.html#Gst.Segment.to_stream_time
+                request.landed = segment.to_stream_time(Gst.Format.TIME, buffer.pts)
+            metrics.REGISTRY.histogram('seek_latency_seconds', 'Time from a seek request to the first buffer at a sink after it',
+                                       kind=request.kind, mode=request.mode).observe(request.latency)
+            # The probes of the other sinks remove themselves on their next call
+            return Gst.PadProbeReturn.REMOVE
+
+        event = info.get_event()
+        if event is None or event.get_seqnum() != seqnum:
+            return Gst.PadProbeReturn.OK
+        # FLUSH_STOP, SEGMENT or INSTANT_RATE_CHANGE of the seek: the next buffer comes after it
+        if event.type != Gst.EventType.FLUSH_START:
+            state['after_seek'] = True
+        if event.type == Gst.EventType.SEGMENT:
+            state['segment'] = event.parse_segment()
+        return Gst.PadProbeReturn.OK
+
+    def handle_message(self, gst_message):
+        # Returns True when the message was for the engine
+        if gst_message.type == Gst.MessageType.ASYNC_DONE and gst_message.src == self.pipeline:
+            self._in_flight = None
+            if self._pending is not None:
+                request, self._pending = self._pending, None
+                self._run(request)
+            return True
+        if gst_message.type == Gst.MessageType.SEGMENT_DONE:
+            if self._loop_segment is not None:
+                start, stop, flags = self._loop_segment
+                # Non flushing, so that playback continues seamlessly from start
+                event = Gst.Event.new_seek(self.rate, Gst.Format.TIME, flags, Gst.SeekType.SET, start, Gst.SeekType.SET, stop)
+                request = SeekResult('loop', 'segment', start, self.rate)
+                self._send(request, event, flushing=False)
+            return True
+        return False
+
+    def close(self):
+        with self._lock:
+            seqnums = list(self._measuring)
+        for seqnum in seqnums:
+            self._disarm(seqnum)
+        self._in_flight = None
+        self._pending = None
+
+    def report(self):
+        for result in self.results:
+            print(result)
+        if self.coalesced:
+            print('{} seek requests were coalesced into later ones'.format(self.coalesced))
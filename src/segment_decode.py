@@ -0,0 +1,242 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import multiprocessing
+import concurrent.futures
+
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst
+from pipeline_builder import PipelineBuilder, BuildError
+from sample_access import SampleFormat
+
+# Decodes the audio of one long local file on every core.
+#
+# The duration is probed like basic-tutorial-4.py does, with query_duration,
+# and the timeline is split into ranges starting on keyframes: a KEY_UNIT |
+# SNAP_BEFORE seek to each nominal split point tells where the keyframe before
+# it is. Every range is decoded by its own worker process with an ACCURATE
+# seek to [start, stop). The decoded samples are clipped on sample indices
+# derived from the buffer timestamps, so that consecutive ranges meet exactly,
+# and the ranges are concatenated in order:
+#
+#     python3 segment_decode.py ~/long.webm --workers 8 --output long.raw --verify
+#
+# --verify also decodes the whole file in one worker, checks that the output is
+# identical and reports the speedup.
+
+# Every worker converts to the same sample format, so the ranges can be concatenated
+OUTPUT_CAPS = 'audio/x-raw, format=(string)S16LE, layout=(string)interleaved'
+BYTES_PER_SAMPLE = 2
+
+def decode_spec(uri):
+    # The uridecodebin topology of basic-tutorial-3.py, ending in an appsink
+    return {
+        'name': 'segment-pipeline',
+        'elements': [
+            {'name': 'source', 'factory': 'uridecodebin', 'properties': {'uri': uri}},
+            {'name': 'convert', 'factory': 'audioconvert'},
+            {'name': 'resample', 'factory': 'audioresample'},
+            {'name': 'sink', 'factory': 'appsink', 'properties': {'sync': False, 'max-buffers': 64}},
+        ],
+        'links': [('source', 'convert', 'audio/x-raw'), ('convert', 'resample'), ('resample', 'sink', OUTPUT_CAPS)],
+    }
+
+class DecodeError(Exception):
+    pass
+
+def wait_async_done(pipeline, timeout):
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bus.html#Gst.Bus.timed_pop_filtered
+    gst_message = pipeline.get_bus().timed_pop_filtered(int(timeout * Gst.SECOND), Gst.MessageType.ASYNC_DONE | Gst.MessageType.ERROR)
+    if gst_message is None:
+        raise DecodeError('no ASYNC_DONE within {}s'.format(timeout))
+    if gst_message.type == Gst.MessageType.ERROR:
+        gerror, debug = gst_message.parse_error()
+        raise DecodeError(gerror.message)
+
+def preroll(uri, timeout):
+    built = PipelineBuilder().build(decode_spec(uri))
+    if built.pipeline.set_state(Gst.State.PAUSED) == Gst.StateChangeReturn.FAILURE:
+        built.pipeline.set_state(Gst.State.NULL)
+        raise DecodeError('failed to preroll {}'.format(uri))
+    try:
+        wait_async_done(built.pipeline, timeout)
+    except DecodeError:
+        built.pipeline.set_state(Gst.State.NULL)
+        raise
+    return built
+
+def find_ranges(uri, count, timeout):
+    # Returns the duration and [(start, stop)] ranges starting on keyframes, the last one open ended (stop -1)
+    built = preroll(uri, timeout)
+    pipeline = built.pipeline
+    try:
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.query_duration
+        queried, duration = pipeline.query_duration(Gst.Format.TIME)
+        if not queried or duration <= 0:
+            raise DecodeError('can not get the duration of {}'.format(uri))
+
+        starts = [0]
+        flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SNAP_BEFORE
+        for i in range(1, count):
+            target = duration * i // count
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.seek
+            if not pipeline.seek(1.0, Gst.Format.TIME, flags, Gst.SeekType.SET, target, Gst.SeekType.NONE, -1):
+                raise DecodeError('seeking {} failed'.format(uri))
+            wait_async_done(pipeline, timeout)
+            # After a key unit seek the position is the keyframe the seek snapped to
+            queried, keyframe = pipeline.query_position(Gst.Format.TIME)
+            if queried and keyframe > starts[-1]:
+                starts.append(keyframe)
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+    stops = starts[1:] + [-1]
+    return duration, list(zip(starts, stops))
+
+def init_worker():
+    gst_bootstrap.init()
+
+def decode_range(uri, index, start, stop, path, timeout):
+    # Decodes [start, stop) of uri into path, keeping only the samples whose index
+    # round(pts * rate) falls in [round(start * rate), round(stop * rate))
+    init_worker()
+    wall_start = time.monotonic()
+    built = preroll(uri, timeout)
+    pipeline = built.pipeline
+    app_sink = built['sink']
+    result = {'index': index, 'start': start, 'stop': stop, 'path': path, 'first_sample': None, 'samples': 0}
+    try:
+        stop_type = Gst.SeekType.NONE if stop < 0 else Gst.SeekType.SET
+        flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE
+        if not pipeline.seek(1.0, Gst.Format.TIME, flags, Gst.SeekType.SET, start, stop_type, stop):
+            raise DecodeError('seeking to {} failed'.format(start))
+        wait_async_done(pipeline, timeout)
+        pipeline.set_state(Gst.State.PLAYING)
+
+        sample_format = None
+        first = last = None
+        bus = pipeline.get_bus()
+        with open(path, 'wb') as f:
+            while True:
+                # https://lazka.github.io/pgi-docs/#GstApp-1.0/classes/AppSink.html#GstApp.AppSink.signals.try_pull_sample
+                sample = app_sink.emit('try-pull-sample', 100 * Gst.MSECOND)
+                if sample is None:
+                    gst_message = bus.pop_filtered(Gst.MessageType.ERROR)
+                    if gst_message is not None:
+                        gerror, debug = gst_message.parse_error()
+                        raise DecodeError(gerror.message)
+                    if app_sink.get_property('eos'):
+                        break
+                    if time.monotonic() - wall_start > timeout:
+                        raise DecodeError('range {} did not finish within {}s'.format(index, timeout))
+                    continue
+
+                if sample_format is None:
+                    sample_format = SampleFormat.from_caps(sample.get_caps())
+                    frame_size = sample_format.channels * BYTES_PER_SAMPLE
+                    rate = sample_format.rate
+                    first = (start * rate + Gst.SECOND // 2) // Gst.SECOND
+                    last = None if stop < 0 else (stop * rate + Gst.SECOND // 2) // Gst.SECOND
+
+                buffer = sample.get_buffer()
+                if buffer.pts == Gst.CLOCK_TIME_NONE:
+                    raise DecodeError('buffer without a timestamp in range {}'.format(index))
+                frames = buffer.get_size() // frame_size
+                buffer_first = (buffer.pts * rate + Gst.SECOND // 2) // Gst.SECOND
+                keep_from = max(first, buffer_first)
+                keep_to = buffer_first + frames if last is None else min(last, buffer_first + frames)
+                if keep_to <= keep_from:
+                    continue
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.extract_dup
+                f.write(buffer.extract_dup((keep_from - buffer_first) * frame_size, (keep_to - keep_from) * frame_size))
+                if result['first_sample'] is None:
+                    result['first_sample'] = keep_from
+                elif keep_from != result['first_sample'] + result['samples']:
+                    raise DecodeError('range {} is not contiguous at sample {}'.format(index, keep_from))
+                result['samples'] += keep_to - keep_from
+
+        if sample_format is not None:
+            result.update(rate=sample_format.rate, channels=sample_format.channels)
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+    result['wall_seconds'] = time.monotonic() - wall_start
+    return result
+
+def decode_parallel(uri, ranges, workers, directory, timeout):
+    # Returns the results of the ranges in timeline order.
+    # Workers are spawned rather than forked, the parent has already run pipelines
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as executor:
+        futures = [executor.submit(decode_range, uri, index, start, stop, os.path.join(directory, 'range-{:04d}.raw'.format(index)), timeout)
+                   for index, (start, stop) in enumerate(ranges)]
+        return [future.result() for future in futures]
+
+def merge(results, output):
+    # Concatenates the ranges, checking that each one starts where the previous one stopped
+    expected = None
+    sha256 = hashlib.sha256()
+    with open(output, 'wb') if output is not None else open(os.devnull, 'wb') as out:
+        for result in results:
+            if result['samples'] == 0:
+                continue
+            if expected is not None and result['first_sample'] != expected:
+                kind = 'gap' if result['first_sample'] > expected else 'overlap'
+                raise DecodeError('{} of {} samples before range {}'.format(kind, abs(result['first_sample'] - expected), result['index']))
+            expected = result['first_sample'] + result['samples']
+            with open(result['path'], 'rb') as f:
+                while True:
+                    block = f.read(1024 * 1024)
+                    if not block:
+                        break
+                    sha256.update(block)
+                    out.write(block)
+    return sha256.hexdigest()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='decode the audio of one file in parallel, one keyframe-aligned range per worker')
+    parser.add_argument('path', help='media file or uri')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: one per core)')
+    parser.add_argument('--ranges', type=int, default=0, help='ranges to split the file into (default: one per worker)')
+    parser.add_argument('--output', default=None, help='write the decoded S16LE interleaved samples to this file')
+    parser.add_argument('--timeout', type=float, default=600.0, help='seconds a range may take')
+    parser.add_argument('--verify', action='store_true', help='also decode sequentially, compare and report the speedup')
+    args = parser.parse_args()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
+    print('initializing Gst...')
+    init_worker()
+    uri = args.path if Gst.uri_is_valid(args.path) else Gst.filename_to_uri(os.path.abspath(args.path))
+
+    directory = tempfile.mkdtemp(prefix='gst-examples-segments-')
+    try:
+        duration, ranges = find_ranges(uri, args.ranges or args.workers, args.timeout)
+        print('{:.1f}s of media split into {} ranges at {}'.format(
+            duration / Gst.SECOND, len(ranges), ', '.join('{:.2f}s'.format(start / Gst.SECOND) for start, stop in ranges)))
+
+        start = time.monotonic()
+        results = decode_parallel(uri, ranges, args.workers, directory, args.timeout)
+        digest = merge(results, args.output)
+        parallel = time.monotonic() - start
+        samples = sum(result['samples'] for result in results)
+        print('decoded {} samples with {} workers in {:.2f}s, {:.1f} media-seconds per wall-second'.format(
+            samples, args.workers, parallel, duration / Gst.SECOND / parallel))
+
+        if args.verify:
+            start = time.monotonic()
+            whole = decode_range(uri, 0, 0, -1, os.path.join(directory, 'whole.raw'), args.timeout)
+            sequential = time.monotonic() - start
+            identical = merge([whole], None) == digest
+            print('sequential decode in {:.2f}s, speedup {:.2f}x, output {}'.format(
+                sequential, sequential / parallel, 'identical' if identical else 'DIFFERENT'))
+            if not identical:
+                sys.exit(1)
+    except (DecodeError, BuildError) as error:
+        print(error)
+        sys.exit(1)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
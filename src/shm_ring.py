@@ -0,0 +1,362 @@
+import sys
+import time
+import zlib
+import struct
+import platform
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+# A ring of samples in shared memory, to consume the app_sink of
+# basic-tutorial-8.py from other processes, away from the GIL of the pipeline.
+#
+# The publisher copies every sample into the next slot of the ring, with its
+# sequence number, PTS, duration and caps, and never waits for anybody:
+#
+#     ring = ShmRingPublisher('gst-examples', slots=64, slot_size=4096)
+#     ring.publish(view.data, view.pts, view.duration, view.format.caps)
+#     ...
+#     ring.close()
+#
+# Any number of subscriber processes attach to the ring by name and read the
+# slots in place, without copying:
+#
+#     ring = ShmRingSubscriber('gst-examples')
+#     while True:
+#         frame = ring.next(timeout=1.0)
+#         if frame is None:
+#             break
+#         result = analyze(frame.data)
+#         if not frame.valid():
+#             # the publisher wrote over the slot while we read it, drop result
+#         frame.release()
+#
+# Every slot is guarded by a sequence lock: odd while the publisher writes it,
+# 2 * sequence + 2 once the frame with that sequence number is complete. A
+# subscriber falling more than a ring behind skips to the oldest frame still
+# there and counts the frames it missed in overruns. A frame read in place is
+# only good if valid() still holds after reading it, copy() checks it for you.
+#
+# The sequence lock relies on the stores of the publisher becoming visible to
+# the subscribers in program order, which x86 guarantees. Python has no memory
+# barrier to enforce it elsewhere: on ARM a subscriber can see the lock of a
+# complete frame before the data landed. On such CPUs the publisher also
+# stores a CRC32 of the header fields, caps and data of every frame, and
+# valid() and copy() check it, so a frame seen half written is dropped like an
+# overwritten one. checksums=True or False overrides the choice.
+#
+#     python3 shm_ring.py bench --subscribers 1 2 4
+#     python3 basic-tutorial-8.py --shm-ring gst-examples &
+#     python3 shm_ring.py subscribe gst-examples
+
+MAGIC = b'GSTR'
+VERSION = 2
+# magic, version, slots, slot size, caps size, checksums; then the last published sequence and the closed flag
+HEADER = struct.Struct('<4sIIIII')
+HEADER_SIZE = 64
+PUBLISHED_OFFSET = 32
+CLOSED_OFFSET = 40
+# lock, sequence, pts, duration, size, caps length, CRC32
+SLOT_HEADER = struct.Struct('<QQQQIII')
+# The fields of the slot header covered by the CRC32: sequence, pts, duration, size, caps length
+CHECKED_FIELDS = struct.Struct('<QQQII')
+SLOT_HEADER_SIZE = 64
+CAPS_SIZE = 512
+U64 = struct.Struct('<Q')
+U32 = struct.Struct('<I')
+# Seconds a subscriber sleeps between two looks at the ring, growing up to the maximum while idle
+POLL_INTERVAL = 0.0001
+MAX_POLL_INTERVAL = 0.002
+
+# CPUs that make stores visible to other cores in program order
+TOTAL_STORE_ORDER = platform.machine().lower() in ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+
+class ShmRingError(Exception):
+    pass
+
+def frame_checksum(sequence, pts, duration, size, caps_bytes, data):
+    crc = zlib.crc32(CHECKED_FIELDS.pack(sequence, pts, duration, size, len(caps_bytes)))
+    return zlib.crc32(data, zlib.crc32(caps_bytes, crc))
+
+def slot_stride(slot_size, caps_size):
+    # Slots start on cache lines
+    return (SLOT_HEADER_SIZE + caps_size + slot_size + 63) // 64 * 64
+
+class ShmRingPublisher():
+
+    def __init__(self, name, slots=64, slot_size=64 * 1024, caps_size=CAPS_SIZE, checksums=None):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.caps_size = caps_size
+        # Only needed where the sequence lock alone does not hold, see above
+        self.checksums = not TOTAL_STORE_ORDER if checksums is None else checksums
+        self.stride = slot_stride(slot_size, caps_size)
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + slots * self.stride)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        HEADER.pack_into(self.buf, 0, MAGIC, VERSION, slots, slot_size, caps_size, int(self.checksums))
+        self.sequence = 0
+        self._caps = None
+        self._caps_bytes = b''
+
+    def publish(self, data, pts=0, duration=0, caps=None):
+        # data is any bytes-like object, e.g. the NumPy array of a SampleView
+        data = memoryview(data).cast('B')
+        size = data.nbytes
+        if size > self.slot_size:
+            raise ShmRingError('a sample of {} bytes does not fit in slots of {} bytes'.format(size, self.slot_size))
+        if caps is not self._caps:
+            self._caps = caps
+            self._caps_bytes = (caps or '').encode()[:self.caps_size]
+
+        sequence = self.sequence + 1
+        offset = HEADER_SIZE + (sequence % self.slots) * self.stride
+        pts = max(pts, 0)
+        duration = max(duration, 0)
+        checksum = frame_checksum(sequence, pts, duration, size, self._caps_bytes, data) if self.checksums else 0
+        U64.pack_into(self.buf, offset, 2 * sequence + 1)
+        SLOT_HEADER.pack_into(self.buf, offset, 2 * sequence + 1, sequence, pts, duration, size, len(self._caps_bytes), checksum)
+        caps_offset = offset + SLOT_HEADER_SIZE
+        self.buf[caps_offset:caps_offset + len(self._caps_bytes)] = self._caps_bytes
+        data_offset = caps_offset + self.caps_size
+        self.buf[data_offset:data_offset + size] = data
+        U64.pack_into(self.buf, offset, 2 * sequence + 2)
+        U64.pack_into(self.buf, PUBLISHED_OFFSET, sequence)
+        self.sequence = sequence
+        return sequence
+
+    def close(self):
+        if self.shm is None:
+            return
+        U32.pack_into(self.buf, CLOSED_OFFSET, 1)
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+class Frame():
+
+    def __init__(self, ring, sequence, offset, pts, duration, caps, data, caps_bytes=b'', checksum=None):
+        self._ring = ring
+        self.sequence = sequence
+        self._offset = offset
+        self.pts = pts
+        self.duration = duration
+        self.caps = caps
+        # A read-only uint8 NumPy array over the slot
+        self.data = data
+        self._caps_bytes = caps_bytes
+        # The CRC32 stored by the publisher, None when the ring has no checksums
+        self._checksum = checksum
+
+    def unchanged(self):
+        # False once the publisher started writing over the slot
+        return self._ring is not None and U64.unpack_from(self._ring.buf, self._offset)[0] == 2 * self.sequence + 2
+
+    def checksum_matches(self, data):
+        if self._checksum is None:
+            return True
+        return frame_checksum(self.sequence, self.pts, self.duration, len(data), self._caps_bytes, data) == self._checksum
+
+    def valid(self):
+        # False once the publisher started writing over the slot, or when it was seen half written
+        return self.unchanged() and self.checksum_matches(self.data)
+
+    def copy(self):
+        # Returns a copy of the data, or None when it was overwritten while copying
+        data = self.data.copy()
+        return data if self.unchanged() and self.checksum_matches(data) else None
+
+    def release(self):
+        # The ring can only be closed once no frame refers to it
+        self.data = None
+        self._ring = None
+
+class ShmRingSubscriber():
+
+    def __init__(self, name, from_start=False, shared_tracker=False):
+        # shared_tracker: started by the publisher process with multiprocessing, sharing its resource tracker
+        if sys.version_info >= (3, 13):
+            self.shm = shared_memory.SharedMemory(name=name, track=shared_tracker)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if not shared_tracker:
+                # Attaching registers the segment with the resource tracker, which would unlink it when this process exits
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.buf = self.shm.buf
+        magic, version, self.slots, self.slot_size, self.caps_size, checksums = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ShmRingError('{} is not a ring of version {}'.format(name, VERSION))
+        self.checksums = bool(checksums)
+        self.stride = slot_stride(self.slot_size, self.caps_size)
+        published = self.published()
+        # The oldest frame still complete, or the next one to be published
+        self.next_sequence = max(1, published - self.slots + 2) if from_start else published + 1
+        self.frames = 0
+        self.overruns = 0
+        self._caps_bytes = None
+        self._caps = None
+
+    def published(self):
+        return U64.unpack_from(self.buf, PUBLISHED_OFFSET)[0]
+
+    def closed(self):
+        return U32.unpack_from(self.buf, CLOSED_OFFSET)[0] != 0
+
+    def skip_to_oldest(self, published):
+        # The slot after the last published one may be being written already
+        oldest = max(1, published - self.slots + 2)
+        if oldest > self.next_sequence:
+            self.overruns += oldest - self.next_sequence
+            self.next_sequence = oldest
+
+    def next(self, timeout=None):
+        # Returns the next Frame, None on timeout or once the publisher closed the ring
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = POLL_INTERVAL
+        while True:
+            published = self.published()
+            if published >= self.next_sequence:
+                self.skip_to_oldest(published)
+                frame = self.read(self.next_sequence)
+                self.next_sequence += 1
+                if frame is not None:
+                    self.frames += 1
+                    return frame
+                # Overwritten before we got to it
+                self.overruns += 1
+                continue
+            if self.closed():
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def read(self, sequence):
+        offset = HEADER_SIZE + (sequence % self.slots) * self.stride
+        lock, slot_sequence, pts, duration, size, caps_length, checksum = SLOT_HEADER.unpack_from(self.buf, offset)
+        if lock != 2 * sequence + 2 or slot_sequence != sequence:
+            return None
+        caps_offset = offset + SLOT_HEADER_SIZE
+        caps_bytes = bytes(self.buf[caps_offset:caps_offset + caps_length])
+        if caps_bytes != self._caps_bytes:
+            self._caps_bytes = caps_bytes
+            self._caps = caps_bytes.decode(errors='replace')
+        data = np.frombuffer(self.buf, dtype=np.uint8, count=size, offset=caps_offset + self.caps_size)
+        frame = Frame(self, sequence, offset, pts, duration, self._caps, data, caps_bytes, checksum if self.checksums else None)
+        # The checksum is left to valid() and copy(), after the data was used
+        if not frame.unchanged():
+            frame.release()
+            return None
+        return frame
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.buf = None
+        self.shm.close()
+        self.shm = None
+
+def bench_subscriber(name, ready, results):
+    ring = ShmRingSubscriber(name, shared_tracker=True)
+    ready.set()
+    torn = 0
+    checksum = 0
+    start = time.monotonic()
+    while True:
+        frame = ring.next(timeout=5.0)
+        if frame is None:
+            break
+        # Touches the data in place like an analysis would
+        checksum += int(frame.data[-1])
+        if not frame.valid():
+            torn += 1
+        frame.release()
+    elapsed = time.monotonic() - start
+    results.put((ring.frames, ring.overruns, torn, elapsed))
+    ring.close()
+
+def bench(subscribers, frames, size, slots, rate, checksums=None):
+    context = multiprocessing.get_context('spawn')
+    payload = np.arange(size, dtype=np.uint8)
+    caps = 'audio/x-raw, format=(string)S16LE, layout=(string)interleaved, rate=(int)44100, channels=(int)1'
+    print('{:>11} {:>12} {:>14} {:>10} {:>6}'.format('subscribers', 'published/s', 'delivered/s', 'overruns', 'torn'))
+    for count in subscribers:
+        ring = ShmRingPublisher('gst-examples-bench-{}'.format(count), slots=slots, slot_size=size, checksums=checksums)
+        results = context.Queue()
+        processes = []
+        for i in range(count):
+            ready = context.Event()
+            process = context.Process(target=bench_subscriber, args=(ring.name, ready, results))
+            process.start()
+            ready.wait()
+            processes.append(process)
+
+        start = time.monotonic()
+        for i in range(frames):
+            ring.publish(payload, i * 1000, 1000, caps)
+            if rate > 0:
+                delay = start + (i + 1) / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        published = frames / (time.monotonic() - start)
+        ring.close()
+
+        outcomes = [results.get() for process in processes]
+        for process in processes:
+            process.join()
+        delivered = sum(frames_read / elapsed for frames_read, overruns, torn, elapsed in outcomes) / count
+        overruns = sum(overruns for frames_read, overruns, torn, elapsed in outcomes)
+        torn = sum(torn for frames_read, overruns, torn, elapsed in outcomes)
+        print('{:>11} {:>12.0f} {:>14.0f} {:>10} {:>6}'.format(count, published, delivered, overruns, torn))
+
+def subscribe(name, from_start):
+    ring = ShmRingSubscriber(name, from_start)
+    print('attached to {}: {} slots of {} bytes'.format(name, ring.slots, ring.slot_size))
+    caps = None
+    start = last = time.monotonic()
+    frames = 0
+    try:
+        while True:
+            frame = ring.next(timeout=1.0)
+            if frame is None:
+                if ring.closed():
+                    break
+                continue
+            if frame.caps != caps:
+                caps = frame.caps
+                print('caps: {}'.format(caps))
+            frame.release()
+            now = time.monotonic()
+            if now - last >= 1.0:
+                print('{:.0f} frames/s, {} frames, {} overruns'.format((ring.frames - frames) / (now - last), ring.frames, ring.overruns))
+                frames = ring.frames
+                last = now
+    except KeyboardInterrupt:
+        pass
+    print('{} frames in {:.1f}s, {} overruns'.format(ring.frames, time.monotonic() - start, ring.overruns))
+    ring.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='shared memory ring of samples')
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench', help='frames/s delivered to several subscribers')
+    bench_parser.add_argument('--subscribers', type=int, nargs='+', default=[1, 2, 4])
+    bench_parser.add_argument('--frames', type=int, default=100000)
+    bench_parser.add_argument('--size', type=int, default=1024, help='bytes per frame')
+    bench_parser.add_argument('--slots', type=int, default=256)
+    bench_parser.add_argument('--rate', type=float, default=0, help='frames/s published (default: as fast as possible)')
+    bench_parser.add_argument('--checksums', action='store_true', default=None, help='checksum every frame, as on CPUs without total store order')
+    subscribe_parser = commands.add_parser('subscribe', help='read a ring, printing the caps and the frame rate')
+    subscribe_parser.add_argument('name')
+    subscribe_parser.add_argument('--from-start', action='store_true', help='start with the oldest frame in the ring')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        bench(args.subscribers, args.frames, args.size, args.slots, args.rate, args.checksums)
+    else:
+        subscribe(args.name, args.from_start)
@@ -0,0 +1,381 @@
+import sys
+import time
+import argparse
+import threading
+
+import metrics
+from metrics import log
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst, GLib
+
+# Adds and removes branches of a tee in a running pipeline, without stopping
+# the other branches, e.g. a recorder on the tee of basic-tutorial-8.py.
+#
+#     branches = TeeBranches(pipeline, tee)
+#     branches.attach('recorder', 'audioconvert ! wavenc ! filesink location=out.wav')
+#     ...
+#     branches.detach('recorder')
+#     branches.report()
+#
+# attach() puts a queue in front of the description, adds the bin to the
+# pipeline, brings it to the state of the pipeline and only then links it to a
+# new request pad of the tee. The sinks of the new branch are made async=false
+# first: a sink prerolling asynchronously makes a running pipeline lose its
+# state, back to PAUSED until the sink has a buffer, which stalls every other
+# branch. TeeBranches(..., async_sinks=True) keeps the default for
+# comparison. detach() waits for the tee pad to be idle with a probe, unlinks
+# it and sends EOS into the branch. Once the EOS went through the sinks of the
+# branch, everything queued has been rendered: the branch is set to NULL,
+# removed and the request pad released.
+#
+# A GlitchMeter watches the sink of every other branch during the change: the
+# longest time between two buffers, beyond the duration of a buffer, and the
+# buffers missing from the timestamps.
+#
+#     python3 tee_branches.py --interval 0.5 --duration 10
+
+# Default seconds to wait for the EOS to drain a detached branch
+DRAIN_TIMEOUT = 5.0
+# Default seconds the other branches are still watched after a change, to see the gap it caused end
+SETTLE_TIME = 0.2
+
+class BranchError(Exception):
+    pass
+
+def branch_sink_pad(tee_pad):
+    # The sink pad of the last element of the branch behind a tee pad, looking through ghost pads
+    pad = tee_pad.get_peer()
+    while pad is not None:
+        if isinstance(pad, Gst.GhostPad) and pad.get_direction() == Gst.PadDirection.SINK:
+            # The sink ghost pad of a bin, continue with the pad inside it
+            target = pad.get_target()
+            if target is None:
+                return pad
+            pad = target
+            continue
+        element = pad.get_parent_element()
+        if element is None:
+            return pad
+        src_pads = [src_pad for src_pad in element.srcpads if src_pad.is_linked()]
+        if not src_pads:
+            return pad
+        pad = src_pads[0].get_peer()
+        parent = pad.get_parent()
+        if isinstance(parent, Gst.GhostPad):
+            # The inside of the src ghost pad of a bin, continue outside of it
+            pad = parent.get_peer()
+    return None
+
+class BranchGlitches():
+
+    def __init__(self, name):
+        self.name = name
+        self.buffers = 0
+        self.dropped = 0
+        self.discont = 0
+        self.max_gap = 0.0
+        self.duration = 0.0
+        self.last_arrival = None
+        self.next_pts = None
+
+    @property
+    def glitch(self):
+        # Time the branch went without data beyond the duration of a buffer
+        return max(0.0, self.max_gap - self.duration)
+
+class GlitchMeter():
+
+    def __init__(self):
+        self.branches = {}
+        self._probes = {}
+        self._lock = threading.Lock()
+
+    def watch(self, name, pad):
+        glitches = self.branches[name] = BranchGlitches(name)
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.add_probe
+        self._probes[name] = (pad, pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer, glitches))
+
+    def unwatch(self, name):
+        probe = self._probes.pop(name, None)
+        if probe is not None:
+            pad, probe_id = probe
+            pad.remove_probe(probe_id)
+        with self._lock:
+            self.branches.pop(name, None)
+
+    def on_buffer(self, pad, info, glitches):
+        now = time.monotonic()
+        buffer = info.get_buffer()
+        with self._lock:
+            glitches.buffers += 1
+            if glitches.last_arrival is not None:
+                glitches.max_gap = max(glitches.max_gap, now - glitches.last_arrival)
+            glitches.last_arrival = now
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.has_flags
+            if buffer.has_flags(Gst.BufferFlags.DISCONT):
+                glitches.discont += 1
+            if buffer.pts == Gst.CLOCK_TIME_NONE or buffer.duration == Gst.CLOCK_TIME_NONE or buffer.duration == 0:
+                glitches.next_pts = None
+                return Gst.PadProbeReturn.OK
+            glitches.duration = buffer.duration / Gst.SECOND
+            # More than half a buffer after the expected timestamp, count the buffers in between as dropped
+            if glitches.next_pts is not None and buffer.pts > glitches.next_pts + buffer.duration // 2:
+                glitches.dropped += (buffer.pts - glitches.next_pts + buffer.duration // 2) // buffer.duration
+            glitches.next_pts = buffer.pts + buffer.duration
+        return Gst.PadProbeReturn.OK
+
+    def begin(self):
+        # Starts a measuring window, keeping what is needed to measure the gap across its start
+        with self._lock:
+            for glitches in self.branches.values():
+                glitches.buffers = 0
+                glitches.dropped = 0
+                glitches.discont = 0
+                glitches.max_gap = 0.0
+
+    def end(self):
+        # Returns {branch: (glitch seconds, dropped buffers, discont buffers, buffers)} since begin()
+        with self._lock:
+            return {name: (glitches.glitch, glitches.dropped, glitches.discont, glitches.buffers)
+                    for name, glitches in self.branches.items()}
+
+class Branch():
+
+    def __init__(self, name, bin, tee_pad):
+        self.name = name
+        self.bin = bin
+        self.tee_pad = tee_pad
+        self.attached_at = time.monotonic()
+        # Seconds from attach() to the first buffer reaching the sink of the branch
+        self.first_buffer = None
+
+class TeeBranches():
+
+    def __init__(self, pipeline, tee, settle=SETTLE_TIME, async_sinks=False):
+        self.pipeline = pipeline
+        self.tee = tee
+        self.settle = settle
+        # Leave the sinks of attached branches to preroll asynchronously, as they would by default
+        self.async_sinks = async_sinks
+        self.branches = {}
+        self.meter = GlitchMeter()
+        # (change, {branch: (glitch seconds, dropped, discont, buffers)}, seconds the change took)
+        self.changes = []
+        self._lock = threading.Lock()
+
+        # The branches linked before, e.g. by link_request_pads in basic-tutorial-8.py, are watched too
+        for pad in tee.srcpads:
+            sink_pad = branch_sink_pad(pad) if pad.is_linked() else None
+            if sink_pad is not None:
+                self.meter.watch(pad.get_peer().get_parent_element().get_name(), sink_pad)
+
+    def request_pad(self):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.request_pad_simple
+        if hasattr(self.tee, 'request_pad_simple'):
+            return self.tee.request_pad_simple('src_%u')
+        return self.tee.get_request_pad('src_%u')
+
+    def measure(self, change, operation, name):
+        # Runs operation on the branch name, measuring the glitch it causes on the other branches
+        self.meter.begin()
+        start = time.monotonic()
+        result = operation()
+        took = time.monotonic() - start
+        # The gap caused by the change only ends with the next buffer of every branch
+        time.sleep(self.settle)
+        glitches = self.meter.end()
+        glitches.pop(name, None)
+        self.changes.append((change, glitches, took))
+        for name, (glitch, dropped, discont, buffers) in glitches.items():
+            metrics.REGISTRY.histogram('tee_branch_glitch_seconds', 'Time a branch went without data during a change of the tee',
+                                       branch=name).observe(glitch)
+            if dropped:
+                metrics.REGISTRY.counter('tee_branch_dropped_buffers_total', 'Buffers a branch lost during a change of the tee',
+                                         branch=name).inc(dropped)
+        log.info('{} took {:.1f}ms, {}'.format(change, took * 1e3, ', '.join(
+            '{} glitch {:.1f}ms dropped {}'.format(name, glitch * 1e3, dropped) for name, (glitch, dropped, discont, buffers) in sorted(glitches.items()))))
+        return result
+
+    def attach(self, name, description):
+        if name in self.branches or self.pipeline.get_by_name(name) is not None:
+            raise BranchError('there is already a branch named {}'.format(name))
+        return self.measure('attach {}'.format(name), lambda: self._attach(name, description), name)
+
+    def _attach(self, name, description):
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.parse_bin_from_description
+        try:
+            bin = Gst.parse_bin_from_description('queue name={}-queue ! {}'.format(name, description), True)
+        except GLib.Error as error:
+            raise BranchError('can not build branch {}: {}'.format(name, error.message))
+        bin.set_name(name)
+        if not self.async_sinks:
+            for sink in self.find_sinks(bin):
+                # https://gstreamer.freedesktop.org/documentation/base/gstbasesink.html#GstBaseSink:async
+                if sink.find_property('async') is not None:
+                    sink.set_property('async', False)
+            # Sinks created later inside sink bins like autoaudiosink still preroll asynchronously, keep that inside the branch
+            # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.props.async_handling
+            bin.set_property('async-handling', True)
+        self.pipeline.add(bin)
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.sync_state_with_parent
+        # Running before it is linked, so the first buffer from the tee does not hit a flushing pad
+        if not bin.sync_state_with_parent():
+            bin.set_state(Gst.State.NULL)
+            self.pipeline.remove(bin)
+            raise BranchError('branch {} can not change to the state of the pipeline'.format(name))
+
+        tee_pad = self.request_pad()
+        branch = Branch(name, bin, tee_pad)
+        sink_pad = bin.get_static_pad('sink')
+        if tee_pad.link(sink_pad) != Gst.PadLinkReturn.OK:
+            self.tee.release_request_pad(tee_pad)
+            bin.set_state(Gst.State.NULL)
+            self.pipeline.remove(bin)
+            raise BranchError('branch {} can not be linked to {}'.format(name, self.tee.get_name()))
+
+        last_pad = branch_sink_pad(tee_pad)
+        last_pad.add_probe(Gst.PadProbeType.BUFFER, self.on_first_buffer, branch)
+        with self._lock:
+            self.branches[name] = branch
+        self.meter.watch(name, last_pad)
+        return branch
+
+    def on_first_buffer(self, pad, info, branch):
+        branch.first_buffer = time.monotonic() - branch.attached_at
+        return Gst.PadProbeReturn.REMOVE
+
+    def detach(self, name, timeout=DRAIN_TIMEOUT):
+        # Returns True when the branch rendered everything it had queued before it was removed
+        with self._lock:
+            branch = self.branches.pop(name, None)
+        if branch is None:
+            raise BranchError('there is no branch named {}'.format(name))
+        self.meter.unwatch(name)
+        return self.measure('detach {}'.format(name), lambda: self._detach(branch, timeout), name)
+
+    def _detach(self, branch, timeout):
+        drained = threading.Event()
+        sinks = self.find_sinks(branch.bin)
+        remaining = [len(sinks)]
+        # The sinks of the branch can get their EOS in different streaming threads
+        remaining_lock = threading.Lock()
+        eos_probes = []
+
+        def on_eos(pad, info):
+            if info.get_event().type != Gst.EventType.EOS:
+                return Gst.PadProbeReturn.OK
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    drained.set()
+            # The sink would post EOS, which the pipeline would hold back until all its sinks are done
+            return Gst.PadProbeReturn.DROP
+
+        for sink in sinks:
+            for pad in sink.sinkpads:
+                eos_probes.append((pad, pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, on_eos)))
+        if not sinks:
+            drained.set()
+
+        def on_idle(pad, info):
+            # Between two pushes of the tee, no buffer of this pad is in flight
+            sink_pad = pad.get_peer()
+            if sink_pad is not None:
+                pad.unlink(sink_pad)
+                # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Pad.html#Gst.Pad.send_event
+                sink_pad.send_event(Gst.Event.new_eos())
+            return Gst.PadProbeReturn.REMOVE
+
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/flags.html#Gst.PadProbeType.IDLE
+        branch.tee_pad.add_probe(Gst.PadProbeType.IDLE, on_idle)
+        complete = drained.wait(timeout)
+        if not complete:
+            log.warning('{} did not drain within {}s, removing it anyway'.format(branch.name, timeout))
+
+        for pad, probe_id in eos_probes:
+            pad.remove_probe(probe_id)
+        branch.bin.set_state(Gst.State.NULL)
+        self.pipeline.remove(branch.bin)
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.release_request_pad
+        self.tee.release_request_pad(branch.tee_pad)
+        return complete
+
+    def cycle(self, name, description, interval, stopping):
+        # Attaches and detaches a branch every interval seconds until stopping is set, run it in a thread:
+        # detach() waits for the branch to drain, which must not hold up a main loop feeding the pipeline
+        try:
+            while not stopping.wait(interval):
+                if name in self.branches:
+                    self.detach(name)
+                else:
+                    self.attach(name, description)
+            if name in self.branches:
+                self.detach(name)
+        except BranchError as error:
+            log.error(error)
+
+    @staticmethod
+    def find_sinks(bin):
+        sinks = []
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Bin.html#Gst.Bin.iterate_sinks
+        iterator = bin.iterate_sinks()
+        while True:
+            result, element = iterator.next()
+            if result == Gst.IteratorResult.RESYNC:
+                iterator.resync()
+                sinks = []
+                continue
+            if result != Gst.IteratorResult.OK:
+                break
+            sinks.append(element)
+        return sinks
+
+    def report(self):
+        for change, glitches, took in self.changes:
+            print('{} took {:.1f}ms'.format(change, took * 1e3))
+            for name, (glitch, dropped, discont, buffers) in sorted(glitches.items()):
+                print('  {}: glitch {:.1f}ms, {} dropped, {} discont in {} buffers'.format(name, glitch * 1e3, dropped, discont, buffers))
+        for branch in self.branches.values():
+            if branch.first_buffer is not None:
+                print('{}: first buffer {:.1f}ms after attach'.format(branch.name, branch.first_buffer * 1e3))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='attach and detach a branch of a running tee, measuring the glitch on the other branches')
+    parser.add_argument('--source', default='audiotestsrc is-live=true samplesperbuffer=441', help='source in front of the tee')
+    parser.add_argument('--branch', default='audioconvert ! fakesink sync=true', help='branch kept during the changes')
+    parser.add_argument('--hot-plug', default='audioconvert ! wavenc ! fakesink sync=true', help='branch attached and detached')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between two changes')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds to run for')
+    parser.add_argument('--async-sinks', action='store_true', help='let the attached sinks preroll asynchronously, to compare the glitches')
+    args = parser.parse_args()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
+    print('initializing Gst...')
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics.serve_from_env()
+
+    pipeline = Gst.parse_launch('{} ! tee name=tee ! queue name=steady ! {}'.format(args.source, args.branch))
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        print('failed to play')
+        pipeline.set_state(Gst.State.NULL)
+        sys.exit(1)
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Element.html#Gst.Element.get_state
+    pipeline.get_state(Gst.CLOCK_TIME_NONE)
+
+    branches = TeeBranches(pipeline, pipeline.get_by_name('tee'), async_sinks=args.async_sinks)
+    stopping = threading.Event()
+    changer = threading.Thread(target=branches.cycle, args=('hot-plug', args.hot_plug, args.interval, stopping), daemon=True)
+    changer.start()
+    try:
+        gst_message = pipeline.get_bus().timed_pop_filtered(int(args.duration * Gst.SECOND), Gst.MessageType.ERROR | Gst.MessageType.EOS)
+        if gst_message is not None and gst_message.type == Gst.MessageType.ERROR:
+            gerror, debug = gst_message.parse_error()
+            print('error {} happened at {}'.format(gerror.message, debug))
+    except KeyboardInterrupt:
+        pass
+    stopping.set()
+    changer.join()
+    pipeline.set_state(Gst.State.NULL)
+    branches.report()
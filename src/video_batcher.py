@@ -0,0 +1,392 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+import collections
+import numpy as np
+
+import metrics
+from metrics import log
+import gst_bootstrap
+# Imported on first use, see gst_bootstrap.py
+from gst_bootstrap import Gst, GstVideo
+
+# Raw video frames from an appsink, in batches for inference.
+#
+# VideoBatcher owns a bin of videoconvert ! videoscale ! appsink with fixed
+# caps, e.g. RGB 224x224, to link behind the videotestsrc of
+# basic-tutorial-2.py or the video pad uridecodebin adds in basic-tutorial-3.py.
+# Each frame is copied once, row by row to drop the stride padding, into a
+# slot of a preallocated batch. A full batch is handed out as one
+# (N, H, W, C) uint8 array along with the PTS of its frames:
+#
+#     batcher = VideoBatcher(batch_size=8, format='RGB', width=224, height=224, policy='drop-oldest')
+#     pipeline.add(batcher.bin)
+#     source.link(batcher.bin)
+#     ...
+#     batch = batcher.get(timeout=1.0)
+#     with batch:
+#         run_inference(batch.frames, batch.pts)
+#
+# A batch must be released, by leaving the with block or calling release(),
+# before its memory is reused. When all batches are full or handed out, the
+# policy decides: 'block' holds the streaming thread until one is released,
+# slowing the decoder down to the speed of the inference, 'drop-oldest'
+# overwrites the oldest batch waiting to be handed out, so the decoder never
+# stalls and the inference gets the newest frames.
+#
+# NV12 frames come as (N, H * 3 / 2, W, 1): the Y plane followed by the
+# interleaved UV plane, as most inference runtimes take them.
+
+# Channels of the packed formats, and NV12
+VIDEO_FORMATS = {'RGB': 3, 'BGR': 3, 'RGBA': 4, 'BGRA': 4, 'RGBx': 4, 'BGRx': 4, 'GRAY8': 1, 'NV12': 1}
+POLICIES = ('drop-oldest', 'block')
+
+class BatchError(Exception):
+    pass
+
+def video_info(caps):
+    # https://lazka.github.io/pgi-docs/#GstVideo-1.0/classes/VideoInfo.html#GstVideo.VideoInfo.new_from_caps
+    if hasattr(GstVideo.VideoInfo, 'new_from_caps'):
+        return GstVideo.VideoInfo.new_from_caps(caps)
+    info = GstVideo.VideoInfo()
+    if not info.from_caps(caps):
+        return None
+    return info
+
+class FrameLayout():
+
+    def __init__(self, format, width, height, strides, offsets):
+        self.format = format
+        self.width = width
+        self.height = height
+        # (offset, stride, rows, row bytes) of each plane in a buffer
+        if format == 'NV12':
+            if width % 2 or height % 2:
+                raise BatchError('NV12 batches need an even width and height, not {}x{}'.format(width, height))
+            self.planes = [(offsets[0], strides[0], height, width), (offsets[1], strides[1], height // 2, width)]
+            self.shape = (height * 3 // 2, width, 1)
+        else:
+            channels = VIDEO_FORMATS[format]
+            self.planes = [(offsets[0], strides[0], height, width * channels)]
+            self.shape = (height, width, channels)
+
+    @classmethod
+    def from_caps(cls, caps):
+        structure = caps.get_structure(0)
+        format = structure.get_string('format')
+        if format not in VIDEO_FORMATS:
+            raise BatchError('{} frames can not be batched'.format(format))
+        info = video_info(caps)
+        if info is None:
+            raise BatchError('can not parse {}'.format(caps.to_string()))
+        return cls(format, info.width, info.height, list(info.stride), list(info.offset))
+
+    def copy(self, data, slot):
+        # Copies the planes of a mapped buffer into a (H, W, C) slot, skipping the padding at the end of the rows
+        flat = slot.reshape(-1)
+        position = 0
+        for offset, stride, rows, row_bytes in self.planes:
+            plane = np.ndarray((rows, row_bytes), dtype=np.uint8, buffer=data, offset=offset, strides=(stride, 1))
+            flat[position:position + rows * row_bytes].reshape(rows, row_bytes)[:] = plane
+            position += rows * row_bytes
+
+class Batch():
+
+    def __init__(self, batcher, index, generation, frames, pts):
+        self._batcher = batcher
+        self.index = index
+        self.generation = generation
+        # (N, H, W, C) and (N,) views of the batch memory, valid until release()
+        self.frames = frames
+        self.pts = pts
+
+    def __len__(self):
+        return len(self.pts)
+
+    def release(self):
+        if self._batcher is not None:
+            self._batcher.release(self.index, self.generation)
+            self._batcher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class VideoBatcher():
+
+    def __init__(self, batch_size=8, format='RGB', width=None, height=None, batches=4, policy='drop-oldest', sync=False, name=None):
+        if format not in VIDEO_FORMATS:
+            raise BatchError('format must be one of {}'.format(', '.join(VIDEO_FORMATS)))
+        if policy not in POLICIES:
+            raise BatchError('policy must be one of {}'.format(', '.join(POLICIES)))
+        self.batch_size = batch_size
+        self.format = format
+        self.width = width
+        self.height = height
+        # Batches preallocated, at least one filling and one handed out
+        self.batches = max(2, batches)
+        self.policy = policy
+
+        self.layout = None
+        self._caps = None
+        # Bumped when the batches are reallocated, batches handed out before are not reused
+        self._generation = 0
+        self._out = set()
+        self._frames = None
+        self._pts = None
+        # Indices of the batches free to fill, filled and waiting for get(), and the one being filled
+        self._free = collections.deque()
+        self._ready = collections.deque()
+        self._filling = None
+        self._count = 0
+        self._eos = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self.frames_in = 0
+        self.frames_dropped = 0
+        self.batches_out = 0
+
+        caps = 'video/x-raw, format=(string){}'.format(format)
+        if width:
+            caps += ', width=(int){}'.format(width)
+        if height:
+            caps += ', height=(int){}'.format(height)
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.parse_bin_from_description
+        self.bin = Gst.parse_bin_from_description(
+            'videoconvert ! videoscale ! appsink name=batch_sink caps="{}" sync={} max-buffers=2 emit-signals=true'.format(
+                caps, 'true' if sync else 'false'), True)
+        if name is not None:
+            self.bin.set_name(name)
+        self.app_sink = self.bin.get_by_name('batch_sink')
+        # https://lazka.github.io/pgi-docs/#GstApp-1.0/classes/AppSink.html#GstApp.AppSink.signals.new_sample
+        self.app_sink.connect('new-sample', self.on_new_sample)
+        self.app_sink.connect('eos', self.on_eos)
+
+        self._frames_total = metrics.REGISTRY.counter('video_batcher_frames_total', 'Frames pulled by the video batcher')
+        self._blocked = metrics.REGISTRY.histogram('video_batcher_block_seconds', 'Time the streaming thread waited for a free batch')
+
+    def allocate(self, layout):
+        # Called with the condition held, on the first frame and when the geometry changes:
+        # the frames not handed out yet have the old geometry and are dropped
+        self.frames_dropped += self._count + sum(count for index, count in self._ready)
+        self.layout = layout
+        self._frames = np.empty((self.batches, self.batch_size) + layout.shape, dtype=np.uint8)
+        self._pts = np.empty((self.batches, self.batch_size), dtype=np.uint64)
+        # Batches already handed out keep the memory they were given
+        self._generation += 1
+        self._out = set()
+        self._free = collections.deque(range(self.batches))
+        self._ready.clear()
+        self._filling = None
+        log.info('allocated {} batches of {} {} frames of {}x{}, {:.1f}MB'.format(
+            self.batches, self.batch_size, layout.format, layout.width, layout.height, self._frames.nbytes / 1024 / 1024))
+
+    def _complete(self):
+        self._ready.append((self._filling, self._count))
+        self._filling = None
+        self._count = 0
+        self._condition.notify_all()
+
+    def _next_slot(self):
+        # Returns False when the frame has to be dropped
+        if self._filling is not None:
+            return True
+        if not self._free and self.policy == 'block':
+            start = time.monotonic()
+            while not self._free and not self._eos and not self._closed:
+                self._condition.wait(0.1)
+            self._blocked.observe(time.monotonic() - start)
+        if not self._free and self.policy == 'drop-oldest' and self._ready:
+            index, count = self._ready.popleft()
+            self.frames_dropped += count
+            metrics.REGISTRY.counter('video_batcher_dropped_frames_total', 'Frames dropped by the video batcher').inc(count)
+            self._free.append(index)
+        if not self._free:
+            # Every batch is handed out, nothing can be overwritten
+            return False
+        self._filling = self._free.popleft()
+        self._count = 0
+        return True
+
+    def on_new_sample(self, app_sink):
+        # https://lazka.github.io/pgi-docs/#GstApp-1.0/classes/AppSink.html#GstApp.AppSink.signals.pull_sample
+        sample = app_sink.emit('pull-sample')
+        if sample is None:
+            return Gst.FlowReturn.ERROR
+        buffer = sample.get_buffer()
+        with self._condition:
+            self.frames_in += 1
+            self._frames_total.inc()
+            caps = sample.get_caps()
+            if self.layout is None or not caps.is_equal(self._caps):
+                self._caps = caps
+                try:
+                    self.allocate(FrameLayout.from_caps(caps))
+                except BatchError as error:
+                    log.error(error)
+                    return Gst.FlowReturn.NOT_NEGOTIATED
+            if not self._next_slot():
+                self.frames_dropped += 1
+                metrics.REGISTRY.counter('video_batcher_dropped_frames_total', 'Frames dropped by the video batcher').inc()
+                return Gst.FlowReturn.OK
+            index, position = self._filling, self._count
+
+        # https://lazka.github.io/pgi-docs/#Gst-1.0/classes/Buffer.html#Gst.Buffer.map
+        success, info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            log.error('failed to map the frame')
+            return Gst.FlowReturn.ERROR
+        data = memoryview(info.data)
+        try:
+            # The slot is only written by this thread until the batch is complete
+            self.layout.copy(data, self._frames[index, position])
+        finally:
+            data.release()
+            buffer.unmap(info)
+
+        with self._condition:
+            if self._filling != index:
+                # The geometry changed meanwhile, the slot belongs to memory nobody will read
+                return Gst.FlowReturn.OK
+            self._pts[index, position] = buffer.pts
+            self._count += 1
+            if self._count == self.batch_size:
+                self._complete()
+        return Gst.FlowReturn.OK
+
+    def on_eos(self, app_sink):
+        # The last, partial, batch is handed out too
+        with self._condition:
+            if self._filling is not None and self._count:
+                self._complete()
+            self._eos = True
+            self._condition.notify_all()
+
+    def get(self, timeout=None):
+        # Returns the oldest full batch, None on timeout or once the last batch after EOS was handed out
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while not self._ready:
+                if self._eos:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            index, count = self._ready.popleft()
+            self._out.add(index)
+            self.batches_out += 1
+            return Batch(self, index, self._generation, self._frames[index, :count], self._pts[index, :count])
+
+    def release(self, index, generation):
+        with self._condition:
+            if generation != self._generation or index not in self._out:
+                return
+            self._out.discard(index)
+            self._free.append(index)
+            self._condition.notify_all()
+
+    @property
+    def eos(self):
+        with self._condition:
+            return self._eos and not self._ready
+
+    def close(self):
+        # Call before stopping the pipeline, so that a streaming thread blocked for a free batch returns
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def reset(self):
+        # After a flushing seek, the frames batched so far are dropped and get() can be called again
+        with self._condition:
+            self._ready.clear()
+            self._filling = None
+            self._count = 0
+            self._eos = False
+            if self._frames is not None:
+                self._free = collections.deque(index for index in range(self.batches) if index not in self._out)
+
+    def report(self):
+        print('{} frames in, {} handed out in {} batches, {} dropped ({})'.format(
+            self.frames_in, self.frames_in - self.frames_dropped, self.batches_out, self.frames_dropped, self.policy))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='batch the frames of videotestsrc, or of a media file, for inference')
+    parser.add_argument('path', nargs='?', default=None, help='media file or uri, decoded with uridecodebin (default: videotestsrc)')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--batches', type=int, default=4, help='batches preallocated')
+    parser.add_argument('--format', choices=sorted(VIDEO_FORMATS), default='RGB')
+    parser.add_argument('--width', type=int, default=224)
+    parser.add_argument('--height', type=int, default=224)
+    parser.add_argument('--policy', choices=POLICIES, default='drop-oldest')
+    parser.add_argument('--inference-time', type=float, default=0.05, help='seconds the simulated inference takes per batch')
+    parser.add_argument('--num-buffers', type=int, default=300, help='frames of videotestsrc')
+    args = parser.parse_args()
+
+    # https://lazka.github.io/pgi-docs/#Gst-1.0/functions.html#Gst.init
+    print('initializing Gst...')
+    gst_bootstrap.init()
+    metrics.configure_logging()
+    metrics.serve_from_env()
+
+    batcher = VideoBatcher(args.batch_size, args.format, args.width, args.height, args.batches, args.policy)
+    pipeline = Gst.Pipeline.new('batch-pipeline')
+    pipeline.add(batcher.bin)
+    if args.path is None:
+        # The source of basic-tutorial-2.py
+        source = Gst.ElementFactory.make('videotestsrc', 'source')
+        source.set_property('num-buffers', args.num_buffers)
+        pipeline.add(source)
+        source.link(batcher.bin)
+    else:
+        # The source of basic-tutorial-3.py, linking its video pad only
+        uri = args.path if Gst.uri_is_valid(args.path) else Gst.filename_to_uri(os.path.abspath(args.path))
+        source = Gst.ElementFactory.make('uridecodebin', 'source')
+        source.set_property('uri', uri)
+        pipeline.add(source)
+
+        def pad_added_handler(src, new_pad):
+            sink_pad = batcher.bin.get_static_pad('sink')
+            caps = new_pad.get_current_caps() or new_pad.query_caps(None)
+            if not sink_pad.is_linked() and caps.get_structure(0).get_name().startswith('video/x-raw'):
+                new_pad.link(sink_pad)
+        source.connect('pad-added', pad_added_handler)
+
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        print('failed to play')
+        pipeline.set_state(Gst.State.NULL)
+        sys.exit(1)
+
+    bus = pipeline.get_bus()
+    start = time.monotonic()
+    try:
+        while True:
+            batch = batcher.get(timeout=0.1)
+            if batch is None:
+                gst_message = bus.pop_filtered(Gst.MessageType.ERROR)
+                if gst_message is not None:
+                    gerror, debug = gst_message.parse_error()
+                    print('error {} happened at {}'.format(gerror.message, debug))
+                    break
+                if batcher.eos:
+                    break
+                continue
+            with batch:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug('batch of {} {}, pts {:.3f}s to {:.3f}s'.format(
+                        len(batch), batch.frames.shape, batch.pts[0] / Gst.SECOND, batch.pts[-1] / Gst.SECOND))
+                time.sleep(args.inference_time)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.monotonic() - start
+    batcher.close()
+    pipeline.set_state(Gst.State.NULL)
+    batcher.report()
+    print('{:.1f} frames/s decoded, {:.1f} frames/s batched'.format(
+        batcher.frames_in / elapsed, (batcher.frames_in - batcher.frames_dropped) / elapsed))
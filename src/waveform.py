@@ -0,0 +1,134 @@
+import sys
+import time
+import numpy as np
+
+# Waveform generator used by basic-tutorial-8.py to feed appsrc.
+#
+# The tutorial's oscillator is the recurrence
+#     c += d; d -= c / 1000; freq = 1100 + 1000 * d     (once per chunk)
+#     a += b; b -= a / freq; sample = 500 * a           (once per sample)
+# Within a chunk freq is constant, so (a, b) evolves by a fixed 2x2 matrix M
+# with det(M) == 1. Its n-th power has the closed form
+#     M^n = (sin(n * theta) * M - sin((n - 1) * theta) * I) / sin(theta)
+# where cos(theta) = trace(M) / 2, which lets us compute a whole chunk with
+# a handful of NumPy calls instead of a Python loop per sample.
+#
+# Run this file directly to measure samples/second of both implementations:
+#     python3 waveform.py [chunk_size_in_bytes ...]
+
+# S16 samples are 2 bytes wide
+BYTES_PER_SAMPLE = 2
+AMPLITUDE = 500
+
+class WaveformGenerator():
+
+    def __init__(self):
+        # Oscillator state, carried across chunks
+        self.a = 0.0
+        self.b = 1.0
+        self.c = 0.0
+        self.d = 1.0
+
+        # Scratch arrays, reallocated only when the chunk size changes
+        self._num_samples = 0
+        self._n = None
+        self._phase = None
+        self._tmp = None
+        self._tmp2 = None
+
+    def _prepare(self, num_samples):
+        if self._num_samples == num_samples:
+            return
+        self._num_samples = num_samples
+        self._n = np.arange(num_samples + 1, dtype=np.float64)
+        self._phase = np.empty(num_samples + 1, dtype=np.float64)
+        self._tmp = np.empty(num_samples, dtype=np.float64)
+        self._tmp2 = np.empty(num_samples, dtype=np.float64)
+
+    def _next_freq(self):
+        self.c += self.d
+        self.d -= self.c / 1000
+        return 1100 + 1000 * self.d
+
+    def fill(self, out):
+        # Write len(out) samples into out, which must be a writable int16 array.
+        # It can be a view of a mapped Gst.MapInfo, so nothing is copied.
+        num_samples = len(out)
+        if num_samples == 0:
+            return
+        freq = self._next_freq()
+
+        cos_theta = 1 - 1 / (2 * freq)
+        if not -1 < cos_theta < 1:
+            # M is not a rotation for this freq, the closed form does not hold
+            self._fill_samples(out, freq)
+            return
+
+        self._prepare(num_samples)
+        theta = np.arccos(cos_theta)
+        sin_theta = np.sin(theta)
+        a0 = self.a
+        b0 = self.b
+
+        # phase[n] = sin(n * theta) for n = 0 .. num_samples
+        phase = self._phase
+        np.multiply(self._n, theta, out=phase)
+        np.sin(phase, out=phase)
+
+        # a_n = (sin(n * theta) * (a0 + b0) - sin((n - 1) * theta) * a0) / sin(theta)
+        tmp = self._tmp
+        np.multiply(phase[1:], AMPLITUDE * (a0 + b0) / sin_theta, out=tmp)
+        np.multiply(phase[:-1], AMPLITUDE * a0 / sin_theta, out=self._tmp2)
+        tmp -= self._tmp2
+        np.clip(tmp, -32768, 32767, out=tmp)
+        np.copyto(out, tmp, casting='unsafe')
+
+        s_n = phase[num_samples]
+        s_n1 = phase[num_samples - 1]
+        self.a = (s_n * (a0 + b0) - s_n1 * a0) / sin_theta
+        self.b = (s_n * (b0 - (a0 + b0) / freq) - s_n1 * b0) / sin_theta
+
+    def fill_loop(self, out):
+        # The original per-sample implementation, kept as a reference
+        freq = self._next_freq()
+        self._fill_samples(out, freq)
+
+    def _fill_samples(self, out, freq):
+        for i in range(len(out)):
+            self.a += self.b
+            self.b -= self.a / freq
+            out[i] = max(-32768, min(32767, int(AMPLITUDE * self.a)))
+
+def measure(fill, chunk_size, seconds):
+    out = np.zeros(chunk_size // BYTES_PER_SAMPLE, dtype=np.int16)
+    generated = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        fill(out)
+        generated += len(out)
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+    return generated / (now - start)
+
+if __name__ == '__main__':
+    chunk_sizes = [int(arg) for arg in sys.argv[1:]] or [1024, 4096, 65536]
+
+    print('checking that both implementations agree...')
+    vectorized = WaveformGenerator()
+    reference = WaveformGenerator()
+    for chunk_size in chunk_sizes:
+        out = np.zeros(chunk_size // BYTES_PER_SAMPLE, dtype=np.int16)
+        expected = np.zeros_like(out)
+        for i in range(10):
+            vectorized.fill(out)
+            reference.fill_loop(expected)
+        print('chunk_size = {}, max abs difference = {}'.format(
+            chunk_size, np.max(np.abs(out.astype(np.int32) - expected))))
+
+    for chunk_size in chunk_sizes:
+        loop_rate = measure(WaveformGenerator().fill_loop, chunk_size, 1.0)
+        vectorized_rate = measure(WaveformGenerator().fill, chunk_size, 1.0)
+        print('chunk_size = {}: loop {:.0f} samples/s, vectorized {:.0f} samples/s ({:.1f}x)'.format(
+            chunk_size, loop_rate, vectorized_rate, vectorized_rate / loop_rate))
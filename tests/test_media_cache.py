@@ -0,0 +1,127 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import http.server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import media_cache
+
+# Tests of media_cache.py against a local HTTP server standing in for the
+# remote media, no network needed:
+#
+#     python3 -m unittest discover tests
+
+# path -> body served by the stand-in
+MEDIA = {
+    '/a.webm': b'a' * 1000,
+    '/same-as-a.webm': b'a' * 1000,
+    '/b.webm': b'b' * 1000,
+    '/c.webm': b'c' * 1000,
+}
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+
+    # Paths requested so far, shared by the handlers of the server
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        body = MEDIA.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MediaCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='media-cache-test-')
+        MediaHandler.requests.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def cache(self, **kwargs):
+        return media_cache.MediaCache(self.directory, timeout=5, **kwargs)
+
+    def objects(self):
+        return sorted(name for root, dirs, names in os.walk(os.path.join(self.directory, 'objects')) for name in names)
+
+    def test_hit_does_not_download_again(self):
+        cache = self.cache()
+        first = cache.resolve(self.base + '/a.webm')
+        second = cache.resolve(self.base + '/a.webm')
+        self.assertEqual(first, second)
+        self.assertEqual(MediaHandler.requests, ['/a.webm'])
+        self.assertTrue(first.startswith('file://'))
+
+    def test_same_content_is_stored_once(self):
+        cache = self.cache()
+        a = cache.resolve(self.base + '/a.webm')
+        same = cache.resolve(self.base + '/same-as-a.webm')
+        self.assertEqual(a, same)
+        self.assertEqual(len(self.objects()), 1)
+        self.assertEqual(len(cache.entries()), 2)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = self.cache(max_bytes=2500)
+        cache.resolve(self.base + '/a.webm')
+        cache.resolve(self.base + '/b.webm')
+        # a becomes more recently used than b
+        cache.resolve(self.base + '/a.webm')
+        cache.resolve(self.base + '/c.webm')
+        cached = [uri for uri, digest, size in cache.entries()]
+        self.assertEqual(cached, [self.base + '/a.webm', self.base + '/c.webm'])
+        self.assertEqual(len(self.objects()), 2)
+
+    def test_offline_miss(self):
+        cache = self.cache(offline=True)
+        with self.assertRaises(media_cache.CacheMissError):
+            cache.resolve(self.base + '/a.webm')
+        self.assertEqual(MediaHandler.requests, [])
+
+    def test_offline_hit(self):
+        self.cache().resolve(self.base + '/a.webm')
+        self.assertTrue(self.cache(offline=True).resolve(self.base + '/a.webm').startswith('file://'))
+
+    def test_http_error(self):
+        with self.assertRaises(media_cache.FetchError):
+            self.cache().resolve(self.base + '/missing.webm')
+        # No partial download is left behind
+        self.assertEqual(self.objects(), [])
+
+    def test_unreachable_server(self):
+        # A port nothing listens on once the socket is closed
+        probe = http.server.HTTPServer(('127.0.0.1', 0), MediaHandler)
+        port = probe.server_address[1]
+        probe.server_close()
+        with self.assertRaises(media_cache.CacheError):
+            self.cache().resolve('http://127.0.0.1:{}/a.webm'.format(port))
+
+    def test_local_uri_is_unchanged(self):
+        self.assertEqual(self.cache().resolve('file:///tmp/a.webm'), 'file:///tmp/a.webm')
+
+if __name__ == '__main__':
+    unittest.main()